@@ -0,0 +1,54 @@
+from typing import Optional
+
+from fastapi import Depends, HTTPException, Query, Request
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.core.database import get_read_db, get_async_read_db, replica_router
+from app.core.pagination import PageParams, decode_cursor, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from app.core.table_versions import current_versions, etag_matches, make_etag
+
+
+def page_params(limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                cursor: Optional[str] = Query(None, description="next_cursor of the previous page")) -> PageParams:
+    if cursor is None:
+        return PageParams(limit)
+    try:
+        return PageParams(limit, decode_cursor(cursor))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def _check_etag(request: Request, versions):
+    etag = make_etag(request, versions)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        raise HTTPException(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+    # Sent with the response by ETagMiddleware
+    request.state.etag = etag
+
+
+def conditional_get(*tables: str):
+    """
+    Dependency for GET routes whose response only depends on their query parameters and on tables.
+    Answers 304 Not Modified when the client's If-None-Match still matches, without running the route.
+    The versions are read through the route's own session, so the routes take theirs from get_read_db,
+    which keeps them on the primary for a while after this worker wrote to tables.
+    """
+    replica_router.watch(tables)
+
+    def check(request: Request, db: Session = Depends(get_read_db)):
+        _check_etag(request, current_versions(db, tables))
+
+    return check
+
+
+def async_conditional_get(*tables: str):
+    """
+    conditional_get for the routes of the async routers.
+    """
+    replica_router.watch(tables)
+
+    async def check(request: Request, db: AsyncSession = Depends(get_async_read_db)):
+        _check_etag(request, await db.run_sync(current_versions, tables))
+
+    return check
@@ -1,16 +1,27 @@
 from datetime import datetime
-from typing import Optional
+from typing import List, Literal, Optional
 
 from fastapi import APIRouter, Depends
 from fastapi import HTTPException
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from app.core.admin_approval import unapproved_users, do_approve_user, do_reject_user
-from app.core.database import get_db
-from app.models.user import User
+from app.api.dependencies import page_params, conditional_get, async_conditional_get
+from app.core.admin_approval import unapproved_users, do_approve_user, do_reject_user, bulk_decide_users, \
+    generate_credentials_async, pending_user_ids
+from app.core.database import get_db, get_async_db, get_read_db, get_async_read_db
+from app.core.pagination import PageParams, next_cursor
+from app.core.users_db import get_users_page
+from app.core.responses import FastJSONResponse
+from app.models.user import User, UserStatus
+
+# The user lists only read the users table
+NOT_MODIFIED = [Depends(conditional_get("users"))]
+ASYNC_NOT_MODIFIED = [Depends(async_conditional_get("users"))]
 
 approve_users = APIRouter()
+async_approve_users = APIRouter()
 
 
 class UserResponse(BaseModel):
@@ -28,31 +39,55 @@ class UserResponse(BaseModel):
 
     @staticmethod
     def from_alchemy(user: User):
-        return UserResponse(
-            id=user.id,
-            first_name=user.first_name,
-            last_name=user.last_name,
-            phone_number=user.phone_number,
-            address=user.address,
-            profile_picture=user.profile_picture,
-            city_id=user.city_id,
-            user_type_id=user.user_type_id,
-            status_id=user.status_id,
-            approved_at=user.approved_at,
-            created_at=user.created_at
-        )
+        # The columns were validated on the way into the database, so skip validation
+        return UserResponse.model_construct(**user_response_row(user))
+
+
+def user_response_row(user: User) -> dict:
+    """
+    The UserResponse fields of user as a plain dict, for pages that skip building the models.
+    """
+    return {field: getattr(user, field) for field in UserResponse.model_fields}
+
+
+class BulkDecision(BaseModel):
+    user_ids: List[str] = Field(..., min_length=1, max_length=1000)
+    decision: Literal["approve", "reject"]
+    approved_by_id: Optional[str] = None
+
+
+def _bulk_result(decision: BulkDecision, users: List[User]):
+    updated = {user.id for user in users}
+    return FastJSONResponse({
+        "updated": [user_response_row(user) for user in users],
+        # Users that do not exist or were no longer pending
+        "skipped": [user_id for user_id in dict.fromkeys(decision.user_ids) if user_id not in updated],
+    })
 
 
-@approve_users.get("/all_users")
-def get_all_users(db: Session = Depends(get_db)):
-    users = User.get_users(db)
-    return [UserResponse.from_alchemy(user) for user in users]
+def _users_page(users, page: PageParams):
+    return FastJSONResponse({
+        "items": [user_response_row(user) for user in users],
+        "next_cursor": next_cursor(users, page, lambda user: (user.created_at, user.id)),
+    })
 
 
-@approve_users.get("/unapproved")
-def get_unapproved_users(db: Session = Depends(get_db)):
-    users = unapproved_users(db)
-    return [UserResponse.from_alchemy(user) for user in users]
+@approve_users.get("/all_users", dependencies=NOT_MODIFIED)
+def get_all_users(page: PageParams = Depends(page_params), db: Session = Depends(get_read_db)):
+    users = get_users_page(db, page)
+    return _users_page(users, page)
+
+
+@approve_users.get("/unapproved", dependencies=NOT_MODIFIED)
+def get_unapproved_users(page: PageParams = Depends(page_params), db: Session = Depends(get_read_db)):
+    users = unapproved_users(db, page)
+    return _users_page(users, page)
+
+
+@approve_users.post("/bulk")
+def bulk_decide(decision: BulkDecision, db: Session = Depends(get_db)):
+    users = bulk_decide_users(db, decision.user_ids, decision.decision, decision.approved_by_id)
+    return _bulk_result(decision, users)
 
 
 @approve_users.post("/{user_id}/approve", response_model=UserResponse)
@@ -69,3 +104,52 @@ def reject_user(user_id: str, db: Session = Depends(get_db)):
     if user:
         return UserResponse.from_alchemy(user)
     raise HTTPException(status_code=404, detail="User not found")
+
+
+@async_approve_users.get("/all_users", dependencies=ASYNC_NOT_MODIFIED)
+async def get_all_users_async(page: PageParams = Depends(page_params), db: AsyncSession = Depends(get_async_read_db)):
+    users = await db.run_sync(get_users_page, page)
+    return _users_page(users, page)
+
+
+@async_approve_users.get("/unapproved", dependencies=ASYNC_NOT_MODIFIED)
+async def get_unapproved_users_async(page: PageParams = Depends(page_params),
+                                     db: AsyncSession = Depends(get_async_read_db)):
+    users = await db.run_sync(unapproved_users, page)
+    return _users_page(users, page)
+
+
+@async_approve_users.post("/bulk")
+async def bulk_decide_async(decision: BulkDecision, db: AsyncSession = Depends(get_async_db)):
+    credentials = None
+    if decision.decision == "approve":
+        # Hash outside run_sync, which runs on the event loop, and only for the users that can be approved
+        user_ids = await db.run_sync(pending_user_ids, decision.user_ids)
+        # Return the connection to the pool instead of leaving it idle in transaction while hashing
+        await db.rollback()
+        credentials = dict(zip(user_ids, await generate_credentials_async(len(user_ids))))
+    users = await db.run_sync(bulk_decide_users, decision.user_ids, decision.decision, decision.approved_by_id,
+                              credentials)
+    return _bulk_result(decision, users)
+
+
+@async_approve_users.post("/{user_id}/approve", response_model=UserResponse)
+async def approve_user_async(user_id: str, db: AsyncSession = Depends(get_async_db)):
+    # Only hash for users that exist and are not approved yet
+    user = await db.run_sync(User.get_user, user_id)
+    if user and user.status_id != UserStatus.APPROVED:
+        # Return the connection to the pool while hashing, outside run_sync, which runs on the event loop
+        await db.rollback()
+        credentials = (await generate_credentials_async(1))[0]
+        user = await db.run_sync(do_approve_user, user_id, credentials)
+    if user:
+        return UserResponse.from_alchemy(user)
+    raise HTTPException(status_code=404, detail="User not found")
+
+
+@async_approve_users.post("/{user_id}/reject", response_model=UserResponse)
+async def reject_user_async(user_id: str, db: AsyncSession = Depends(get_async_db)):
+    user = await db.run_sync(do_reject_user, user_id)
+    if user:
+        return UserResponse.from_alchemy(user)
+    raise HTTPException(status_code=404, detail="User not found")
@@ -1,34 +1,110 @@
+from typing import List, Literal, Optional
+
 from dateutil import parser
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from app.core.adminview_db import city_count, status_count, type_count, request_completion_time
-from app.core.database import get_db
+from app.api.dependencies import conditional_get, async_conditional_get
+from app.core.adminview_db import city_count, status_count, type_count, request_completion_time, dashboard_summary, \
+    request_completion_stats
+from app.core.cache import dashboard_cache
+from app.core.database import get_read_db, get_async_read_db
+
+# Tables the dashboard results are computed from. Polls get a 304 while none of them changed
+DASHBOARD_TABLES = ("requests", "request_process", "request_daily_rollup", "cities", "request_types",
+                    "request_status")
+NOT_MODIFIED = [Depends(conditional_get(*DASHBOARD_TABLES))]
+ASYNC_NOT_MODIFIED = [Depends(async_conditional_get(*DASHBOARD_TABLES))]
 
 dashboard_router = APIRouter()
+async_dashboard_router = APIRouter()
 
 
-@dashboard_router.get("/city-count")
+@dashboard_router.get("/city-count", dependencies=NOT_MODIFIED)
 def get_city_count(start_date: str, end_date: str, status: str = None, request_type: str = None, city: str = None,
-                   db: Session = Depends(get_db)):
+                   db: Session = Depends(get_read_db)):
     return city_count(db, parser.parse(start_date), parser.parse(end_date), status, request_type, city)
 
 
-@dashboard_router.get("/status-count")
+@dashboard_router.get("/status-count", dependencies=NOT_MODIFIED)
 def get_status_count(start_date: str, end_date: str, status: str = None, request_type: str = None, city: str = None,
-                     db: Session = Depends(get_db)):
+                     db: Session = Depends(get_read_db)):
     return status_count(db, parser.parse(start_date), parser.parse(end_date), status, request_type, city)
 
 
-@dashboard_router.get("/type-count")
+@dashboard_router.get("/type-count", dependencies=NOT_MODIFIED)
 def get_type_count(start_date: str, end_date: str, status: str = None, request_type: str = None, city: str = None,
-                   db: Session = Depends(get_db)):
+                   db: Session = Depends(get_read_db)):
     return type_count(db, parser.parse(start_date), parser.parse(end_date), status, request_type, city)
 
 
-@dashboard_router.get("/request-completion-time")
+@dashboard_router.get("/summary", dependencies=NOT_MODIFIED)
+def get_summary(start_date: str, end_date: str, status: str = None, request_type: str = None, city: str = None,
+                db: Session = Depends(get_read_db)):
+    return dashboard_summary(db, parser.parse(start_date), parser.parse(end_date), status, request_type, city)
+
+
+@dashboard_router.get("/cache-stats")
+@async_dashboard_router.get("/cache-stats")
+def get_cache_stats():
+    return dashboard_cache.stats()
+
+
+@dashboard_router.get("/request-completion-time", dependencies=NOT_MODIFIED)
 def get_request_completion_time(start_date: str, end_date: str, city: str = None, request_type: str = None,
-                                db: Session = Depends(get_db)):
+                                mode: Literal["stats", "raw"] = "stats",
+                                group_by: List[Literal["city", "request_type"]] = Query([]),
+                                limit: int = Query(1000, ge=1, le=10000), after: Optional[str] = None,
+                                db: Session = Depends(get_read_db)):
+    """
+    mode=stats (default) returns completion-time statistics per group_by group.
+    mode=raw returns the completion time of each request, one page of limit requests at a time.
+    """
+    if mode == "stats":
+        return request_completion_stats(db, parser.parse(start_date), parser.parse(end_date), city, request_type,
+                                        group_by)
     return request_completion_time(db, parser.parse(start_date), parser.parse(end_date), city,
-                                   request_type)
+                                   request_type, limit, after)
+
+
+@async_dashboard_router.get("/city-count", dependencies=ASYNC_NOT_MODIFIED)
+async def get_city_count_async(start_date: str, end_date: str, status: str = None, request_type: str = None,
+                               city: str = None, db: AsyncSession = Depends(get_async_read_db)):
+    return await db.run_sync(city_count, parser.parse(start_date), parser.parse(end_date), status, request_type,
+                             city)
+
+
+@async_dashboard_router.get("/status-count", dependencies=ASYNC_NOT_MODIFIED)
+async def get_status_count_async(start_date: str, end_date: str, status: str = None, request_type: str = None,
+                                 city: str = None, db: AsyncSession = Depends(get_async_read_db)):
+    return await db.run_sync(status_count, parser.parse(start_date), parser.parse(end_date), status, request_type,
+                             city)
+
+
+@async_dashboard_router.get("/type-count", dependencies=ASYNC_NOT_MODIFIED)
+async def get_type_count_async(start_date: str, end_date: str, status: str = None, request_type: str = None,
+                               city: str = None, db: AsyncSession = Depends(get_async_read_db)):
+    return await db.run_sync(type_count, parser.parse(start_date), parser.parse(end_date), status, request_type,
+                             city)
+
+
+@async_dashboard_router.get("/summary", dependencies=ASYNC_NOT_MODIFIED)
+async def get_summary_async(start_date: str, end_date: str, status: str = None, request_type: str = None,
+                            city: str = None, db: AsyncSession = Depends(get_async_read_db)):
+    return await db.run_sync(dashboard_summary, parser.parse(start_date), parser.parse(end_date), status,
+                             request_type, city)
+
+
+@async_dashboard_router.get("/request-completion-time", dependencies=ASYNC_NOT_MODIFIED)
+async def get_request_completion_time_async(start_date: str, end_date: str, city: str = None,
+                                            request_type: str = None, mode: Literal["stats", "raw"] = "stats",
+                                            group_by: List[Literal["city", "request_type"]] = Query([]),
+                                            limit: int = Query(1000, ge=1, le=10000), after: Optional[str] = None,
+                                            db: AsyncSession = Depends(get_async_read_db)):
+    if mode == "stats":
+        return await db.run_sync(request_completion_stats, parser.parse(start_date), parser.parse(end_date), city,
+                                 request_type, group_by)
+    return await db.run_sync(request_completion_time, parser.parse(start_date), parser.parse(end_date), city,
+                             request_type, limit, after)
@@ -0,0 +1,16 @@
+from fastapi import APIRouter
+
+from app.core.config import DB_POOL_CONFIG
+from app.core.database import get_pools, replica_router
+from app.core.pool_metrics import pool_snapshot
+
+pool_router = APIRouter()
+
+
+@pool_router.get("/stats")
+def get_pool_stats():
+    """
+    Live connection pool occupancy (checked out, idle, overflow) and checkout wait-time histograms
+    for this worker process, together with the configured pool settings, and where its reads went.
+    """
+    return {"config": DB_POOL_CONFIG, "pools": pool_snapshot(get_pools()), "replica": replica_router.stats()}
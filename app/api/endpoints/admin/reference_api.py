@@ -0,0 +1,30 @@
+from fastapi import APIRouter, Depends
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.core.database import get_db, get_async_db
+from app.core.reference_data import reference_data
+
+reference_router = APIRouter()
+async_reference_router = APIRouter()
+
+
+@reference_router.get("/")
+@async_reference_router.get("/")
+def get_reference_data():
+    """
+    The cached id -> name maps of the reference tables held by this worker process.
+    """
+    return reference_data.snapshot()
+
+
+@reference_router.post("/refresh")
+def refresh_reference_data(db: Session = Depends(get_db)):
+    reference_data.load(db)
+    return reference_data.snapshot()
+
+
+@async_reference_router.post("/refresh")
+async def refresh_reference_data_async(db: AsyncSession = Depends(get_async_db)):
+    await db.run_sync(reference_data.load)
+    return reference_data.snapshot()
@@ -1,115 +1,265 @@
 #define APIRouter() instance for requests
-from fastapi import APIRouter, Depends, HTTPException, Query
-from typing import Optional
-from app.models.request import Request, RequestStatus, RequestType
+from dateutil import parser
+from fastapi import APIRouter, Body, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from typing import List, Literal, Optional
+from app.api.dependencies import page_params, conditional_get, async_conditional_get
 from app.schemas.request import RequestModel
-from app.core.database import get_db
-from sqlalchemy.orm import Session, joinedload
-from app.models.user import *
-from sqlalchemy.sql import case, func
+from app.core import requests_db
+from app.core.bulk_import import import_requests, summarize, MAX_BULK_ROWS
+from app.core.pagination import PageParams, next_cursor
+from app.core.database import get_db, get_async_db, get_read_db, get_async_read_db, read_session_factory, \
+    async_read_session_factory
+from app.core.config import MATCHING_CONFIG
+from app.core.city_distances import city_distances
+from app.core.matching import matching_engine, SCORERS
+from app.core.reference_data import reference_data
+from app.core.request_feed import request_feed, FeedFull
+from app.core.responses import FastJSONResponse
+from app.core.export import iter_export, aiter_export, requests_export_query, EXPORT_MEDIA_TYPES
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+# Tables the request lists read, including the reference tables their names come from
+REQUEST_TABLES = ("requests", "cities", "request_types", "request_status")
+MATCHED_REQUEST_TABLES = REQUEST_TABLES + ("users", "families", "volunteers", "user_types")
+NOT_MODIFIED = [Depends(conditional_get(*REQUEST_TABLES))]
+ASYNC_NOT_MODIFIED = [Depends(async_conditional_get(*REQUEST_TABLES))]
+MATCHED_NOT_MODIFIED = [Depends(conditional_get(*MATCHED_REQUEST_TABLES))]
+ASYNC_MATCHED_NOT_MODIFIED = [Depends(async_conditional_get(*MATCHED_REQUEST_TABLES))]
 
 request_router = APIRouter()
+async_request_router = APIRouter()
+
+def _matched_page(rows, page: PageParams):
+    cursor = next_cursor(rows, page, lambda row: (row["created_at"], row["request_id"]))
+    return FastJSONResponse({"items": rows, "next_cursor": cursor})
 
-@request_router.get("/requests/")
-def get_requests(db: Session = Depends(get_db)):
+def _requests_page(requests, page: PageParams):
+    cursor = next_cursor(requests, page, lambda request: (request["created_at"], request["id"]))
+    return FastJSONResponse({"items": requests, "next_cursor": cursor})
+
+@request_router.get("/requests/", dependencies=MATCHED_NOT_MODIFIED)
+def get_requests(page: PageParams = Depends(page_params), db: Session = Depends(get_read_db)):
     """
-    Returns a list of requests with volunteer details and a calculated match percentage.
-    
-    The match percentage is computed as:
-      - 100 if both the request's city and request_type match the volunteer's preferred city and skill.
-      - 50 if either the city or the skill matches.
-      - 0 otherwise.
-    
-    Filters:
-      - Only include users whose related user_type has an id equal to 2.
-      - Only include users that have been approved (approved_by_id is not null).
-      - Only include requests with a status of 1.
+    Returns a page of requests with volunteer details and a calculated match percentage.
+    See requests_db.get_matched_requests for the matching rules.
+    """
+    return _matched_page(requests_db.get_matched_requests(db, page), page)
+
+@request_router.get("/request", dependencies=NOT_MODIFIED)
+def read_all_requests(id: Optional[str] = Query(None), page: PageParams = Depends(page_params),
+                      db: Session = Depends(get_read_db)):
+    return _requests_page(requests_db.get_requests(db, id, page), page)
+
+@request_router.get("/request/export")
+def export_requests(format: Literal["ndjson", "csv"] = "ndjson", start_date: Optional[str] = None,
+                    end_date: Optional[str] = None, city: Optional[int] = None, status: Optional[int] = None):
+    """
+    Stream all requests matching the filters as NDJSON or CSV.
+    """
+    query = requests_export_query(start_date and parser.parse(start_date), end_date and parser.parse(end_date),
+                                  city, status)
+    return StreamingResponse(iter_export(read_session_factory(), query, format), media_type=EXPORT_MEDIA_TYPES[format],
+                             headers={"Content-Disposition": f"attachment; filename=requests.{format}"})
+
+# Match fields that refer to a reference table, see reference_data.with_names
+VOLUNTEER_NAME_FIELDS = {"city": "cities", "skill": "request_types", "license_level": "licenses"}
+REQUEST_NAME_FIELDS = {"city": "cities", "request_type": "request_types"}
+
+def _with_names(matches, fields):
+    return FastJSONResponse([reference_data.with_names(match, **fields) for match in matches])
+
+def _scorer(scorer: str):
+    if scorer not in SCORERS:
+        raise HTTPException(status_code=400, detail=f"Unknown scorer, expected one of {sorted(SCORERS)}")
+    return SCORERS[scorer]
+
+@request_router.get("/matches/requests/{request_id}")
+def get_request_matches(request_id: str, k: int = Query(MATCHING_CONFIG["default_k"], ge=1, le=1000),
+                        scorer: str = "binary", license_level: Optional[int] = None, db: Session = Depends(get_db)):
+    """
+    The k best approved volunteers for an open request, ranked by the chosen scorer.
+    """
+    matching_engine.ensure_loaded(db)
+    reference_data.ensure_loaded(db)
+    city_distances.ensure_loaded(db)
+    matches = matching_engine.top_volunteers(request_id, k, _scorer(scorer), license_level)
+    if matches is None:
+        raise HTTPException(status_code=404, detail="Open request not found")
+    return _with_names(matches, VOLUNTEER_NAME_FIELDS)
+
+@request_router.get("/matches/volunteers/{volunteer_id}")
+def get_volunteer_matches(volunteer_id: str, k: int = Query(MATCHING_CONFIG["default_k"], ge=1, le=1000),
+                          scorer: str = "binary", db: Session = Depends(get_db)):
+    """
+    The k best open requests for an approved volunteer, ranked by the chosen scorer.
+    """
+    matching_engine.ensure_loaded(db)
+    reference_data.ensure_loaded(db)
+    city_distances.ensure_loaded(db)
+    matches = matching_engine.top_requests(volunteer_id, k, _scorer(scorer))
+    if matches is None:
+        raise HTTPException(status_code=404, detail="Approved volunteer not found")
+    return _with_names(matches, REQUEST_NAME_FIELDS)
+
+def _nearest_volunteers(request_id: str, k: int, license_level: Optional[int], max_distance_km: Optional[float]):
+    matches = matching_engine.nearest_volunteers(request_id, k, city_distances, license_level,
+                                                 max_distance_km if max_distance_km is not None else float("inf"))
+    if matches is None:
+        raise HTTPException(status_code=404, detail="Open request not found")
+    return _with_names(matches, VOLUNTEER_NAME_FIELDS)
+
+@request_router.get("/matches/requests/{request_id}/nearest")
+def get_nearest_volunteers(request_id: str, k: int = Query(MATCHING_CONFIG["default_k"], ge=1, le=1000),
+                           license_level: Optional[int] = None, max_distance_km: Optional[float] = Query(None, ge=0),
+                           db: Session = Depends(get_db)):
+    """
+    The k approved volunteers nearest to an open request, by the city distance matrix, for dispatching
+    urgent requests that have no volunteer in their own city. Requests that require a vehicle only get
+    volunteers licensed to drive to them.
+    """
+    matching_engine.ensure_loaded(db)
+    reference_data.ensure_loaded(db)
+    city_distances.ensure_loaded(db)
+    return _nearest_volunteers(request_id, k, license_level, max_distance_km)
+
+def _volunteer_feed(volunteer_id: str):
+    volunteer = matching_engine.volunteers.get(volunteer_id)
+    if volunteer is None:
+        raise HTTPException(status_code=404, detail="Approved volunteer not found")
+    try:
+        request_feed.check_capacity()
+    except FeedFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    # X-Accel-Buffering keeps nginx from holding back the events
+    return StreamingResponse(request_feed.stream(volunteer.city, volunteer.skill), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@request_router.get("/feed/volunteers/{volunteer_id}")
+def stream_volunteer_feed(volunteer_id: str, db: Session = Depends(get_db)):
     """
-    # Define the match_percentage expression.
-    match_percentage_expr = case(
-        (
-            (Request.city == Volunteer.preferred_city) &
-            (Request.request_type == Volunteer.preferred_skill),
-            100
-        ),
-        (
-            (Request.city == Volunteer.preferred_city) |
-            (Request.request_type == Volunteer.preferred_skill),
-            50
-        ),
-        else_=0
-    ).label("match_percentage")
-
-    # Build the query with joins and filters.
-    query = (
-        db.query(
-            Request.id.label("request_id"),
-            Request.request_type,
-            Request.description,
-            Request.city,
-            Request.status,
-            Request.is_urgent,
-            # Concatenate first_name and last_name from the User model.
-            func.concat(User.first_name, " ", User.last_name).label("vol_name"),
-            match_percentage_expr
-        )
-        .join(Family, Family.user_id == Request.family_id)
-        .join(User, User.id == Family.user_id)
-        .join(Volunteer, Volunteer.user_id == User.id)
-        .filter(
-            # Filter using the relationship’s criteria.
-            User.user_type.has(id=2),
-            User.approved_by_id.isnot(None),
-            Request.status == 1
-        )
-    )
-
-    results = query.all()
-    # Convert each result row to a dictionary.
-    return [dict(row._mapping) for row in results]
-
-@request_router.get("/request")
-def read_all_requests(id: Optional[str] = Query(None), db: Session = Depends(get_db)):
-    if id:
-        results = db.query(Request).options(joinedload(Request.request_type_relation).filter(Request.id == id)).all()
-    else:
-        results = db.query(Request).options(joinedload(Request.request_type_relation)).all()
-    return results
+    Server-Sent Events stream of the requests created, changed or deleted in the volunteer's preferred city
+    or of their preferred skill, replacing polling of GET /requests/. Fetch the list once on the "ready"
+    event and again on "resync", apply the "request" events in between.
+    """
+    matching_engine.ensure_loaded(db)
+    return _volunteer_feed(volunteer_id)
 
 # Create a New Request
 @request_router.post("/request", response_model=dict)
-def create_request(request, db: Session = Depends(get_db)):
-    new_request = Request(**request.model_dump())
-    db.add(new_request)
+def create_request(request: RequestModel, db: Session = Depends(get_db)):
     try:
-        db.commit()
-        db.refresh(new_request)
+        new_request = requests_db.create_request(db, request)
         return {"id": new_request.id}
     except Exception as e:
-        db.rollback()
         raise HTTPException(status_code=400, detail=str(e))
     
+@request_router.post("/request/bulk")
+def create_requests_bulk(rows: List[dict] = Body(..., max_length=MAX_BULK_ROWS), db: Session = Depends(get_db)):
+    """
+    Create many requests at once. Every row is validated on its own and the response reports
+    the outcome of each row, so one bad row does not reject the rest.
+    """
+    return summarize(import_requests(db, rows))
+    
 @request_router.put("/request/{request_id}", response_model=RequestModel)
 def update_request(request_id: str, updated_request: RequestModel, db: Session = Depends(get_db)):
-    db_request = db.query(Request).filter(Request.id == request_id).first()
+    db_request = requests_db.update_request(db, request_id, updated_request)
     if not db_request:
         raise HTTPException(status_code=404, detail="Request not found")
-
-    for key, value in updated_request.dict(exclude_unset=True, exclude={"id", "created_at"}).items():
-        setattr(db_request, key, value)
-
-    db.commit()
-    db.refresh(db_request)
     return db_request
 
 # Delete a request
 @request_router.delete("/request/{request_id}", response_model=dict)
 def delete_request(request_id: str, db: Session = Depends(get_db)):
-    db_request = db.query(Request).filter(Request.id == request_id).first()
+    if not requests_db.delete_request(db, request_id):
+        raise HTTPException(status_code=404, detail="Request not found")
+    return {"message": "Request deleted successfully"}
+
+
+# Async versions of the routes above. The ORM code is shared and runs on the
+# AsyncSession's connection through run_sync, so no threadpool slot is held.
+@async_request_router.get("/requests/", dependencies=ASYNC_MATCHED_NOT_MODIFIED)
+async def get_requests_async(page: PageParams = Depends(page_params), db: AsyncSession = Depends(get_async_read_db)):
+    return _matched_page(await db.run_sync(requests_db.get_matched_requests, page), page)
+
+@async_request_router.get("/request", dependencies=ASYNC_NOT_MODIFIED)
+async def read_all_requests_async(id: Optional[str] = Query(None), page: PageParams = Depends(page_params),
+                                  db: AsyncSession = Depends(get_async_read_db)):
+    return _requests_page(await db.run_sync(requests_db.get_requests, id, page), page)
+
+@async_request_router.get("/request/export")
+async def export_requests_async(format: Literal["ndjson", "csv"] = "ndjson", start_date: Optional[str] = None,
+                                end_date: Optional[str] = None, city: Optional[int] = None,
+                                status: Optional[int] = None):
+    query = requests_export_query(start_date and parser.parse(start_date), end_date and parser.parse(end_date),
+                                  city, status)
+    session_factory = await async_read_session_factory()
+    return StreamingResponse(aiter_export(session_factory, query, format), media_type=EXPORT_MEDIA_TYPES[format],
+                             headers={"Content-Disposition": f"attachment; filename=requests.{format}"})
+
+@async_request_router.get("/matches/requests/{request_id}")
+async def get_request_matches_async(request_id: str, k: int = Query(MATCHING_CONFIG["default_k"], ge=1, le=1000),
+                                    scorer: str = "binary", license_level: Optional[int] = None,
+                                    db: AsyncSession = Depends(get_async_db)):
+    await db.run_sync(matching_engine.ensure_loaded)
+    await db.run_sync(reference_data.ensure_loaded)
+    await db.run_sync(city_distances.ensure_loaded)
+    matches = matching_engine.top_volunteers(request_id, k, _scorer(scorer), license_level)
+    if matches is None:
+        raise HTTPException(status_code=404, detail="Open request not found")
+    return _with_names(matches, VOLUNTEER_NAME_FIELDS)
+
+@async_request_router.get("/matches/volunteers/{volunteer_id}")
+async def get_volunteer_matches_async(volunteer_id: str, k: int = Query(MATCHING_CONFIG["default_k"], ge=1, le=1000),
+                                      scorer: str = "binary", db: AsyncSession = Depends(get_async_db)):
+    await db.run_sync(matching_engine.ensure_loaded)
+    await db.run_sync(reference_data.ensure_loaded)
+    await db.run_sync(city_distances.ensure_loaded)
+    matches = matching_engine.top_requests(volunteer_id, k, _scorer(scorer))
+    if matches is None:
+        raise HTTPException(status_code=404, detail="Approved volunteer not found")
+    return _with_names(matches, REQUEST_NAME_FIELDS)
+
+@async_request_router.get("/matches/requests/{request_id}/nearest")
+async def get_nearest_volunteers_async(request_id: str, k: int = Query(MATCHING_CONFIG["default_k"], ge=1, le=1000),
+                                       license_level: Optional[int] = None,
+                                       max_distance_km: Optional[float] = Query(None, ge=0),
+                                       db: AsyncSession = Depends(get_async_db)):
+    await db.run_sync(matching_engine.ensure_loaded)
+    await db.run_sync(reference_data.ensure_loaded)
+    await db.run_sync(city_distances.ensure_loaded)
+    return _nearest_volunteers(request_id, k, license_level, max_distance_km)
+
+@async_request_router.get("/feed/volunteers/{volunteer_id}")
+async def stream_volunteer_feed_async(volunteer_id: str, db: AsyncSession = Depends(get_async_db)):
+    await db.run_sync(matching_engine.ensure_loaded)
+    return _volunteer_feed(volunteer_id)
+
+@async_request_router.post("/request", response_model=dict)
+async def create_request_async(request: RequestModel, db: AsyncSession = Depends(get_async_db)):
+    try:
+        new_request = await db.run_sync(requests_db.create_request, request)
+        return {"id": new_request.id}
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@async_request_router.post("/request/bulk")
+async def create_requests_bulk_async(rows: List[dict] = Body(..., max_length=MAX_BULK_ROWS),
+                                     db: AsyncSession = Depends(get_async_db)):
+    return await db.run_sync(lambda session: summarize(import_requests(session, rows)))
+
+@async_request_router.put("/request/{request_id}", response_model=RequestModel)
+async def update_request_async(request_id: str, updated_request: RequestModel,
+                               db: AsyncSession = Depends(get_async_db)):
+    db_request = await db.run_sync(requests_db.update_request, request_id, updated_request)
     if not db_request:
         raise HTTPException(status_code=404, detail="Request not found")
+    return db_request
 
-    db.delete(db_request)
-    db.commit()
+@async_request_router.delete("/request/{request_id}", response_model=dict)
+async def delete_request_async(request_id: str, db: AsyncSession = Depends(get_async_db)):
+    if not await db.run_sync(requests_db.delete_request, request_id):
+        raise HTTPException(status_code=404, detail="Request not found")
     return {"message": "Request deleted successfully"}
-
@@ -1,16 +1,87 @@
+from typing import Literal, Optional
+
+from dateutil import parser
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from app.core.database import get_db
+from app.api.dependencies import page_params, conditional_get, async_conditional_get
+from app.core.database import get_db, get_async_db, get_read_db, get_async_read_db, read_session_factory, \
+    async_read_session_factory
+from app.core.export import iter_export, aiter_export, users_export_query, EXPORT_MEDIA_TYPES
+from app.core.pagination import PageParams, next_cursor
+from app.core.responses import FastJSONResponse
+from app.core.signin import authenticate, authenticate_async
+from app.core.users_db import get_users_with_profiles
+
+from app.models.user import User, UserStatus
+from app.schemas.user import UserDTO_for_signin
 
-from app.models.user import User
+# Tables the user list reads, including the reference tables its names come from
+USER_LIST_TABLES = ("users", "families", "volunteers", "cities", "user_types", "user_status")
+NOT_MODIFIED = [Depends(conditional_get(*USER_LIST_TABLES))]
+ASYNC_NOT_MODIFIED = [Depends(async_conditional_get(*USER_LIST_TABLES))]
 
 users_router = APIRouter()
+async_users_router = APIRouter()
+
+
+def _users_page(users, page: PageParams):
+    return FastJSONResponse({"items": users,
+                             "next_cursor": next_cursor(users, page, lambda user: (user["created_at"], user["id"]))})
+
+
+def _signin_result(user: Optional[User]):
+    if user is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Wrong email or password")
+    if user.status_id != UserStatus.APPROVED:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="User is not approved")
+    return {"id": user.id, "first_name": user.first_name, "last_name": user.last_name,
+            "user_type_id": user.user_type_id, "city_id": user.city_id}
+
 
 #דוגמה ליצירת ראוט וראוטר
-@users_router.get("/")
-def read_user(db: Session = Depends(get_db)):
+@users_router.get("/", dependencies=NOT_MODIFIED)
+def read_user(page: PageParams = Depends(page_params), db: Session = Depends(get_read_db)):
     # db_user = crud.get_user(db, user_id=user_id)
     # if db_user is None:
     #     raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
-    return db.query(User).all()
-    return "אני רק דוגמהההה"
\ No newline at end of file
+    return _users_page(get_users_with_profiles(db, page), page)
+
+
+@async_users_router.get("/", dependencies=ASYNC_NOT_MODIFIED)
+async def read_user_async(page: PageParams = Depends(page_params), db: AsyncSession = Depends(get_async_read_db)):
+    return _users_page(await db.run_sync(get_users_with_profiles, page), page)
+
+
+@users_router.get("/export")
+def export_users(format: Literal["ndjson", "csv"] = "ndjson", start_date: Optional[str] = None,
+                 end_date: Optional[str] = None, city: Optional[int] = None, status: Optional[int] = None):
+    """
+    Stream all users matching the filters as NDJSON or CSV.
+    """
+    query = users_export_query(start_date and parser.parse(start_date), end_date and parser.parse(end_date),
+                               city, status)
+    return StreamingResponse(iter_export(read_session_factory(), query, format), media_type=EXPORT_MEDIA_TYPES[format],
+                             headers={"Content-Disposition": f"attachment; filename=users.{format}"})
+
+
+@async_users_router.get("/export")
+async def export_users_async(format: Literal["ndjson", "csv"] = "ndjson", start_date: Optional[str] = None,
+                             end_date: Optional[str] = None, city: Optional[int] = None,
+                             status: Optional[int] = None):
+    query = users_export_query(start_date and parser.parse(start_date), end_date and parser.parse(end_date),
+                               city, status)
+    session_factory = await async_read_session_factory()
+    return StreamingResponse(aiter_export(session_factory, query, format), media_type=EXPORT_MEDIA_TYPES[format],
+                             headers={"Content-Disposition": f"attachment; filename=users.{format}"})
+
+
+@users_router.post("/signin")
+def signin(credentials: UserDTO_for_signin, db: Session = Depends(get_db)):
+    return _signin_result(authenticate(db, credentials.email, credentials.password))
+
+
+@async_users_router.post("/signin")
+async def signin_async(credentials: UserDTO_for_signin, db: AsyncSession = Depends(get_async_db)):
+    return _signin_result(await authenticate_async(db, credentials.email, credentials.password))
@@ -1,52 +1,51 @@
-import hashlib
-import random
+import secrets
 import string
-from typing import List
+from typing import Dict, List, Literal, Optional, Tuple
 
-import requests
+from sqlalchemy import String, Text, column, func, select, update, values
 from sqlalchemy.orm import Session
 
+from .email_outbox import enqueue_email, enqueue_emails
+from .matching import queue_volunteer_refresh
+from .table_versions import bump_versions
+from .users_db import get_users_page
+from .pagination import PageParams
+from .password_hashing import password_hasher
 from ..models.user import User, UserStatus
 
 
-def send_email(user_email, subject, message):
-    # API URL
-    url = "https://virtserver.swaggerhub.com/liorshwartz/alert_service/1.0.0/api/send-email"
+APPROVAL_EMAIL_SUBJECT = "Successful connection to Yad-Tamar: "
 
-    # Email data
-    email_data = {
-        "to_email": user_email,
-        "subject": subject,
-        "body": message
-    }
 
-    # Headers to define content type
-    headers = {
-        "Content-Type": "application/json",
-        "Accept": "application/json"
-    }
+def new_password() -> str:
+    characters = string.ascii_letters + string.digits  # Letters (uppercase + lowercase) and digits
+    return ''.join(secrets.choice(characters) for _ in range(12))
 
-    # Make the POST request
-    response = requests.post(url, json=email_data, headers=headers)
 
-    # Check if the email was sent successfully
-    if response.status_code == 200:
-        print("Email sent successfully!")
-        print(response.json())  # Print the response from the server
-    else:
-        print("Failed to send email.")
-        print(f"Error: {response.status_code}")
-        print(response.json())  # Print error details
+def generate_credentials(count: int) -> List[Tuple[str, str]]:
+    """
+    count new random passwords with their hashes, hashed in parallel by the password hashing pool.
+    """
+    passwords = [new_password() for _ in range(count)]
+    return list(zip(passwords, password_hasher.hash_many(passwords)))
 
 
-def unapproved_users(session: Session) -> List[User]:
-    users = User.get_users(session,
+async def generate_credentials_async(count: int) -> List[Tuple[str, str]]:
+    """
+    generate_credentials for async callers, waits for the hashing pool without blocking the event loop.
+    """
+    passwords = [new_password() for _ in range(count)]
+    return list(zip(passwords, await password_hasher.ahash_many(passwords)))
+
+
+def unapproved_users(session: Session, page: Optional[PageParams] = None) -> List[User]:
+    users = get_users_page(session, page,
                            filters=[User.status_id == UserStatus.PENDING])  # TODO: replace status with requested
 
     return users
 
 
-def do_approve_user(session: Session, user_id: string):
+def do_approve_user(session: Session, user_id: string, credentials: Optional[Tuple[str, str]] = None):
     """
     Approve or reject a user based on the user_id
     if approved:
@@ -57,23 +56,21 @@ def do_approve_user(session: Session, user_id: string):
     if rejected:
     - update user status to rejected
     - send email to user that he/she got rejected (optional)
+    The email is queued in the email outbox and only sent once the approval is committed
+    credentials is the (password, password_hash) to give the user, generated here when not passed.
+    Async callers should pass it (see generate_credentials_async) since hashing blocks.
+    Users that are already approved are returned as they are, without new credentials or email.
 
     """
     user = User.get_user(session, user_id)
-    if user:
+    if user and user.status_id != UserStatus.APPROVED:
         user.status_id = UserStatus.APPROVED
-        # generate new password
-        characters = string.ascii_letters + string.digits  # Letters (uppercase + lowercase) and digits
-        password = ''.join(random.choice(characters) for _ in range(12))  # Randomly choose characters
-        hashed_password = hashlib.sha256(password.encode()).hexdigest()
-
-        user.hashed_password = hashed_password  # TODO: check hashed_password field
-        send_email(user.email, "Successful connection to Yad-Tamar: ", password)
+        password, user.password_hash = credentials or generate_credentials(1)[0]
+        enqueue_email(session, user.email, APPROVAL_EMAIL_SUBJECT, password)
 
         session.commit()
         session.refresh(user)
-        return user
-    return None
+    return user
 
 
 def do_reject_user(session: Session, user_id: string):
@@ -84,3 +81,62 @@ def do_reject_user(session: Session, user_id: string):
         session.refresh(user)
         return user
     return None
+
+
+def pending_user_ids(session: Session, user_ids: List[str]) -> List[str]:
+    """
+    The users among user_ids that exist and are pending, in the order given. Credentials are only
+    generated for these, hashing is the expensive part of an approval.
+    """
+    user_ids = list(dict.fromkeys(user_ids))
+    pending = set(session.scalars(select(User.id).where(User.id.in_(user_ids),
+                                                        User.status_id == UserStatus.PENDING)))
+    return [user_id for user_id in user_ids if user_id in pending]
+
+
+def bulk_decide_users(session: Session, user_ids: List[str], decision: Literal["approve", "reject"],
+                      approved_by_id: Optional[str] = None,
+                      credentials: Optional[Dict[str, Tuple[str, str]]] = None) -> List[User]:
+    """
+    Approve or reject many pending users with a single UPDATE ... RETURNING. Approved users get new
+    credentials, set through a VALUES list joined into the UPDATE, and their emails are queued with
+    a single INSERT, all in one transaction.
+    :param session: SQLAlchemy database session
+    :param user_ids: Users to decide on. Users that do not exist or are not pending are skipped
+    :param decision: "approve" or "reject"
+    :param approved_by_id: The admin approving the users, ignored when rejecting
+    :param credentials: {user_id: (password, password_hash)} for every user to approve, generated here for
+                        the pending users when not passed. Users without credentials are not approved
+    :return: The users that were updated
+    """
+    user_ids = list(dict.fromkeys(user_ids))
+    if decision == "approve" and credentials is None:
+        user_ids = pending_user_ids(session, user_ids)
+        credentials = dict(zip(user_ids, generate_credentials(len(user_ids))))
+    if not user_ids or (decision == "approve" and not credentials):
+        session.commit()
+        return []
+    # Users decided on since pending_user_ids are skipped by the status condition
+    stmt = update(User).where(User.id.in_(user_ids), User.status_id == UserStatus.PENDING)
+    if decision == "approve":
+        passwords = credentials
+        credentials = values(column("id", String), column("password_hash", Text), name="credentials").data(
+            [(user_id, password_hash) for user_id, (_, password_hash) in passwords.items()])
+        stmt = stmt.where(User.id == credentials.c.id).values(
+            status_id=UserStatus.APPROVED, approved_at=func.now(), approved_by_id=approved_by_id,
+            password_hash=credentials.c.password_hash)
+    else:
+        stmt = stmt.values(status_id=UserStatus.REJECTED)
+
+    users = session.scalars(stmt.returning(User), execution_options={"synchronize_session": False}).all()
+    if decision == "approve":
+        enqueue_emails(session, [(user.email, APPROVAL_EMAIL_SUBJECT, passwords[user.id][0]) for user in users])
+    queue_volunteer_refresh(session, [user.id for user in users])
+    # The bulk UPDATE bypasses the flush listener that bumps the table versions
+    if users:
+        bump_versions(session, ["users"])
+    # Keep the returned rows as they are instead of reloading every user after the commit
+    for user in users:
+        session.expunge(user)
+    session.commit()
+    return users
@@ -1,50 +1,142 @@
-from datetime import datetime
-from typing import Optional
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Optional, Sequence
 
-from sqlalchemy import func
+from sqlalchemy import func, tuple_, or_, and_, false
 from sqlalchemy.orm import Session
 
-from app.models.request import Request, RequestProcess, RequestStatus, RequestType
-from app.models.user import City
+from app.core.cache import cached_query
+from app.core.reference_data import reference_data
+from app.core.rollup import database_today, full_days, day_start
+from app.models.request import Request, RequestProcess, RequestStatus, RequestDailyRollup
 
+# Breakdowns dashboard_summary can compute, with the keys each one groups by
+BREAKDOWN_KEYS = ("city", "status", "type")
+BREAKDOWNS = {
+    "city": ("city",),
+    "status": ("status",),
+    "type": ("type",),
+    "cross_tab": ("city", "status", "type"),
+}
+# The reference table holding the names of each key
+KEY_TABLES = {"city": "cities", "status": "request_statuses", "type": "request_types"}
 
-def city_count(session: Session, start_date: datetime, end_date: datetime, status: Optional[int] = None,
-               request_type: Optional[str] = None, city: Optional[str] = None):
+
+@cached_query
+def dashboard_summary(session: Session, start_date: datetime, end_date: datetime, status: Optional[str] = None,
+                      request_type: Optional[str] = None, city: Optional[str] = None,
+                      breakdowns: Sequence[str] = tuple(BREAKDOWNS)):
     """
-        The function below is used to get the count of requests based on the city, status and type of request.
+        The function below is used to get the request counts per city, per status, per type of request and
+        their cross-tab, all from a single GROUPING SETS scan. Whole past days are read from the daily rollup
+        and only the partial days at the edges of the range (and today) from the requests table.
         The function takes in the following parameters:
         session: the session object
         start_date: the start date of the request
         end_date: the end date of the request
         status: the status of the request
         request_type: the type of request
-        The function returns the count of requests based on the city, status and type of request.
+        city: the city of the request
+        breakdowns: which of "city", "status", "type" and "cross_tab" to compute
+        The function returns a dict with one entry per requested breakdown. "city", "status" and "type" map a
+        name to its count, "cross_tab" is a list of {"city", "status", "type", "count"} rows.
     """
-    filters = [Request.created_at.between(start_date, end_date)]
+    # Filter on the integer keys, no join needed
+    reference_data.ensure_loaded(session)
+    names = {"city": city, "status": status, "type": request_type}
+    filter_ids = {key: reference_data.id_of(KEY_TABLES[key], name, session)
+                  for key, name in names.items() if name is not None}
+    if None in filter_ids.values():
+        # No such city, status or type, so nothing matches
+        return {name: [] if name == "cross_tab" else {} for name in breakdowns}
 
-    query = session.query(City.city_name, func.count(Request.id))
+    # Whole past days come from the daily rollup, the partial days at either end and today from the raw rows
+    days = full_days(start_date, end_date, database_today(session))
+    if days is None:
+        rows = _grouped_counts(session, Request, func.count(Request.id), Request.city, Request.status,
+                               Request.request_type, filter_ids, [Request.created_at.between(start_date, end_date)],
+                               breakdowns)
+    else:
+        first_day, last_day = days
+        raw_range = or_(
+            and_(Request.created_at >= start_date, Request.created_at < day_start(first_day)),
+            and_(Request.created_at >= day_start(last_day + timedelta(days=1)), Request.created_at <= end_date),
+        )
+        rows = _grouped_counts(session, Request, func.count(Request.id), Request.city, Request.status,
+                               Request.request_type, filter_ids, [raw_range], breakdowns)
+        rows += _grouped_counts(session, RequestDailyRollup, func.sum(RequestDailyRollup.request_count),
+                                RequestDailyRollup.city, RequestDailyRollup.status, RequestDailyRollup.request_type,
+                                filter_ids, [RequestDailyRollup.day.between(first_day, last_day),
+                                             RequestDailyRollup.request_count != 0],
+                                breakdowns)
 
-    if status is not None:
-        query = query.join(RequestStatus, Request.status == RequestStatus.id)
-        filters.append(RequestStatus.status_name == status)
-    if request_type is not None:
-        query = query.join(RequestType, Request.request_type == RequestType.id)
-        filters.append(RequestType.type_name == request_type)
-    if city is not None:
-        filters.append(City.city_name == city)
+    summary = {name: defaultdict(int) for name in breakdowns}
+    for name, city_id, status_id, type_id, count in rows:
+        # Requests without a status (NULL, or 0 in the rollup) have no status name
+        city_name = reference_data.name_of("cities", city_id)
+        status_name = reference_data.name_of("request_statuses", status_id)
+        type_name = reference_data.name_of("request_types", type_id)
+        if name == "cross_tab":
+            summary[name][(city_name, status_name, type_name)] += count
+        elif name == "city":
+            summary[name][city_name] += count
+        elif name == "status":
+            if status_name is not None:
+                summary[name][status_name] += count
+        else:
+            summary[name][type_name] += count
+
+    summary = {name: dict(counts) for name, counts in summary.items()}
+    if "cross_tab" in summary:
+        summary["cross_tab"] = [{"city": city_name, "status": status_name, "type": type_name, "count": count}
+                                for (city_name, status_name, type_name), count in summary["cross_tab"].items()]
+    return summary
+
+
+def _grouped_counts(session: Session, source, count, city_key, status_key, type_key, filter_ids, filters,
+                    breakdowns):
+    """
+        Run the GROUPING SETS query for the given breakdowns over source, which is either the requests
+        table or the daily rollup, grouping on the integer keys. filter_ids maps "city", "status" and "type"
+        to the id to filter on. Returns a list of (breakdown, city_id, status_id, type_id, count) rows.
+    """
+    columns = dict(zip(BREAKDOWN_KEYS, (city_key, status_key, type_key)))
+    # Postgres only accepts the columns of the grouping sets in the select list and in grouping()
+    grouped = [key for key in BREAKDOWN_KEYS if any(key in BREAKDOWNS[name] for name in breakdowns)]
+    # grouping() sets a bit for every column that is aggregated away in a row, which tells us
+    # which grouping set the row belongs to
+    set_masks = {
+        sum(1 << (len(grouped) - 1 - i) for i, key in enumerate(grouped) if key not in BREAKDOWNS[name]): name
+        for name in breakdowns
+    }
 
     query = (
-        query
-        .join(City, Request.city == City.id)
-        .filter(*filters)
-        .group_by(City.city_name)
+        session.query(*(columns[key] for key in grouped), func.grouping(*(columns[key] for key in grouped)), count)
+        .select_from(source)
+        .filter(*filters, *(columns[key] == id_ for key, id_ in filter_ids.items()))
+        .group_by(func.grouping_sets(*(tuple_(*(columns[key] for key in BREAKDOWNS[name])) for name in breakdowns)))
     )
 
-    print(query)
+    results = []
+    for row in query.all():
+        ids = dict(zip(grouped, row))
+        results.append((set_masks[row[-2]], ids.get("city"), ids.get("status"), ids.get("type"), row[-1]))
+    return results
 
-    res = query.all()
 
-    return {city: count for city, count in res}
+def city_count(session: Session, start_date: datetime, end_date: datetime, status: Optional[int] = None,
+               request_type: Optional[str] = None, city: Optional[str] = None):
+    """
+        The function below is used to get the count of requests based on the city, status and type of request.
+        The function takes in the following parameters:
+        session: the session object
+        start_date: the start date of the request
+        end_date: the end date of the request
+        status: the status of the request
+        request_type: the type of request
+        The function returns the count of requests based on the city, status and type of request.
+    """
+    return dashboard_summary(session, start_date, end_date, status, request_type, city, ("city",))["city"]
 
 
 def status_count(session: Session, start_date: datetime, end_date: datetime, status: Optional[int] = None,
@@ -59,29 +151,7 @@ def status_count(session: Session, start_date: datetime, end_date: datetime, sta
         request_type: the type of request
         The function returns the count of status (open and closed) requests based on the city, and type of request.
     """
-    filters = [Request.created_at.between(start_date, end_date)]
-
-    query = session.query(RequestStatus.status_name, func.count(Request.id))
-
-    if city is not None:
-        query = query.join(City, Request.city == City.id)
-        filters.append(City.city_name == city)
-    if request_type is not None:
-        query = query.join(RequestType, Request.request_type == RequestType.id)
-        filters.append(RequestType.type_name == request_type)
-    if status is not None:
-        filters.append(RequestStatus.status_name == status)
-
-    query = (
-        query
-        .join(RequestStatus, Request.status == RequestStatus.id)
-        .filter(*filters)
-        .group_by(RequestStatus.status_name)
-    )
-
-    res = query.all()
-
-    return {status: count for status, count in res}
+    return dashboard_summary(session, start_date, end_date, status, request_type, city, ("status",))["status"]
 
 
 def type_count(session: Session, start_date: datetime, end_date: datetime, status: Optional[int] = None,
@@ -95,65 +165,125 @@ def type_count(session: Session, start_date: datetime, end_date: datetime, statu
         city: the city of the request
         The function returns the count of requests based on the type of request.
     """
-    filters = [Request.created_at.between(start_date, end_date)]
+    return dashboard_summary(session, start_date, end_date, status, request_type, city, ("type",))["type"]
 
-    query = session.query(RequestType.type_name, func.count(Request.id))
 
+# Upper bounds (in seconds) of the completion-time histogram buckets, the last bucket is open ended
+COMPLETION_TIME_BUCKETS = (
+    ("<1h", 3600), ("<6h", 6 * 3600), ("<12h", 12 * 3600), ("<1d", 86400), ("<2d", 2 * 86400),
+    ("<3d", 3 * 86400), ("<7d", 7 * 86400), ("<14d", 14 * 86400), ("<30d", 30 * 86400), (">=30d", None),
+)
+
+# Columns the completion statistics can be grouped by, with the reference table holding their names
+COMPLETION_GROUPS = {"city": (Request.city, "cities"), "request_type": (Request.request_type, "request_types")}
+
+
+def _completion_query(session: Session, start_date: datetime, end_date: datetime, city: Optional[str],
+                      request_type: Optional[str], columns):
+    ids = {RequestProcess.status: reference_data.id_of("request_statuses", RequestStatus.COMPLETED, session)}
     if city is not None:
-        query = query.join(City, Request.city == City.id)
-        filters.append(City.city_name == city)
-    if status is not None:
-        query = query.join(RequestStatus, Request.status == RequestStatus.id)
-        filters.append(RequestStatus.status_name == status)
+        ids[Request.city] = reference_data.id_of("cities", city, session)
     if request_type is not None:
-        filters.append(RequestType.type_name == request_type)
+        ids[Request.request_type] = reference_data.id_of("request_types", request_type, session)
 
-    query = (
-        query
-        .join(RequestType, Request.request_type == RequestType.id)
+    filters = [Request.created_at.between(start_date, end_date)]
+    # An unknown name matches nothing
+    filters += [column == id_ for column, id_ in ids.items()] if None not in ids.values() else [false()]
+
+    return (
+        session.query(*columns)
+        .select_from(Request)
+        .join(RequestProcess, Request.id == RequestProcess.request_id)
         .filter(*filters)
-        .group_by(RequestType.type_name)
     )
 
-    res = query.all()
 
-    return {type_name: count for type_name, count in res}
+def _completion_seconds():
+    return func.extract('epoch', RequestProcess.completed_at) - func.extract('epoch', Request.created_at)
 
 
-def request_completion_time(session: Session, start_date: datetime, end_date: datetime, city: Optional[int] = None,
-                            request_type: Optional[str] = None):
+@cached_query
+def request_completion_stats(session: Session, start_date: datetime, end_date: datetime, city: Optional[str] = None,
+                             request_type: Optional[str] = None, group_by: Sequence[str] = ()):
     """
-        The function below is used to get the time taken to close a request based on the city, and type of request.
+        The function below is used to get statistics of the time taken to close a request, computed in the database.
         The function takes in the following parameters:
         session: the session object
         start_date: the start date of the request
         end_date: the end date of the request
         city: the city of the request
         request_type: the type of request
-        The function returns the time taken to close a request based on the city, and type of request.
+        group_by: any of "city" and "request_type", an empty value gives one overall row
+        The function returns one row per group with the count, mean, p50/p90/p99 (in seconds) and a histogram
+        over COMPLETION_TIME_BUCKETS.
     """
-    filters = [Request.created_at.between(start_date, end_date), RequestStatus.status_name == RequestStatus.COMPLETED]
+    group_columns = [COMPLETION_GROUPS[name][0] for name in group_by]
+    completion = _completion_seconds()
 
-    query = session.query(
-        Request.id,
-        (func.extract('epoch', RequestProcess.completed_at) - func.extract('epoch', Request.created_at)).label(
-            "completion_time")
-    )
+    buckets = []
+    lower = None
+    for _, upper in COMPLETION_TIME_BUCKETS:
+        conditions = [completion >= lower] if lower is not None else []
+        if upper is not None:
+            conditions.append(completion < upper)
+        buckets.append(func.count().filter(and_(*conditions)))
+        lower = upper
 
-    if city is not None:
-        query = query.join(City, Request.city == City.id)
-        filters.append(City.city_name == city)
-    if request_type is not None:
-        query = query.join(RequestType, Request.status == RequestType.id)
-        filters.append(RequestType.type_name == request_type)
+    columns = [
+        *group_columns,
+        func.count(),
+        func.avg(completion),
+        func.percentile_cont(0.5).within_group(completion),
+        func.percentile_cont(0.9).within_group(completion),
+        func.percentile_cont(0.99).within_group(completion),
+        *buckets,
+    ]
+    query = _completion_query(session, start_date, end_date, city, request_type, columns)
+    if group_columns:
+        query = query.group_by(*group_columns)
 
-    query = (
-        query
-        .join(RequestProcess, Request.id == RequestProcess.request_id)
-        .join(RequestStatus, RequestProcess.status == RequestStatus.id)
-        .filter(*filters)
-    )
+    res = []
+    for row in query.all():
+        groups, values = row[:len(group_columns)], row[len(group_columns):]
+        count, mean, p50, p90, p99 = values[:5]
+        stats = {name: reference_data.name_of(COMPLETION_GROUPS[name][1], group)
+                 for name, group in zip(group_by, groups)}
+        stats.update({
+            "count": count,
+            "mean_seconds": mean,
+            "p50_seconds": p50,
+            "p90_seconds": p90,
+            "p99_seconds": p99,
+            "histogram": {label: n for (label, _), n in zip(COMPLETION_TIME_BUCKETS, values[5:])},
+        })
+        res.append(stats)
+    return res
+
+
+@cached_query
+def request_completion_time(session: Session, start_date: datetime, end_date: datetime, city: Optional[int] = None,
+                            request_type: Optional[str] = None, limit: int = 1000, after: Optional[str] = None):
+    """
+        The function below is used to get the time taken to close a request based on the city, and type of request.
+        The function takes in the following parameters:
+        session: the session object
+        start_date: the start date of the request
+        end_date: the end date of the request
+        city: the city of the request
+        request_type: the type of request
+        limit: the maximum number of requests to return
+        after: return only requests whose id comes after this one (the next_after of the previous page)
+        The function returns the time taken to close each request, one page at a time, together with the
+        next_after to pass for the next page (None on the last page).
+    """
+    query = _completion_query(session, start_date, end_date, city, request_type,
+                              [Request.id, _completion_seconds().label("completion_time")])
+    if after is not None:
+        query = query.filter(Request.id > after)
 
-    res = query.all()
+    res = query.order_by(Request.id).limit(limit).all()
 
-    return {request_id: completion_time for request_id, completion_time in res}
+    return {
+        "completion_times": {request_id: completion_time for request_id, completion_time in res},
+        "next_after": res[-1][0] if len(res) == limit else None,
+    }
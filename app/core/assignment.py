@@ -0,0 +1,284 @@
+import argparse
+import logging
+import signal
+import threading
+import time
+from collections import defaultdict, deque
+from datetime import datetime
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+from sqlalchemy import func, text
+from sqlalchemy.orm import Session
+
+from app.core.config import ASSIGNMENT_CONFIG, MATCHING_CONFIG
+from app.core.matching import MatchingEngine, OPEN_REQUEST_STATUS, RequestEntry, SCORERS, matching_engine
+from app.core.reference_data import reference_data
+from app.models.request import Request, RequestProcess, RequestStatus
+
+logger = logging.getLogger(__name__)
+
+# Only one batch runs at a time, whichever worker or command line run gets here first
+_BATCH_LOCK = text("SELECT pg_try_advisory_xact_lock(hashtext('request_assignment'))")
+
+
+class Proposal(NamedTuple):
+    request_id: str
+    volunteer_id: str
+    score: float
+    # Score plus the urgency bonus, minus the workload penalty of the volunteer's slot
+    benefit: float
+
+
+def auction(counts: Sequence[int], edges: Sequence[Sequence[Tuple[int, float]]], slot_start: Sequence[int],
+            slot_cost: Sequence[float], epsilon: float) -> List[List[int]]:
+    """
+    Maximum benefit assignment of groups of identical requests to volunteer slots, by Bertsekas' forward
+    auction algorithm for similar persons. A group bids for as many slots as it has unassigned requests in
+    one go, which avoids the long price wars of identical requests outbidding each other by epsilon.
+    A request is left unassigned rather than given a slot worth nothing to it.
+
+    Prices start at 0 and a slot, once taken, stays taken, so the slots left free are at price 0 and the
+    result is optimal within epsilon per request.
+    :param counts: Number of requests in each group
+    :param edges: Per group, the (volunteer, benefit) pairs its requests can be assigned to
+    :param slot_start: Volunteer v owns the slots slot_start[v] to slot_start[v + 1] - 1
+    :param slot_cost: Taken off the benefit of every pair for that slot
+    :param epsilon: Smallest bid increment
+    :return: Per group, the slots its requests got
+    """
+    price = [0.0] * slot_start[-1]
+    owner = [-1] * len(price)
+    held: List[Set[int]] = [set() for _ in counts]
+    bidders = deque(g for g, row in enumerate(edges) if row and counts[g])
+    while bidders:
+        g = bidders.popleft()
+        wanted = counts[g] - len(held[g])
+        if wanted <= 0:
+            continue
+        values = []
+        for volunteer, benefit in edges[g]:
+            for slot in range(slot_start[volunteer], slot_start[volunteer + 1]):
+                if owner[slot] != g:
+                    value = benefit - slot_cost[slot] - price[slot]
+                    # Staying unassigned is worth 0
+                    if value > 0:
+                        values.append((value, slot))
+        if not values:
+            continue
+        values.sort(reverse=True)
+        taken = min(wanted, len(values))
+        # What the next best slot, or no slot, would be worth to the group's requests
+        alternative = values[taken][0] if len(values) > taken else 0.0
+        for value, slot in values[:taken]:
+            price[slot] += value - alternative + epsilon
+            outbid = owner[slot]
+            if outbid >= 0:
+                held[outbid].discard(slot)
+                bidders.append(outbid)
+            owner[slot] = g
+            held[g].add(slot)
+    return [sorted(slots) for slots in held]
+
+
+class CandidateGraph(NamedTuple):
+    # Open requests that get the same candidates, oldest first, and per group its (volunteer index, benefit)
+    # pairs and their scores
+    groups: List[List[RequestEntry]]
+    edges: List[List[Tuple[int, float]]]
+    scores: List[List[float]]
+    volunteer_ids: List[str]
+    # See auction
+    slot_start: List[int]
+    slot_cost: List[float]
+
+
+def build_candidate_graph(engine: MatchingEngine, workload: Dict[str, int],
+                          config: dict = ASSIGNMENT_CONFIG) -> CandidateGraph:
+    """
+    Pair the open requests of the engine with their config["candidates_per_request"] best volunteers that
+    have room for more work. Requests with the same scorer key (see Scorer.request_key), urgency and
+    vehicle requirement get the same candidates and form one group. The benefit of a pair is the scorer's score
+    plus config["urgent_bonus"] for urgent requests. Each volunteer gets a slot for every request they
+    can still take, up to config["volunteer_capacity"], costing config["workload_penalty"] per request
+    they would then have. Requests that require a vehicle only get volunteers licensed for it, as in
+    MatchingEngine.nearest_volunteers.
+    :param engine: Loaded matching engine, with the open requests and the approved volunteers
+    :param workload: Requests each volunteer has waiting for approval or in progress
+    """
+    scorer = SCORERS[config["scorer"]]
+    capacity = config["volunteer_capacity"]
+    requests, volunteers = engine.snapshot()
+    available = {user_id for user_id in volunteers if workload.get(user_id, 0) < capacity}
+    drivers = {user_id for user_id in available
+               if volunteers[user_id].license_level >= MATCHING_CONFIG["vehicle_min_license_level"]}
+
+    groups: Dict[tuple, List[RequestEntry]] = defaultdict(list)
+    for request in requests:
+        groups[scorer.request_key(request), request.requires_vehicle, request.is_urgent].append(request)
+    ranked = {key: [(score, volunteer) for score, volunteer in
+                    engine.rank_volunteers(members[0], config["candidates_per_request"], scorer,
+                                           drivers if key[1] else available) if score > 0]
+              for key, members in groups.items()}
+
+    volunteer_ids = sorted({volunteer.user_id for best in ranked.values() for _, volunteer in best})
+    volunteer_index = {user_id: v for v, user_id in enumerate(volunteer_ids)}
+    slot_start, slot_cost = [0], []
+    for user_id in volunteer_ids:
+        load = workload.get(user_id, 0)
+        slot_cost.extend(config["workload_penalty"] * (load + j) for j in range(capacity - load))
+        slot_start.append(len(slot_cost))
+
+    graph = CandidateGraph([], [], [], volunteer_ids, slot_start, slot_cost)
+    for key, members in groups.items():
+        bonus = config["urgent_bonus"] if key[2] else 0
+        graph.groups.append(sorted(members, key=lambda request: (request.created_at or datetime.max,
+                                                                 request.request_id)))
+        graph.edges.append([(volunteer_index[volunteer.user_id], score + bonus)
+                            for score, volunteer in ranked[key]])
+        graph.scores.append([score for score, _ in ranked[key]])
+    return graph
+
+
+def proposals_from_slots(graph: CandidateGraph, slots: Sequence[Sequence[int]]) -> List[Proposal]:
+    """
+    The proposals of an assignment of the graph's groups to slots, the best slots going to the oldest
+    requests of each group.
+    """
+    slot_owner = [v for v in range(len(graph.volunteer_ids))
+                  for _ in range(graph.slot_start[v], graph.slot_start[v + 1])]
+    proposals = []
+    for members, edges, scores, group_slots in zip(graph.groups, graph.edges, graph.scores, slots):
+        pair_of = {volunteer: e for e, (volunteer, _) in enumerate(edges)}
+        offers = sorted(((edges[pair_of[slot_owner[slot]]][1] - graph.slot_cost[slot], slot)
+                         for slot in group_slots), reverse=True)
+        for request, (benefit, slot) in zip(members, offers):
+            v = slot_owner[slot]
+            proposals.append(Proposal(request.request_id, graph.volunteer_ids[v], scores[pair_of[v]], benefit))
+    return proposals
+
+
+def plan_assignments(engine: MatchingEngine, workload: Dict[str, int],
+                     config: dict = ASSIGNMENT_CONFIG) -> List[Proposal]:
+    """
+    Choose a volunteer for as many of the engine's open requests as possible, maximizing the total
+    benefit over the candidate graph (see build_candidate_graph) rather than request by request, so
+    that sought-after volunteers are not offered more than they can take while other requests get no one.
+    """
+    graph = build_candidate_graph(engine, workload, config)
+    slots = auction([len(members) for members in graph.groups], graph.edges, graph.slot_start, graph.slot_cost,
+                    config["epsilon"])
+    return proposals_from_slots(graph, slots)
+
+
+def active_workload(session: Session) -> Dict[str, int]:
+    """
+    Requests each volunteer has waiting for their approval or in progress.
+    """
+    statuses = [reference_data.id_of("request_statuses", name, session)
+                for name in (RequestStatus.WAITING_APPROVAL, RequestStatus.IN_PROGRESS)]
+    rows = (session.query(RequestProcess.volunteer_id, func.count())
+            .filter(RequestProcess.status.in_(statuses))
+            .group_by(RequestProcess.volunteer_id))
+    return dict(rows.all())
+
+
+def run_batch(session: Session, dry_run: bool = False, config: dict = ASSIGNMENT_CONFIG) -> dict:
+    """
+    Propose a volunteer for the open requests, see plan_assignments, in a single transaction: every
+    proposed request moves to RequestStatus.WAITING_APPROVAL with a request_process row for the volunteer.
+    Requests that were taken or changed by someone else in the meantime are skipped.
+    :param session: SQLAlchemy database session
+    :param dry_run: Plan without writing anything
+    :return: Counts and timings of the batch
+    """
+    start = time.perf_counter()
+    if not session.execute(_BATCH_LOCK).scalar():
+        session.rollback()
+        return {"skipped": "another batch is running"}
+    # Other workers' writes are only picked up by a reload
+    matching_engine.load(session)
+    workload = active_workload(session)
+    open_requests, volunteers = len(matching_engine.requests), len(matching_engine.volunteers)
+    loaded = time.perf_counter()
+    proposals = plan_assignments(matching_engine, workload, config)
+    planned = time.perf_counter()
+
+    written = 0
+    if proposals and not dry_run:
+        waiting = reference_data.id_of("request_statuses", RequestStatus.WAITING_APPROVAL, session)
+        volunteer_of = {proposal.request_id: proposal.volunteer_id for proposal in proposals}
+        # Through the ORM, so that the rollup, matching engine, versions and feed listeners see the changes
+        requests = (session.query(Request)
+                    .filter(Request.id.in_(list(volunteer_of)), Request.status == OPEN_REQUEST_STATUS)
+                    .with_for_update(skip_locked=True)
+                    .all())
+        for request in requests:
+            request.status = waiting
+            session.add(RequestProcess(request_id=request.id, volunteer_id=volunteer_of[request.id], status=waiting,
+                                       volunteer_approval=False))
+        written = len(requests)
+    if dry_run:
+        session.rollback()
+    else:
+        session.commit()
+
+    return {"open_requests": open_requests, "volunteers": volunteers,
+            "proposed": len(proposals), "written": written,
+            "total_benefit": round(sum(proposal.benefit for proposal in proposals), 2),
+            "load_seconds": round(loaded - start, 3), "plan_seconds": round(planned - loaded, 3),
+            "write_seconds": round(time.perf_counter() - planned, 3)}
+
+
+class AssignmentScheduler:
+    """
+    Runs the batch every ASSIGNMENT_CONFIG["interval_seconds"], in the process of
+    `python -m app.core.assignment schedule`. The API workers do not run it: every one of them would run its
+    own batches, and the auction would hold the GIL of a worker serving requests.
+    """
+
+    def __init__(self, session_factory: Callable[[], Session], config: dict = ASSIGNMENT_CONFIG):
+        self.session_factory = session_factory
+        self.config = config
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def run(self):
+        while not self._stop.wait(self.config["interval_seconds"]):
+            try:
+                with self.session_factory() as session:
+                    logger.info("Request assignment batch: %s", run_batch(session, config=self.config))
+            except Exception:
+                logger.exception("Request assignment batch failed")
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name="request-assignment", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+
+if __name__ == "__main__":
+    from app.core.database import SessionLocal
+
+    arg_parser = argparse.ArgumentParser(description="Propose volunteers for the open requests")
+    commands = arg_parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="Run one batch")
+    run_parser.add_argument("--dry-run", action="store_true", help="Plan without writing anything")
+    commands.add_parser("schedule", help="Run a batch every ASSIGNMENT_INTERVAL_SECONDS until stopped")
+    args = arg_parser.parse_args()
+
+    if args.command == "schedule":
+        logging.basicConfig(level=logging.INFO, format="%(levelname)s:     %(message)s")
+        scheduler = AssignmentScheduler(SessionLocal)
+        signal.signal(signal.SIGTERM, lambda signum, frame: scheduler.stop())
+        try:
+            scheduler.run()
+        except KeyboardInterrupt:
+            pass
+    else:
+        with SessionLocal() as db:
+            print(run_batch(db, args.dry_run))
@@ -0,0 +1,169 @@
+import argparse
+import itertools
+import json
+import sys
+from collections import defaultdict
+from typing import Iterable, Iterator, List
+
+from pydantic import ValidationError
+from sqlalchemy import func, insert, select
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from app.core import rollup
+from app.core.matching import matching_engine, RequestEntry, OPEN_REQUEST_STATUS
+from app.core.request_feed import publish_request_changes, request_event
+from app.core.table_versions import bump_versions
+from app.models.request import Request
+from app.schemas.request import RequestModel
+
+DEFAULT_CHUNK_SIZE = 1000
+# Largest batch accepted by POST /api/request/bulk, bigger imports should use the command line importer
+MAX_BULK_ROWS = 10000
+
+
+def _validate(rows: Iterable[tuple]) -> Iterator[tuple]:
+    """
+    Yield (row_number, values, error) for each row, values being the column values to insert.
+    """
+    for row_number, raw in rows:
+        try:
+            if isinstance(raw, Exception):
+                raise raw
+            values = RequestModel.model_validate(raw).model_dump()
+        except (ValidationError, ValueError, TypeError) as e:
+            yield row_number, None, str(e)
+            continue
+        yield row_number, values, None
+
+
+def _insert(session: Session, rows: List[dict]):
+    # A list of parameter sets makes this an executemany, batched into multi-row INSERTs by SQLAlchemy
+    session.execute(insert(Request.__table__), rows)
+
+
+def _record_inserted(session: Session, rows: List[dict]):
+    """
+    The bulk INSERT bypasses the ORM flush listeners, so update the daily rollup and queue the
+    cache and matching-engine updates for commit, bump the version of the requests table and publish the
+    new requests to the live feed the same way they would.
+    """
+    deltas = defaultdict(int)
+    for row in rows:
+        deltas[row["created_at"].date(), row["city"], row["request_type"], row["status"] or rollup.NO_STATUS] += 1
+    rollup.apply_deltas(session, deltas)
+    session.info.setdefault("rollup_changes", set()).update((day, city) for day, city, _, _ in deltas)
+    bump_versions(session, ["requests"])
+    publish_request_changes(session, (request_event("upsert", row) for row in rows))
+
+    if matching_engine.loaded_at is not None:
+        session.info.setdefault("matching_changes", []).extend(
+            (matching_engine.upsert_request, RequestEntry(
+                row["id"], row["request_type"], row["city"], row["description"], bool(row["is_urgent"]),
+                bool(row["requires_vehicle"]), row["created_at"]))
+            for row in rows if row["status"] == OPEN_REQUEST_STATUS
+        )
+
+
+def import_requests(session: Session, rows: Iterable, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[dict]:
+    """
+    Validate and insert requests in chunks, one transaction per chunk.
+    A chunk is inserted with a single executemany. If that fails, the chunk is retried row by row,
+    each in its own savepoint, so that only the offending rows are rejected.
+    :param session: SQLAlchemy database session
+    :param rows: Request dicts in the RequestModel format. An Exception in place of a row (e.g. a
+                 line that is not valid JSON) is reported as an invalid row
+    :param chunk_size: Number of rows per transaction
+    :return: One result per row: {"row", "id", "status": "created" | "invalid" | "failed", "error"}
+    """
+    validated = _validate(enumerate(rows, start=1))
+    while True:
+        chunk = list(itertools.islice(validated, chunk_size))
+        if not chunk:
+            return
+
+        results = {}
+        valid = []
+        now = None
+        for row_number, values, error in chunk:
+            if error is not None:
+                results[row_number] = {"row": row_number, "id": None, "status": "invalid", "error": error}
+                continue
+            if values["created_at"] is None:
+                # By the database clock, as the created_at server default and the days of the daily rollup.
+                # The same timestamp goes into the row and into the rollup
+                now = now or session.scalar(select(func.localtimestamp()))
+                values["created_at"] = now
+            valid.append((row_number, values))
+
+        try:
+            if valid:
+                with session.begin_nested():
+                    _insert(session, [values for _, values in valid])
+            inserted = valid
+        except SQLAlchemyError:
+            inserted = []
+            for row_number, values in valid:
+                try:
+                    with session.begin_nested():
+                        _insert(session, [values])
+                    inserted.append((row_number, values))
+                except SQLAlchemyError as e:
+                    results[row_number] = {"row": row_number, "id": values["id"], "status": "failed",
+                                           "error": str(e.orig if getattr(e, "orig", None) else e)}
+
+        try:
+            if inserted:
+                _record_inserted(session, [values for _, values in inserted])
+            session.commit()
+        except SQLAlchemyError as e:
+            session.rollback()
+            inserted, error = [], str(e)
+            for row_number, values in valid:
+                results.setdefault(row_number, {"row": row_number, "id": values["id"], "status": "failed",
+                                                "error": error})
+
+        for row_number, values in inserted:
+            results[row_number] = {"row": row_number, "id": values["id"], "status": "created", "error": None}
+        for row_number, _, _ in chunk:
+            yield results[row_number]
+
+
+def summarize(results: Iterable[dict]) -> dict:
+    results = list(results)
+    summary = {status: sum(result["status"] == status for result in results)
+               for status in ("created", "invalid", "failed")}
+    summary["results"] = results
+    return summary
+
+
+def read_jsonl(lines: Iterable[str]) -> Iterator:
+    """
+    Parse JSON lines lazily, yielding the exception instead of the row for lines that do not parse.
+    Blank lines are skipped.
+    """
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError as e:
+            yield ValueError(f"Invalid JSON: {e}")
+
+
+if __name__ == "__main__":
+    from app.core.database import SessionLocal
+
+    arg_parser = argparse.ArgumentParser(
+        description="Import requests from a JSON lines file. Per-row results are written to stdout as JSON lines.")
+    arg_parser.add_argument("file", help="JSON lines file, - for stdin")
+    arg_parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="Rows per transaction")
+    args = arg_parser.parse_args()
+
+    counts = defaultdict(int)
+    source = sys.stdin if args.file == "-" else open(args.file, encoding="utf-8")
+    with source, SessionLocal() as db:
+        for result in import_requests(db, read_jsonl(source), args.chunk_size):
+            counts[result["status"]] += 1
+            print(json.dumps(result, ensure_ascii=False))
+    print(json.dumps(dict(counts)), file=sys.stderr)
@@ -0,0 +1,218 @@
+import copy
+import functools
+import inspect
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime
+from typing import Callable, Iterable, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.core.config import DASHBOARD_CACHE_CONFIG
+from app.core.reference_data import reference_data
+
+try:
+    import redis
+except ImportError:  # the shared backend is optional
+    redis = None
+
+
+class CacheScope:
+    """
+    The part of the data a cached result depends on: the created_at range it covers and the
+    city it was filtered on (None for all cities).
+    """
+
+    def __init__(self, start_date: datetime, end_date: datetime, city_id: Optional[int]):
+        self.first_day = start_date.date()
+        self.last_day = end_date.date()
+        self.city_id = city_id
+
+    def affected_by(self, day: date, city_id: int) -> bool:
+        return self.first_day <= day <= self.last_day and self.city_id in (None, city_id)
+
+
+class TTLCache:
+    """
+    Bounded in-process LRU cache whose entries also expire after ttl seconds. Every worker process has
+    its own and only sees the writes made by that process, entries invalidated by a write in another
+    worker are served until they expire. Use RedisCache when running more than one worker.
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._generation = 0  # Bumped by every invalidation
+        self._entries = OrderedDict()  # key -> (expires_at, scope, value)
+        self._lock = threading.Lock()
+
+    def generation(self) -> int:
+        return self._generation
+
+    def get(self, key: str) -> Tuple[bool, object]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            value = entry[2]
+        # Callers get their own copy, changing it must not change the cached result
+        return True, copy.deepcopy(value)
+
+    def set(self, key: str, value, scope: CacheScope, generation: int):
+        """
+        Cache value unless an invalidation happened since generation was read, value could then be
+        computed from data that is no longer current.
+        """
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, scope, copy.deepcopy(value))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, changes: Iterable[Tuple[date, int]]):
+        """
+        Drop every entry whose scope covers one of the changed (day, city_id) pairs.
+        """
+        changes = list(changes)
+        with self._lock:
+            stale = [key for key, (_, scope, _) in self._entries.items()
+                     if any(scope.affected_by(day, city_id) for day, city_id in changes)]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+            self._generation += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+
+    def stats(self) -> dict:
+        return {"backend": "memory", "entries": len(self._entries), "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl, "hits": self.hits, "misses": self.misses,
+                "invalidations": self.invalidations}
+
+
+class RedisCache:
+    """
+    Cache shared by all workers through Redis. Entries expire after ttl seconds and any write
+    invalidates all of them by bumping a generation number that is part of every key.
+    """
+
+    def __init__(self, url: str, ttl: float, prefix: str = "dashboard-cache"):
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def generation(self) -> int:
+        return int(self.client.get(f"{self.prefix}:generation") or 0)
+
+    def _key(self, key: str, generation: int) -> str:
+        return f"{self.prefix}:{generation}:{key}"
+
+    def get(self, key: str) -> Tuple[bool, object]:
+        value = self.client.get(self._key(key, self.generation()))
+        if value is None:
+            self.misses += 1
+            return False, None
+        self.hits += 1
+        return True, json.loads(value)
+
+    def set(self, key: str, value, scope: CacheScope, generation: int):
+        # Under the generation read before the query, an entry set after an invalidation is never read
+        self.client.set(self._key(key, generation), json.dumps(value, default=str), ex=max(int(self.ttl), 1))
+
+    def invalidate(self, changes: Iterable[Tuple[date, int]]):
+        if any(True for _ in changes):
+            self.client.incr(f"{self.prefix}:generation")
+            self.invalidations += 1
+
+    def clear(self):
+        self.client.incr(f"{self.prefix}:generation")
+
+    def stats(self) -> dict:
+        return {"backend": "redis", "ttl_seconds": self.ttl, "hits": self.hits, "misses": self.misses,
+                "invalidations": self.invalidations}
+
+
+def _build_dashboard_cache():
+    if DASHBOARD_CACHE_CONFIG["redis_url"]:
+        if redis is None:
+            raise RuntimeError("DASHBOARD_CACHE_REDIS_URL is set but the redis package is not installed")
+        return RedisCache(DASHBOARD_CACHE_CONFIG["redis_url"], DASHBOARD_CACHE_CONFIG["ttl_seconds"])
+    return TTLCache(DASHBOARD_CACHE_CONFIG["max_entries"], DASHBOARD_CACHE_CONFIG["ttl_seconds"])
+
+
+dashboard_cache = _build_dashboard_cache()
+
+
+def _normalize(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (list, tuple)):
+        return [_normalize(item) for item in value]
+    return value
+
+
+def cached_query(func: Callable) -> Callable:
+    """
+    Cache the result of a dashboard query taking (session, start_date, end_date, ..., city=...).
+    The key is the function name plus its normalized arguments, so calls with the same
+    parameters share an entry no matter how they were passed.
+    """
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    def wrapper(session: Session, *args, **kwargs):
+        if not DASHBOARD_CACHE_CONFIG["enabled"]:
+            return func(session, *args, **kwargs)
+
+        arguments = signature.bind(session, *args, **kwargs)
+        arguments.apply_defaults()
+        params = {name: _normalize(value) for name, value in arguments.arguments.items() if name != "session"}
+        key = json.dumps([func.__name__, params], sort_keys=True, default=str)
+
+        hit, value = dashboard_cache.get(key)
+        if hit:
+            return value
+
+        # Read before the query. A write committed while the query runs may be missing from its result,
+        # and its invalidation has already happened, so such a result is not cached
+        generation = dashboard_cache.generation()
+        value = func(session, *args, **kwargs)
+        city = arguments.arguments.get("city")
+        city_id = reference_data.id_of("cities", city, session) if city is not None else None
+        dashboard_cache.set(key, value, CacheScope(arguments.arguments["start_date"],
+                                                   arguments.arguments["end_date"], city_id), generation)
+        return value
+
+    return wrapper
+
+
+# app/core/rollup.py records the (day, city) pairs each flush touched in session.info["rollup_changes"].
+# They are invalidated once the transaction commits, before that other sessions still read the old data.
+# Queries that ran across the commit skip caching their result, see cached_query.
+@event.listens_for(Session, "after_commit")
+def _invalidate_committed_changes(session: Session):
+    changes = session.info.pop("rollup_changes", None)
+    if changes:
+        dashboard_cache.invalidate(changes)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_rolled_back_changes(session: Session):
+    session.info.pop("rollup_changes", None)
@@ -0,0 +1,182 @@
+import argparse
+import csv
+import heapq
+import logging
+import math
+import sys
+import threading
+import time
+from array import array
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import event, insert, select
+from sqlalchemy.orm import Session
+
+from app.core.config import MATCHING_CONFIG
+from app.models.user import City, CityDistance
+
+logger = logging.getLogger(__name__)
+
+UNREACHABLE = math.inf
+
+
+class _Matrix(NamedTuple):
+    city_ids: List[int]
+    # city id -> row and column of the city
+    index: Dict[int, int]
+    # Row-major, n * n
+    distances: array
+    # Per row, the columns of the nearest reachable cities, nearest first
+    nearest: List[array]
+
+
+class CityDistances:
+    """
+    City to city distance matrix, loaded from the city_distances table into flat float32 arrays.
+
+    For n cities the matrix takes 4 * n * n bytes, plus 4 * MATCHING_CONFIG["nearest_cities"] bytes per
+    city for its nearest neighbours sorted by distance, which the nearest volunteer search walks outwards
+    from the request's city. Pairs missing from the table are unreachable, except a city from itself.
+
+    Loaded at startup, reloaded every MATCHING_CONFIG["reload_seconds"] and after this process commits
+    a change to the table. Reloads run in a background thread, requests keep using the previous matrix
+    until the new one is ready.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Replaced as a whole on reload, so readers never see parts of two different loads
+        self.matrix = _Matrix([], {}, array("f"), [])
+        self.loaded_at: Optional[float] = None
+        self._stale = False
+        self._reloading = False
+
+    def load(self, session: Session, nearest_cities: int = MATCHING_CONFIG["nearest_cities"]):
+        # Cleared before reading, so that a change committed while loading makes the matrix stale again
+        self._stale = False
+        city_ids = session.scalars(select(City.id).order_by(City.id)).all()
+        rows = session.execute(select(CityDistance.from_city, CityDistance.to_city, CityDistance.distance_km)).all()
+        n = len(city_ids)
+        index = {city_id: i for i, city_id in enumerate(city_ids)}
+        distances = array("f", [UNREACHABLE]) * (n * n)
+        for i in range(n):
+            distances[i * n + i] = 0
+        pairs = [(index[a], index[b], distance) for a, b, distance in rows if a in index and b in index]
+        for a, b, distance in pairs:
+            distances[a * n + b] = distance
+        # Then the reverse of the pairs stored in one direction only
+        for a, b, distance in pairs:
+            if distances[b * n + a] == UNREACHABLE:
+                distances[b * n + a] = distance
+        nearest = []
+        for i in range(n):
+            row = distances[i * n:(i + 1) * n]
+            reachable = (j for j in range(n) if row[j] != UNREACHABLE)
+            nearest.append(array("I", heapq.nsmallest(nearest_cities, reachable, key=row.__getitem__)))
+        with self._lock:
+            self.matrix = _Matrix(city_ids, index, distances, nearest)
+            self.loaded_at = time.monotonic()
+
+    def ensure_loaded(self, session: Session):
+        """
+        Load the matrix if it never was, start a background reload if it is out of date.
+        """
+        if self.loaded_at is None:
+            self.load(session)
+        elif self._stale or time.monotonic() - self.loaded_at > MATCHING_CONFIG["reload_seconds"]:
+            with self._lock:
+                if self._reloading:
+                    return
+                self._reloading = True
+            threading.Thread(target=self._reload, name="city-distances-reload", daemon=True).start()
+
+    def _reload(self):
+        from app.core.database import SessionLocal
+
+        try:
+            with SessionLocal() as session:
+                self.load(session)
+        except Exception:
+            logger.exception("Reloading the city distances failed, keeping the loaded ones")
+            # Retried by the first request after reload_seconds, not by the next one
+            with self._lock:
+                self.loaded_at = time.monotonic()
+                self._stale = False
+        finally:
+            self._reloading = False
+
+    def invalidate(self):
+        self._stale = True
+
+    def distance(self, from_city: int, to_city: int) -> float:
+        """
+        Distance in km, UNREACHABLE if it is not known.
+        """
+        if from_city == to_city:
+            return 0
+        matrix = self.matrix
+        a, b = matrix.index.get(from_city), matrix.index.get(to_city)
+        if a is None or b is None:
+            return UNREACHABLE
+        return matrix.distances[a * len(matrix.city_ids) + b]
+
+    def nearest_cities(self, city: int) -> Iterator[Tuple[int, float]]:
+        """
+        (city id, distance) of the MATCHING_CONFIG["nearest_cities"] cities nearest to city that are reachable
+        from it, nearest first, starting with city itself.
+        """
+        matrix = self.matrix
+        a = matrix.index.get(city)
+        if a is None:
+            yield city, 0
+            return
+        row = a * len(matrix.city_ids)
+        for b in matrix.nearest[a]:
+            yield matrix.city_ids[b], matrix.distances[row + b]
+
+
+city_distances = CityDistances()
+
+
+def import_distances(session: Session, lines) -> int:
+    """
+    Replace the contents of city_distances with from_city,to_city,distance_km CSV rows (with a header).
+    :return: The number of pairs imported
+    """
+    rows = [{"from_city": int(row["from_city"]), "to_city": int(row["to_city"]),
+             "distance_km": float(row["distance_km"])} for row in csv.DictReader(lines)]
+    session.query(CityDistance).delete()
+    if rows:
+        session.execute(insert(CityDistance), rows)
+    # The bulk statements bypass the flush listener
+    session.info["city_distances_changed"] = True
+    session.commit()
+    return len(rows)
+
+
+@event.listens_for(Session, "after_flush")
+def _note_distance_changes(session: Session, flush_context):
+    if any(isinstance(obj, (City, CityDistance)) for obj in (*session.new, *session.dirty, *session.deleted)):
+        session.info["city_distances_changed"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_city_distances(session: Session):
+    if session.info.pop("city_distances_changed", False):
+        city_distances.invalidate()
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_distance_changes(session: Session):
+    session.info.pop("city_distances_changed", None)
+
+
+if __name__ == "__main__":
+    from app.core.database import SessionLocal
+
+    arg_parser = argparse.ArgumentParser(description="Import the city distance matrix from a CSV file")
+    arg_parser.add_argument("file", nargs="?", default="-", help="from_city,to_city,distance_km CSV, - for stdin")
+    args = arg_parser.parse_args()
+    with (sys.stdin if args.file == "-" else open(args.file, newline="", encoding="utf-8")) as f, \
+            SessionLocal() as db:
+        print(f"Imported {import_distances(db, f)} city distances")
@@ -1,23 +1,255 @@
+import logging
+import math
 import os
+import threading
+import time
+from typing import Iterable, Set
 
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine, event, make_url, text
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+
+from app.core.config import DB_POOL_CONFIG, REPLICA_CONFIG
+from app.core.metrics import instrument_engine
+from app.core.pool_metrics import PoolStats, timed_pool_class
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 DB_IP = os.getenv("DB_IP", "localhost")
 POSTGRES_USER = os.getenv("POSTGRES_USER", "postgres") 
 POSTGRES_PASSWORD = os.getenv("POSTGRES_PASSWORD", "postgres")
 DB_NAME = os.getenv("DB_NAME", "postgres")
 
 DATABASE_URL = f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{DB_IP}/{DB_NAME}"
-engine = create_engine(DATABASE_URL)
+engine = create_engine(DATABASE_URL, poolclass=timed_pool_class(QueuePool, PoolStats("primary")), **DB_POOL_CONFIG)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Same database through asyncpg, used when USE_ASYNC_DB is enabled
+ASYNC_DATABASE_URL = f"postgresql+asyncpg://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{DB_IP}/{DB_NAME}"
+async_engine = create_async_engine(ASYNC_DATABASE_URL,
+                                   poolclass=timed_pool_class(AsyncAdaptedQueuePool, PoolStats("async")),
+                                   **DB_POOL_CONFIG)
+AsyncSessionLocal = async_sessionmaker(async_engine, autocommit=False, autoflush=False, expire_on_commit=False)
+
+# Optional read replica, see get_read_db
+replica_engine = async_replica_engine = None
+ReplicaSessionLocal = AsyncReplicaSessionLocal = None
+if REPLICA_CONFIG["url"]:
+    # psycopg2 only takes whole seconds
+    connect_timeout = math.ceil(REPLICA_CONFIG["connect_timeout_seconds"])
+    replica_engine = create_engine(REPLICA_CONFIG["url"], poolclass=timed_pool_class(QueuePool, PoolStats("replica")),
+                                   connect_args={"connect_timeout": connect_timeout}, **DB_POOL_CONFIG)
+    ReplicaSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=replica_engine)
+    async_replica_engine = create_async_engine(make_url(REPLICA_CONFIG["url"]).set(drivername="postgresql+asyncpg"),
+                                               poolclass=timed_pool_class(AsyncAdaptedQueuePool,
+                                                                          PoolStats("async_replica")),
+                                               connect_args={"timeout": REPLICA_CONFIG["connect_timeout_seconds"]},
+                                               **DB_POOL_CONFIG)
+    AsyncReplicaSessionLocal = async_sessionmaker(async_replica_engine, autocommit=False, autoflush=False,
+                                                  expire_on_commit=False)
+
+# Statement counts and timings for the /metrics endpoint
+instrument_engine(engine)
+instrument_engine(async_engine.sync_engine)
+if replica_engine is not None:
+    instrument_engine(replica_engine)
+    instrument_engine(async_replica_engine.sync_engine)
+
+
+def get_pools():
+    """Pools of all engines, keyed by the name used in the pool metrics."""
+    pools = {"primary": engine.pool, "async": async_engine.sync_engine.pool}
+    if replica_engine is not None:
+        pools.update(replica=replica_engine.pool, async_replica=async_replica_engine.sync_engine.pool)
+    return pools
+
+
+def warm_up_pools():
+    """
+    Open DB_POOL_CONFIG["pool_size"] connections in the primary's pool, and the replica's, and leave
+    them idle in it.
+    """
+    for pool_engine in (engine, replica_engine):
+        if pool_engine is not None:
+            connections = [pool_engine.connect() for _ in range(DB_POOL_CONFIG["pool_size"])]
+            for connection in connections:
+                connection.close()
+
+
+async def async_warm_up_pools():
+    """
+    warm_up_pools for the async engines.
+    """
+    for pool_engine in (async_engine, async_replica_engine):
+        if pool_engine is not None:
+            connections = [await pool_engine.connect() for _ in range(DB_POOL_CONFIG["pool_size"])]
+            for connection in connections:
+                await connection.close()
+
+
+async def dispose_engines():
+    """
+    Close the pooled connections of all engines, on shutdown.
+    """
+    for pool_engine in (engine, replica_engine):
+        if pool_engine is not None:
+            pool_engine.dispose()
+    for pool_engine in (async_engine, async_replica_engine):
+        if pool_engine is not None:
+            await pool_engine.dispose()
+
+
+# Seconds the replica is behind. A replica that has replayed everything it received is not behind, even if
+# the last transaction it replayed is old because nothing was written since
+_REPLICA_LAG = text("""
+    SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END
+""")
+
+
+class ReplicaRouter:
+    """
+    Decides, per read, whether the replica is fresh enough to serve it (see REPLICA_CONFIG).
+
+    The lag is measured at most every REPLICA_CONFIG["lag_check_seconds"] by whichever read comes
+    first, the others use the last measurement. Writes are only known of in the worker that committed
+    them, another worker may still read the replica up to REPLICA_CONFIG["max_lag_seconds"] behind.
+    Only writes to the watched tables count, see conditional_get.
+    """
+
+    def __init__(self, config: dict = REPLICA_CONFIG):
+        self.config = config
+        self._lock = threading.Lock()
+        # None until measured, math.inf while the replica cannot be reached
+        self.lag = None
+        self.checked_at = None
+        self.last_write_at = -math.inf
+        self.reads = {"replica": 0, "primary": 0}
+        # Tables the reads routed here depend on, writes to other tables do not affect them
+        self.watched: Set[str] = set()
+
+    def watch(self, tables: Iterable[str]):
+        self.watched.update(tables)
+
+    def note_write(self, tables: Iterable[str]):
+        if not self.watched.isdisjoint(tables):
+            self.last_write_at = time.monotonic()
+
+    def _check_due(self) -> bool:
+        # Claims the check, so that concurrent reads do not all measure the lag at once
+        with self._lock:
+            now = time.monotonic()
+            if self.checked_at is not None and now - self.checked_at < self.config["lag_check_seconds"]:
+                return False
+            self.checked_at = now
+            return True
+
+    def _record_lag(self, lag):
+        if lag is None:
+            logger.warning("Read replica has not replayed any transaction yet")
+        self.lag = math.inf if lag is None else float(lag)
+
+    def _choose(self) -> bool:
+        use_replica = (self.lag is not None and self.lag <= self.config["max_lag_seconds"]
+                       and time.monotonic() - self.last_write_at >= self.config["read_after_write_seconds"])
+        self.reads["replica" if use_replica else "primary"] += 1
+        return use_replica
+
+    def use_replica(self) -> bool:
+        if replica_engine is None:
+            return False
+        if self._check_due():
+            try:
+                with replica_engine.connect() as connection:
+                    self._record_lag(connection.execute(_REPLICA_LAG).scalar())
+            except Exception as e:
+                logger.warning("Read replica unavailable, reading from the primary: %s", e)
+                self.lag = math.inf
+        return self._choose()
+
+    async def async_use_replica(self) -> bool:
+        if async_replica_engine is None:
+            return False
+        if self._check_due():
+            try:
+                async with async_replica_engine.connect() as connection:
+                    self._record_lag((await connection.execute(_REPLICA_LAG)).scalar())
+            except Exception as e:
+                logger.warning("Read replica unavailable, reading from the primary: %s", e)
+                self.lag = math.inf
+        return self._choose()
+
+    def stats(self) -> dict:
+        # Without the URL, it has the password
+        settings = {name: value for name, value in self.config.items() if name != "url"}
+        return {"configured": replica_engine is not None, "lag_seconds": self.lag, "reads": dict(self.reads),
+                **settings}
+
+
+replica_router = ReplicaRouter()
+
+
+# app/core/table_versions.py records the tables each transaction wrote in session.info["written_tables"]
+@event.listens_for(Session, "after_commit")
+def _note_committed_writes(session: Session):
+    tables = session.info.pop("written_tables", None)
+    if tables:
+        replica_router.note_write(tables)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_rolled_back_writes(session: Session):
+    session.info.pop("written_tables", None)
+
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+def read_session_factory():
+    """
+    ReplicaSessionLocal when the replica is fresh enough (see ReplicaRouter), SessionLocal otherwise.
+    """
+    return ReplicaSessionLocal if replica_router.use_replica() else SessionLocal
+
+
+async def async_read_session_factory():
+    return AsyncReplicaSessionLocal if await replica_router.async_use_replica() else AsyncSessionLocal
+
+
+def get_read_db():
+    """
+    get_db for routes that only read and can be served slightly stale data, from the replica when one
+    is configured.
+    """
+    db = read_session_factory()()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_async_read_db():
+    async with (await async_read_session_factory())() as db:
+        yield db
+
+
+# Registers the flush listener that keeps the daily dashboard rollup up to date
+import app.core.rollup  # noqa: E402,F401
+# Registers the flush listener that bumps the versions of the written tables
+import app.core.table_versions  # noqa: E402,F401
+# Registers the flush listener that publishes request changes to the live feed
+import app.core.request_feed  # noqa: E402,F401
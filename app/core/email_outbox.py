@@ -0,0 +1,241 @@
+import argparse
+import json
+import logging
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, List, NamedTuple, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from sqlalchemy import func, insert, update
+from sqlalchemy.orm import Session
+
+from app.core.config import EMAIL_CONFIG
+from app.models.outbox import EmailOutbox
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_email(session: Session, to_email: str, subject: str, body: str) -> EmailOutbox:
+    """
+    Queue an email in the caller's transaction. It is sent by the dispatcher once the transaction commits.
+    """
+    message = EmailOutbox(to_email=to_email, subject=subject, body=body)
+    session.add(message)
+    return message
+
+
+def enqueue_emails(session: Session, emails: List[tuple]):
+    """
+    Queue many (to_email, subject, body) emails in the caller's transaction with a single INSERT.
+    """
+    if emails:
+        session.execute(insert(EmailOutbox), [{"to_email": to_email, "subject": subject, "body": body}
+                                              for to_email, subject, body in emails])
+
+
+class OutboxMessage(NamedTuple):
+    id: int
+    to_email: str
+    subject: str
+    body: Optional[str]
+    attempts: int
+
+
+class DeliveryError(Exception):
+    def __init__(self, message: str, permanent: bool = False):
+        super().__init__(message)
+        self.permanent = permanent
+
+
+def backoff_seconds(attempts: int, config: dict = EMAIL_CONFIG) -> float:
+    """
+    Delay before the next attempt after `attempts` failed ones: exponential, capped and jittered so
+    that messages that failed together are not all retried at the same moment.
+    """
+    delay = min(config["backoff_base_seconds"] * 2 ** (attempts - 1), config["backoff_max_seconds"])
+    return delay * random.uniform(0.5, 1.0)
+
+
+class EmailDispatcher:
+    """
+    Sends the pending outbox rows. Rows are claimed in a short transaction with FOR UPDATE SKIP LOCKED
+    and leased by pushing next_attempt_at forward, so any number of dispatchers (one per worker
+    process, or standalone ones) can run at once, and a row claimed by a dispatcher that dies is
+    picked up again when the lease runs out. No transaction is held open while emails are sent.
+    """
+
+    def __init__(self, session_factory: Callable[[], Session], config: dict = EMAIL_CONFIG):
+        self.session_factory = session_factory
+        self.config = config
+        # One keep-alive connection pool shared by all sending threads
+        self.http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=config["concurrency"], pool_block=True)
+        self.http.mount("http://", adapter)
+        self.http.mount("https://", adapter)
+        self.http.headers.update({"Content-Type": "application/json", "Accept": "application/json"})
+        self._executor = ThreadPoolExecutor(max_workers=config["concurrency"], thread_name_prefix="email")
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def claim(self, session: Session) -> List[OutboxMessage]:
+        rows = (
+            session.query(EmailOutbox)
+            .filter(EmailOutbox.status == EmailOutbox.PENDING, EmailOutbox.next_attempt_at <= func.now())
+            .order_by(EmailOutbox.next_attempt_at)
+            .limit(self.config["batch_size"])
+            .with_for_update(skip_locked=True)
+            .all()
+        )
+        messages = [OutboxMessage(row.id, row.to_email, row.subject, row.body, row.attempts) for row in rows]
+        if messages:
+            # Long enough for every message of the batch to time out once
+            rounds = len(messages) / self.config["concurrency"] + 1
+            lease = timedelta(seconds=self.config["timeout_seconds"] * rounds)
+            session.execute(update(EmailOutbox)
+                            .where(EmailOutbox.id.in_([message.id for message in messages]))
+                            .values(next_attempt_at=func.now() + lease))
+        session.commit()
+        return messages
+
+    def deliver(self, message: OutboxMessage):
+        try:
+            response = self.http.post(self.config["url"], timeout=self.config["timeout_seconds"],
+                                      json={"to_email": message.to_email, "subject": message.subject,
+                                            "body": message.body})
+        except requests.RequestException as e:
+            raise DeliveryError(str(e))
+        if response.status_code >= 400:
+            # Other client errors will fail the same way every time
+            permanent = response.status_code < 500 and response.status_code not in (408, 429)
+            raise DeliveryError(f"HTTP {response.status_code}: {response.text[:500]}", permanent)
+
+    def _attempt(self, message: OutboxMessage) -> Optional[DeliveryError]:
+        try:
+            self.deliver(message)
+        except DeliveryError as e:
+            return e
+        return None
+
+    def record(self, session: Session, results: List[tuple]):
+        sent = [message.id for message, error in results if error is None]
+        if sent:
+            session.execute(update(EmailOutbox).where(EmailOutbox.id.in_(sent))
+                            .values(status=EmailOutbox.SENT, sent_at=func.now(), body=None, last_error=None,
+                                    attempts=EmailOutbox.attempts + 1))
+        for message, error in results:
+            if error is None:
+                continue
+            attempts = message.attempts + 1
+            values = {"attempts": attempts, "last_error": str(error)}
+            if error.permanent or attempts >= self.config["max_attempts"]:
+                values["status"] = EmailOutbox.DEAD
+                logger.warning("Email %s to %s dead-lettered after %s attempts: %s",
+                               message.id, message.to_email, attempts, error)
+            else:
+                values["next_attempt_at"] = func.now() + timedelta(seconds=backoff_seconds(attempts, self.config))
+            session.execute(update(EmailOutbox).where(EmailOutbox.id == message.id).values(**values))
+        session.commit()
+
+    def dispatch_once(self) -> int:
+        """
+        Claim and send one batch of due emails.
+        :return: Number of emails attempted
+        """
+        with self.session_factory() as session:
+            messages = self.claim(session)
+        if not messages:
+            return 0
+        errors = list(self._executor.map(self._attempt, messages))
+        with self.session_factory() as session:
+            self.record(session, list(zip(messages, errors)))
+        return len(messages)
+
+    def run(self):
+        while not self._stop.is_set():
+            try:
+                attempted = self.dispatch_once()
+            except Exception:
+                logger.exception("Email dispatch failed")
+                attempted = 0
+            # A full batch means more are probably due, otherwise wait for new ones
+            if attempted < self.config["batch_size"]:
+                self._stop.wait(self.config["poll_seconds"])
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name="email-dispatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._executor.shutdown(wait=False)
+        self.http.close()
+
+
+def requeue_dead(session: Session) -> int:
+    """
+    Give every dead-lettered email a fresh set of attempts, e.g. after the mail service was fixed.
+    """
+    result = session.execute(update(EmailOutbox).where(EmailOutbox.status == EmailOutbox.DEAD)
+                             .values(status=EmailOutbox.PENDING, attempts=0, next_attempt_at=func.now()))
+    session.commit()
+    return result.rowcount
+
+
+def stub_mail_server(port: int, fail_rate: float = 0.0, delay: float = 0.0) -> ThreadingHTTPServer:
+    """
+    Local stand-in for the mail service that accepts every email, failing a fraction of them with a 503
+    and answering after `delay` seconds, for trying the dispatcher's retries and concurrency.
+    Point EMAIL_SERVICE_URL at http://localhost:<port>/api/send-email to use it.
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            email = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            threading.Event().wait(delay)
+            status = 503 if random.random() < fail_rate else 200
+            body = json.dumps({"status": "sent" if status == 200 else "unavailable"}).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            logger.info("Stub mail server answered %s to %s: %s", status, email.get("to_email"), email.get("subject"))
+
+        def log_message(self, format, *args):
+            pass
+
+    return ThreadingHTTPServer(("127.0.0.1", port), Handler)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Send queued emails from the email_outbox table")
+    commands = arg_parser.add_subparsers(dest="command", required=True)
+    dispatch_parser = commands.add_parser("dispatch", help="Run a dispatcher")
+    dispatch_parser.add_argument("--once", action="store_true", help="Send one batch and exit")
+    commands.add_parser("requeue-dead", help="Retry the dead-lettered emails")
+    stub_parser = commands.add_parser("stub-server", help="Run a local stub of the mail service")
+    stub_parser.add_argument("--port", type=int, default=8025)
+    stub_parser.add_argument("--fail-rate", type=float, default=0.0, help="Fraction of emails answered with 503")
+    stub_parser.add_argument("--delay", type=float, default=0.0, help="Seconds to wait before answering")
+    args = arg_parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "stub-server":
+        stub_mail_server(args.port, args.fail_rate, args.delay).serve_forever()
+    else:
+        from app.core.database import SessionLocal
+
+        if args.command == "requeue-dead":
+            with SessionLocal() as db:
+                print(requeue_dead(db))
+        elif args.once:
+            print(EmailDispatcher(SessionLocal).dispatch_once())
+        else:
+            EmailDispatcher(SessionLocal).run()
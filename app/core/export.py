@@ -0,0 +1,112 @@
+import csv
+import io
+import json
+from datetime import date, datetime
+from typing import AsyncIterator, Iterator, List, Optional
+
+from sqlalchemy import Select, select
+
+from app.models.request import Request
+from app.models.user import User
+
+# Rows fetched from the server-side cursor per round trip, and written out per chunk
+EXPORT_CHUNK_SIZE = 1000
+
+EXPORT_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+REQUEST_EXPORT_COLUMNS = [
+    Request.id, Request.family_id, Request.request_type, Request.description, Request.city, Request.status,
+    Request.is_urgent, Request.requires_vehicle, Request.assigned_volunteer_id, Request.expected_completion,
+    Request.preferred_datetime, Request.created_at,
+]
+
+# password_hash is deliberately left out
+USER_EXPORT_COLUMNS = [
+    User.id, User.first_name, User.last_name, User.email, User.phone_number, User.address, User.city_id,
+    User.user_type_id, User.status_id, User.approved_at, User.approved_by_id, User.created_at,
+]
+
+
+def requests_export_query(start_date: Optional[datetime] = None, end_date: Optional[datetime] = None,
+                          city: Optional[int] = None, status: Optional[int] = None) -> Select:
+    query = select(*REQUEST_EXPORT_COLUMNS)
+    if start_date is not None:
+        query = query.where(Request.created_at >= start_date)
+    if end_date is not None:
+        query = query.where(Request.created_at <= end_date)
+    if city is not None:
+        query = query.where(Request.city == city)
+    if status is not None:
+        query = query.where(Request.status == status)
+    return query
+
+
+def users_export_query(start_date: Optional[datetime] = None, end_date: Optional[datetime] = None,
+                       city: Optional[int] = None, status: Optional[int] = None) -> Select:
+    query = select(*USER_EXPORT_COLUMNS)
+    if start_date is not None:
+        query = query.where(User.created_at >= start_date)
+    if end_date is not None:
+        query = query.where(User.created_at <= end_date)
+    if city is not None:
+        query = query.where(User.city_id == city)
+    if status is not None:
+        query = query.where(User.status_id == status)
+    return query
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+
+def _encode(rows: List, columns: List[str], fmt: str) -> str:
+    if fmt == "ndjson":
+        return "".join(json.dumps(dict(zip(columns, row)), default=_json_default, ensure_ascii=False) + "\n"
+                       for row in rows)
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue()
+
+
+def _header(columns: List[str], fmt: str) -> Optional[str]:
+    if fmt != "csv":
+        return None
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(columns)
+    return buffer.getvalue()
+
+
+def iter_export(session_factory, query: Select, fmt: str) -> Iterator[str]:
+    """
+    Stream the rows of query as NDJSON or CSV. Rows are read through a server-side cursor
+    EXPORT_CHUNK_SIZE at a time, so memory use does not depend on the size of the table.
+    The generator opens its own session because it runs after the request handler has returned.
+    :param session_factory: SessionLocal
+    :param query: Query built by requests_export_query or users_export_query
+    :param fmt: "ndjson" or "csv"
+    """
+    columns = list(query.selected_columns.keys())
+    header = _header(columns, fmt)
+    if header:
+        yield header
+    with session_factory() as session:
+        result = session.execute(query.execution_options(yield_per=EXPORT_CHUNK_SIZE))
+        for rows in result.partitions():
+            yield _encode(rows, columns, fmt)
+
+
+async def aiter_export(session_factory, query: Select, fmt: str) -> AsyncIterator[str]:
+    """
+    Same as iter_export, for the async stack.
+    :param session_factory: AsyncSessionLocal
+    """
+    columns = list(query.selected_columns.keys())
+    header = _header(columns, fmt)
+    if header:
+        yield header
+    async with session_factory() as session:
+        result = await session.stream(query.execution_options(yield_per=EXPORT_CHUNK_SIZE))
+        async for rows in result.partitions():
+            yield _encode(rows, columns, fmt)
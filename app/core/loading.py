@@ -0,0 +1,29 @@
+from typing import Dict, Iterable
+
+from sqlalchemy import inspect
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.util import identity_key
+
+
+def get_many(session: Session, model, ids: Iterable) -> Dict:
+    """
+    Like session.get for many primary keys: the instances already in the session are used as they are and
+    all the others are loaded with a single query. Flush listeners use this instead of one session.get
+    per flushed row.
+    :return: {primary key: instance}, without the keys that have no row
+    """
+    found, missing = {}, []
+    for id_ in set(ids):
+        if id_ is None:
+            continue
+        obj = session.identity_map.get(identity_key(model, id_))
+        if obj is not None:
+            found[id_] = obj
+        else:
+            missing.append(id_)
+    if missing:
+        primary_key = inspect(model).primary_key[0]
+        with session.no_autoflush:
+            for obj in session.query(model).filter(primary_key.in_(missing)):
+                found[getattr(obj, primary_key.key)] = obj
+    return found
@@ -0,0 +1,382 @@
+import heapq
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Collection, Dict, Hashable, List, NamedTuple, Optional, Set, Tuple
+
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+
+from app.core.city_distances import CityDistances, city_distances, UNREACHABLE
+from app.core.config import MATCHING_CONFIG
+from app.core.loading import get_many
+from app.models.request import Request
+from app.models.user import User, UserStatus, Volunteer
+
+# Requests in this status are waiting for a volunteer (see requests_db.get_matched_requests)
+OPEN_REQUEST_STATUS = 1
+
+
+class VolunteerEntry(NamedTuple):
+    user_id: str
+    name: str
+    city: int
+    skill: int
+    license_level: int
+
+
+class RequestEntry(NamedTuple):
+    request_id: str
+    request_type: int
+    city: int
+    description: Optional[str]
+    is_urgent: bool
+    requires_vehicle: bool
+    created_at: Optional[datetime]
+
+
+class Scorer:
+    """
+    Scores how well a volunteer fits a request, higher is better.
+    Unless full_scan is set, score() must not rank a pair that shares neither city nor skill above
+    one that does, which lets the engine look only at the indexed candidates.
+    """
+    full_scan = False
+
+    def score(self, request: RequestEntry, volunteer: VolunteerEntry) -> float:
+        raise NotImplementedError
+
+    def request_key(self, request: RequestEntry) -> Hashable:
+        """
+        Requests with the same key score the same against every volunteer, which lets batch callers
+        (see app/core/assignment.py) rank volunteers once for all of them.
+        """
+        return request.request_id
+
+
+class _CityTypeUrgencyScorer(Scorer):
+    def request_key(self, request: RequestEntry) -> Hashable:
+        return request.city, request.request_type, request.is_urgent
+
+
+class BinaryMatchScorer(_CityTypeUrgencyScorer):
+    """
+    100 if both the city and the skill match, 50 if one of them does, 0 otherwise.
+    """
+
+    def score(self, request: RequestEntry, volunteer: VolunteerEntry) -> float:
+        matches = (request.city == volunteer.city) + (request.request_type == volunteer.skill)
+        return (0, 50, 100)[matches]
+
+
+class WeightedMatchScorer(_CityTypeUrgencyScorer):
+    """
+    Weighted city and skill match, with a bonus for urgent requests the volunteer can reach locally.
+    """
+
+    def __init__(self, city_weight: float = 60, skill_weight: float = 40, urgent_bonus: float = 20):
+        self.city_weight = city_weight
+        self.skill_weight = skill_weight
+        self.urgent_bonus = urgent_bonus
+
+    def score(self, request: RequestEntry, volunteer: VolunteerEntry) -> float:
+        city_match = request.city == volunteer.city
+        score = self.city_weight * city_match + self.skill_weight * (request.request_type == volunteer.skill)
+        if request.is_urgent and city_match:
+            score += self.urgent_bonus
+        return score
+
+
+class DistanceScorer(_CityTypeUrgencyScorer):
+    """
+    Proximity of the volunteer's preferred city to the request's, falling linearly to nothing at radius_km,
+    plus a skill match. Urgent requests add a bonus that also falls with the distance, so a volunteer one
+    town over ranks above one with the right skill far away. Needs the city distances to be loaded.
+    """
+    full_scan = True
+
+    def __init__(self, distances: CityDistances, proximity_weight: float = 60, skill_weight: float = 40,
+                 urgent_bonus: float = 20, radius_km: float = MATCHING_CONFIG["distance_radius_km"]):
+        self.distances = distances
+        self.proximity_weight = proximity_weight
+        self.skill_weight = skill_weight
+        self.urgent_bonus = urgent_bonus
+        self.radius_km = radius_km
+
+    def score(self, request: RequestEntry, volunteer: VolunteerEntry) -> float:
+        proximity = max(0.0, 1 - self.distances.distance(request.city, volunteer.city) / self.radius_km)
+        score = self.proximity_weight * proximity + self.skill_weight * (request.request_type == volunteer.skill)
+        if request.is_urgent:
+            score += self.urgent_bonus * proximity
+        return score
+
+
+SCORERS: Dict[str, Scorer] = {
+    "binary": BinaryMatchScorer(),
+    "weighted": WeightedMatchScorer(),
+    "distance": DistanceScorer(city_distances),
+}
+
+
+def register_scorer(name: str, scorer: Scorer):
+    SCORERS[name] = scorer
+
+
+def _approved_volunteers(session: Session):
+    return (
+        session.query(Volunteer.user_id, func.concat(User.first_name, " ", User.last_name),
+                      Volunteer.preferred_city, Volunteer.preferred_skill, Volunteer.license_level)
+        .join(User, User.id == Volunteer.user_id)
+        .filter(User.status_id == UserStatus.APPROVED)
+    )
+
+
+class MatchingEngine:
+    """
+    In-memory inverted indexes of approved volunteers (by preferred city, skill and license level) and of
+    open requests (by city and request type), used to rank matches without a database round trip.
+
+    The indexes are loaded on first use, kept up to date by the session listeners at the bottom of this
+    module for writes made by this process, and fully reloaded every MATCHING_CONFIG["reload_seconds"]
+    to pick up writes made by other workers.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.loaded_at: Optional[float] = None
+        self._reset()
+
+    def _reset(self):
+        self.volunteers: Dict[str, VolunteerEntry] = {}
+        self.volunteers_by_city: Dict[int, Set[str]] = defaultdict(set)
+        self.volunteers_by_skill: Dict[int, Set[str]] = defaultdict(set)
+        self.volunteers_by_license: Dict[int, Set[str]] = defaultdict(set)
+        self.requests: Dict[str, RequestEntry] = {}
+        self.requests_by_city: Dict[int, Set[str]] = defaultdict(set)
+        self.requests_by_type: Dict[int, Set[str]] = defaultdict(set)
+
+    def load(self, session: Session):
+        """
+        Rebuild both indexes from the database.
+        """
+        volunteers = _approved_volunteers(session).all()
+        requests = (
+            session.query(Request.id, Request.request_type, Request.city, Request.description, Request.is_urgent,
+                          Request.requires_vehicle, Request.created_at)
+            .filter(Request.status == OPEN_REQUEST_STATUS)
+            .all()
+        )
+        with self._lock:
+            self._reset()
+            for row in volunteers:
+                self.upsert_volunteer(VolunteerEntry(*row))
+            for row in requests:
+                self.upsert_request(RequestEntry(*row))
+            self.loaded_at = time.monotonic()
+
+    def ensure_loaded(self, session: Session):
+        if self.loaded_at is None or time.monotonic() - self.loaded_at > MATCHING_CONFIG["reload_seconds"]:
+            self.load(session)
+
+    def snapshot(self) -> Tuple[List[RequestEntry], Dict[str, VolunteerEntry]]:
+        """
+        The open requests and the approved volunteers by user id, as of now.
+        """
+        with self._lock:
+            return list(self.requests.values()), dict(self.volunteers)
+
+    def upsert_volunteer(self, volunteer: VolunteerEntry):
+        with self._lock:
+            self.remove_volunteer(volunteer.user_id)
+            self.volunteers[volunteer.user_id] = volunteer
+            self.volunteers_by_city[volunteer.city].add(volunteer.user_id)
+            self.volunteers_by_skill[volunteer.skill].add(volunteer.user_id)
+            self.volunteers_by_license[volunteer.license_level].add(volunteer.user_id)
+
+    def remove_volunteer(self, user_id: str):
+        with self._lock:
+            volunteer = self.volunteers.pop(user_id, None)
+            if volunteer is not None:
+                self.volunteers_by_city[volunteer.city].discard(user_id)
+                self.volunteers_by_skill[volunteer.skill].discard(user_id)
+                self.volunteers_by_license[volunteer.license_level].discard(user_id)
+
+    def upsert_request(self, request: RequestEntry):
+        with self._lock:
+            self.remove_request(request.request_id)
+            self.requests[request.request_id] = request
+            self.requests_by_city[request.city].add(request.request_id)
+            self.requests_by_type[request.request_type].add(request.request_id)
+
+    def remove_request(self, request_id: str):
+        with self._lock:
+            request = self.requests.pop(request_id, None)
+            if request is not None:
+                self.requests_by_city[request.city].discard(request_id)
+                self.requests_by_type[request.request_type].discard(request_id)
+
+    def top_volunteers(self, request_id: str, k: int, scorer: Scorer,
+                       license_level: Optional[int] = None) -> Optional[List[dict]]:
+        """
+        The k best volunteers for an open request.
+        :param request_id: Identifier of the request
+        :param k: Number of volunteers to return
+        :param scorer: How to score a volunteer against the request
+        :param license_level: Only consider volunteers with this license level
+        :return: Ranked volunteers with their score, or None if the request is not open
+        """
+        with self._lock:
+            request = self.requests.get(request_id)
+            if request is None:
+                return None
+            pool = self.volunteers.keys() if license_level is None else self.volunteers_by_license[license_level]
+            best = self.rank_volunteers(request, k, scorer, pool)
+        return [dict(volunteer._asdict(), score=score) for score, volunteer in best]
+
+    def rank_volunteers(self, request: RequestEntry, k: int, scorer: Scorer,
+                        pool: Collection[str]) -> List[Tuple[float, VolunteerEntry]]:
+        """
+        The k best (score, volunteer) for request out of the volunteers whose user ids are in pool, best first.
+        """
+        with self._lock:
+            candidates = (self.volunteers_by_city[request.city] | self.volunteers_by_skill[request.request_type])
+            candidates = candidates.intersection(pool)
+            if scorer.full_scan or len(candidates) < k:
+                # pool may have been taken before the last change to the index
+                candidates = self.volunteers.keys() & pool
+            scored = ((scorer.score(request, self.volunteers[user_id]), self.volunteers[user_id])
+                      for user_id in candidates)
+            return heapq.nlargest(k, scored, key=lambda pair: pair[0])
+
+    def nearest_volunteers(self, request_id: str, k: int, distances: CityDistances,
+                           license_level: Optional[int] = None,
+                           max_distance_km: float = UNREACHABLE) -> Optional[List[dict]]:
+        """
+        The k eligible volunteers whose preferred city is nearest to an open request's, walking the cities
+        outwards from the request's and stopping as soon as k are found. Volunteers with the request's skill
+        come first within a city. Requests that require a vehicle only get volunteers with at least
+        MATCHING_CONFIG["vehicle_min_license_level"]. Volunteers outside the MATCHING_CONFIG["nearest_cities"]
+        cities nearest to the request's are not found.
+        :param request_id: Identifier of the request
+        :param k: Number of volunteers to return
+        :param distances: The loaded city distances
+        :param license_level: Only consider volunteers with this license level
+        :param max_distance_km: Only consider volunteers at most this far
+        :return: Volunteers with their distance_km, nearest first, or None if the request is not open
+        """
+        with self._lock:
+            request = self.requests.get(request_id)
+            if request is None:
+                return None
+            min_license = MATCHING_CONFIG["vehicle_min_license_level"] if request.requires_vehicle else None
+            found = []
+            for city, distance in distances.nearest_cities(request.city):
+                # Cities at the same distance as the last one found may still hold better matches
+                if distance > max_distance_km or (len(found) >= k and distance > found[-1][0]):
+                    break
+                eligible = [volunteer for volunteer in map(self.volunteers.get, self.volunteers_by_city[city])
+                            if (license_level is None or volunteer.license_level == license_level)
+                            and (min_license is None or volunteer.license_level >= min_license)]
+                eligible.sort(key=lambda volunteer: (volunteer.skill != request.request_type, volunteer.user_id))
+                found.extend((distance, volunteer) for volunteer in eligible)
+            found.sort(key=lambda pair: (pair[0], pair[1].skill != request.request_type))
+        # The matrix holds float32s, rounded so that 12.3 does not come out as 12.300000190734863
+        return [dict(volunteer._asdict(), distance_km=round(distance, 2)) for distance, volunteer in found[:k]]
+
+    def top_requests(self, volunteer_id: str, k: int, scorer: Scorer) -> Optional[List[dict]]:
+        """
+        The k best open requests for a volunteer. Ties go to urgent requests, then to the oldest ones.
+        :param volunteer_id: User id of an approved volunteer
+        :param k: Number of requests to return
+        :param scorer: How to score the volunteer against a request
+        :return: Ranked requests with their score, or None if the volunteer is not approved
+        """
+        with self._lock:
+            volunteer = self.volunteers.get(volunteer_id)
+            if volunteer is None:
+                return None
+            candidates = self.requests_by_city[volunteer.city] | self.requests_by_type[volunteer.skill]
+            if scorer.full_scan or len(candidates) < k:
+                candidates = self.requests.keys()
+            scored = ((scorer.score(self.requests[request_id], volunteer), self.requests[request_id])
+                      for request_id in candidates)
+            best = heapq.nlargest(k, scored, key=lambda pair: (
+                pair[0], pair[1].is_urgent,
+                -pair[1].created_at.timestamp() if pair[1].created_at else float("-inf")))
+        return [dict(request._asdict(), score=score) for score, request in best]
+
+
+matching_engine = MatchingEngine()
+
+
+def _pending_changes(session: Session) -> list:
+    """
+    Snapshot the index updates implied by the flushed objects. Values are copied now because the
+    objects are expired by the time the transaction commits.
+    """
+    changes = []
+    changed_user_ids = set()
+    for obj in (*session.new, *session.dirty):
+        if obj not in session.new and not session.is_modified(obj):
+            continue
+        if isinstance(obj, Request):
+            if obj.status == OPEN_REQUEST_STATUS:
+                changes.append((matching_engine.upsert_request, RequestEntry(
+                    obj.id, obj.request_type, obj.city, obj.description, bool(obj.is_urgent),
+                    bool(obj.requires_vehicle), obj.created_at)))
+            else:
+                changes.append((matching_engine.remove_request, obj.id))
+        elif isinstance(obj, User):
+            changed_user_ids.add(obj.id)
+        elif isinstance(obj, Volunteer):
+            changed_user_ids.add(obj.user_id)
+    if changed_user_ids:
+        # A volunteer entry needs both rows, whichever of them changed
+        users = get_many(session, User, changed_user_ids)
+        volunteers = get_many(session, Volunteer, changed_user_ids)
+        for user_id in changed_user_ids:
+            user, volunteer = users.get(user_id), volunteers.get(user_id)
+            if user is not None and volunteer is not None and user.status_id == UserStatus.APPROVED:
+                changes.append((matching_engine.upsert_volunteer, VolunteerEntry(
+                    user_id, f"{user.first_name} {user.last_name}", volunteer.preferred_city,
+                    volunteer.preferred_skill, volunteer.license_level)))
+            else:
+                changes.append((matching_engine.remove_volunteer, user_id))
+    for obj in session.deleted:
+        if isinstance(obj, Request):
+            changes.append((matching_engine.remove_request, obj.id))
+        elif isinstance(obj, Volunteer):
+            changes.append((matching_engine.remove_volunteer, obj.user_id))
+    return changes
+
+
+def queue_volunteer_refresh(session: Session, user_ids: List[str]):
+    """
+    For bulk UPDATEs, which bypass the flush listeners: re-read these users in the current transaction
+    and update the index with them on commit.
+    """
+    if matching_engine.loaded_at is None or not user_ids:
+        return
+    approved = [VolunteerEntry(*row) for row in _approved_volunteers(session).filter(Volunteer.user_id.in_(user_ids))]
+    changes = session.info.setdefault("matching_changes", [])
+    changes.extend((matching_engine.upsert_volunteer, volunteer) for volunteer in approved)
+    approved_ids = {volunteer.user_id for volunteer in approved}
+    changes.extend((matching_engine.remove_volunteer, user_id) for user_id in user_ids if user_id not in approved_ids)
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_matching_changes(session: Session, flush_context):
+    if matching_engine.loaded_at is not None:
+        session.info.setdefault("matching_changes", []).extend(_pending_changes(session))
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_matching_changes(session: Session):
+    for apply, value in session.info.pop("matching_changes", ()):
+        apply(value)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_matching_changes(session: Session):
+    session.info.pop("matching_changes", None)
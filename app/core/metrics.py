@@ -0,0 +1,240 @@
+import bisect
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import Pool
+
+# Upper bounds (in seconds) of the HTTP latency and SQL statement duration histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Upper bounds of the SQL statements per HTTP request histogram buckets
+STATEMENT_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Histogram:
+    """
+    Prometheus style histogram. Not thread safe on its own, Metrics updates it under its lock.
+    """
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.bounds = buckets
+        # One extra bucket for values above the last bound
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name: str, labels: dict) -> Iterable[str]:
+        cumulative = 0
+        for bound, count in zip((*self.bounds, "+Inf"), self.counts):
+            cumulative += count
+            yield _sample(f"{name}_bucket", {**labels, "le": bound}, cumulative)
+        yield _sample(f"{name}_sum", labels, self.sum)
+        yield _sample(f"{name}_count", labels, self.count)
+
+
+class DbUsage:
+    """
+    SQL statements sent while serving one HTTP request.
+    """
+    __slots__ = ("statements", "seconds")
+
+    def __init__(self):
+        self.statements = 0
+        self.seconds = 0.0
+
+
+# The DbUsage of the HTTP request being served. The middleware sets it before calling the route, and
+# since the object is shared, statements run from the thread pool or a run_sync call are counted too
+current_db_usage: ContextVar[Optional[DbUsage]] = ContextVar("current_db_usage", default=None)
+
+
+@contextmanager
+def count_statements() -> Iterator[DbUsage]:
+    """
+    Count the SQL statements sent inside the block, e.g. to check that a list query does not send one
+    statement per row. They still count towards the enclosing HTTP request.
+    """
+    outer, usage = current_db_usage.get(), DbUsage()
+    token = current_db_usage.set(usage)
+    try:
+        yield usage
+    finally:
+        current_db_usage.reset(token)
+        if outer is not None:
+            outer.statements += usage.statements
+            outer.seconds += usage.seconds
+
+
+class Metrics:
+    """
+    Per-route HTTP and SQL metrics of this worker process, rendered in the Prometheus text format.
+    Updated from request handlers and engine events on any thread, so every method is thread safe.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.responses: Dict[Tuple[str, str, str], int] = defaultdict(int)
+        self.latency: Dict[Tuple[str, str], Histogram] = {}
+        self.request_statements: Dict[Tuple[str, str], Histogram] = {}
+        self.request_db_seconds: Dict[Tuple[str, str], Histogram] = {}
+        self.statements = Histogram(LATENCY_BUCKETS)
+        self.statement_errors = 0
+
+    def request_started(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def request_finished(self, method: str, route: str, status: int, seconds: float, db: DbUsage):
+        key = (method, route)
+        with self._lock:
+            self.in_flight -= 1
+            self.responses[(method, route, str(status))] += 1
+            if key not in self.latency:
+                self.latency[key] = Histogram(LATENCY_BUCKETS)
+                self.request_statements[key] = Histogram(STATEMENT_COUNT_BUCKETS)
+                self.request_db_seconds[key] = Histogram(LATENCY_BUCKETS)
+            self.latency[key].observe(seconds)
+            self.request_statements[key].observe(db.statements)
+            self.request_db_seconds[key].observe(db.seconds)
+
+    def statement_finished(self, seconds: float, failed: bool = False):
+        usage = current_db_usage.get()
+        if usage is not None:
+            usage.statements += 1
+            usage.seconds += seconds
+        with self._lock:
+            self.statements.observe(seconds)
+            self.statement_errors += failed
+
+    def render(self, pools: Optional[Dict[str, Pool]] = None) -> str:
+        """
+        :param pools: Connection pools (see app.core.database.get_pools) to report the occupancy of
+        :return: The metrics in the Prometheus text exposition format
+        """
+        lines: List[str] = []
+
+        def family(name: str, kind: str, help_text: str, samples: Iterable[str]):
+            lines.extend((f"# HELP {name} {help_text}", f"# TYPE {name} {kind}", *samples))
+
+        def labeled(histograms: Dict[Tuple[str, str], Histogram], name: str):
+            for (method, route), histogram in sorted(histograms.items()):
+                yield from histogram.samples(name, {"method": method, "route": route})
+
+        with self._lock:
+            family("http_requests_in_flight", "gauge", "HTTP requests being served.",
+                   [_sample("http_requests_in_flight", {}, self.in_flight)])
+            family("http_requests_total", "counter", "HTTP responses by route and status code.",
+                   [_sample("http_requests_total", {"method": method, "route": route, "status": status}, count)
+                    for (method, route, status), count in sorted(self.responses.items())])
+            family("http_request_duration_seconds", "histogram", "HTTP request latency by route.",
+                   labeled(self.latency, "http_request_duration_seconds"))
+            family("http_request_db_statements", "histogram", "SQL statements sent per HTTP request, by route.",
+                   labeled(self.request_statements, "http_request_db_statements"))
+            family("http_request_db_seconds", "histogram", "Time spent in SQL statements per HTTP request, by route.",
+                   labeled(self.request_db_seconds, "http_request_db_seconds"))
+            family("db_statement_duration_seconds", "histogram", "Duration of every SQL statement of this process.",
+                   self.statements.samples("db_statement_duration_seconds", {}))
+            family("db_statement_errors_total", "counter", "SQL statements that raised an error.",
+                   [_sample("db_statement_errors_total", {}, self.statement_errors)])
+
+        if pools:
+            occupancy = {name: pool.stats.snapshot(pool) for name, pool in pools.items()}
+            for field, help_text in (("checked_out", "Connections in use."), ("idle", "Idle connections."),
+                                     ("overflow", "Connections above pool_size.")):
+                family(f"db_pool_{field}", "gauge", help_text,
+                       [_sample(f"db_pool_{field}", {"pool": name}, stats[field]) for name, stats in occupancy.items()])
+            for field, help_text in (("checkouts", "Connection checkouts."),
+                                     ("timeouts", "Checkouts that timed out waiting for a connection.")):
+                family(f"db_pool_{field}_total", "counter", help_text,
+                       [_sample(f"db_pool_{field}_total", {"pool": name}, stats[field])
+                        for name, stats in occupancy.items()])
+        return "\n".join(lines) + "\n"
+
+
+def _escape(label_value) -> str:
+    return str(label_value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _sample(name: str, labels: dict, value) -> str:
+    if not labels:
+        return f"{name} {value}"
+    pairs = ",".join(f'{key}="{_escape(label_value)}"' for key, label_value in labels.items())
+    return f"{name}{{{pairs}}} {value}"
+
+
+metrics = Metrics()
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording latency, status and SQL usage of every request under its route template
+    (e.g. /admin/approval/{user_id}/approve), so the label set stays bounded. Requests that match no
+    route are recorded as "unmatched".
+    """
+
+    def __init__(self, app, registry: Metrics = metrics):
+        self.app = app
+        self.metrics = registry
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = 500
+        usage = DbUsage()
+        token = current_db_usage.set(usage)
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        self.metrics.request_started()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            self.metrics.request_finished(scope["method"], _route_label(scope), status, time.perf_counter() - start,
+                                          usage)
+            current_db_usage.reset(token)
+
+
+def _route_label(scope) -> str:
+    if "route" in scope:
+        # FastAPI routes, the path includes the router prefix
+        return scope["route"].path
+    # Plain Starlette routes such as /docs have fixed paths
+    return scope["path"] if "endpoint" in scope else "unmatched"
+
+
+def instrument_engine(engine: Engine, registry: Metrics = metrics):
+    """
+    Time every statement the engine sends. For an AsyncEngine, pass its sync_engine.
+    """
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _start(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_statement_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _finish(conn, cursor, statement, parameters, context, executemany):
+        registry.statement_finished(time.perf_counter() - conn.info["metrics_statement_start"].pop())
+
+    @event.listens_for(engine, "handle_error")
+    def _failed(context):
+        starts = context.connection.info.get("metrics_statement_start") if context.connection else None
+        if starts:
+            registry.statement_finished(time.perf_counter() - starts.pop(), failed=True)
@@ -0,0 +1,55 @@
+import base64
+import json
+from datetime import datetime
+from typing import Callable, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import tuple_
+from sqlalchemy.orm import Query
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+class PageParams(NamedTuple):
+    limit: int = DEFAULT_PAGE_SIZE
+    # (created_at, id) of the last row of the previous page
+    after: Optional[Tuple[datetime, str]] = None
+
+
+def encode_cursor(created_at: datetime, row_id: str) -> str:
+    """
+    Opaque cursor pointing just past the row with this (created_at, id) key.
+    """
+    raw = json.dumps([created_at.isoformat(), row_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    """
+    Inverse of encode_cursor. Raises ValueError if the cursor is malformed.
+    """
+    try:
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(created_at), row_id
+    except (TypeError, ValueError) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def keyset_page(query: Query, created_at_column, id_column, page: PageParams) -> Query:
+    """
+    Restrict query to one page, newest first, using the (created_at, id) composite index
+    instead of OFFSET so every page costs the same.
+    """
+    if page.after is not None:
+        query = query.filter(tuple_(created_at_column, id_column) < tuple_(*page.after))
+    return query.order_by(created_at_column.desc(), id_column.desc()).limit(page.limit)
+
+
+def next_cursor(rows: List, page: PageParams, key: Callable) -> Optional[str]:
+    """
+    Cursor for the page after rows, or None when rows was the last page.
+    :param key: Returns the (created_at, id) of a row
+    """
+    if len(rows) < page.limit:
+        return None
+    return encode_cursor(*key(rows[-1]))
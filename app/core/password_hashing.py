@@ -0,0 +1,183 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import math
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import List, Optional
+
+from fastapi.concurrency import run_in_threadpool
+
+from app.core.config import PASSWORD_HASHING_CONFIG
+
+SCRYPT_PREFIX = "scrypt"
+SALT_BYTES = 16
+KEY_BYTES = 32
+
+
+class HasherBusy(RuntimeError):
+    """
+    Raised when max_pending hashes are already queued and no slot freed up within queue_timeout_seconds.
+    """
+
+
+def _b64(data: bytes) -> str:
+    return base64.b64encode(data).decode()
+
+
+def hash_password(password: str, n: int, r: int, p: int) -> str:
+    """
+    scrypt hash of the password in the form scrypt$n$r$p$salt$key. CPU and memory heavy, call it
+    through PasswordHasher rather than directly from a request handler.
+    """
+    salt = os.urandom(SALT_BYTES)
+    key = hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=256 * n * r * p, dklen=KEY_BYTES)
+    return f"{SCRYPT_PREFIX}${n}${r}${p}${_b64(salt)}${_b64(key)}"
+
+
+def hash_passwords(passwords: List[str], n: int, r: int, p: int) -> List[str]:
+    """
+    hash_password for each password, one pool job for a chunk of a batch (see PasswordHasher.hash_many).
+    """
+    return [hash_password(password, n, r, p) for password in passwords]
+
+
+def verify_password(password: str, encoded: Optional[str]) -> bool:
+    """
+    Check a password against a hash made by hash_password, or against a legacy bare sha256 hex digest.
+    """
+    if not encoded:
+        return False
+    if not encoded.startswith(SCRYPT_PREFIX + "$"):
+        return hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), encoded.lower())
+    _, n, r, p, salt, key = encoded.split("$")
+    n, r, p = int(n), int(r), int(p)
+    expected = base64.b64decode(key)
+    actual = hashlib.scrypt(password.encode(), salt=base64.b64decode(salt), n=n, r=r, p=p,
+                            maxmem=256 * n * r * p, dklen=len(expected))
+    return hmac.compare_digest(actual, expected)
+
+
+def needs_rehash(encoded: Optional[str], config: dict = PASSWORD_HASHING_CONFIG) -> bool:
+    """
+    Whether a stored hash is legacy sha256 or uses other cost parameters than the configured ones.
+    """
+    if not encoded or not encoded.startswith(SCRYPT_PREFIX + "$"):
+        return True
+    _, n, r, p, _, _ = encoded.split("$")
+    return (int(n), int(r), int(p)) != (config["scrypt_n"], config["scrypt_r"], config["scrypt_p"])
+
+
+class PasswordHasher:
+    """
+    Runs hash_password/verify_password in a pool of worker processes, so that hashing neither holds
+    the GIL of the API process nor blocks its event loop. At most max_pending hashes or batches of hashes
+    are queued or running at once, callers beyond that wait for a slot and get HasherBusy if none frees
+    up in time. The pool is started on first use.
+    """
+
+    def __init__(self, config: dict = PASSWORD_HASHING_CONFIG):
+        self.config = config
+        self._slots = threading.BoundedSemaphore(config["max_pending"])
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pool_lock = threading.Lock()
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        with self._pool_lock:
+            if self._pool is None:
+                # spawn rather than fork, the API process has threads and open connections
+                self._pool = ProcessPoolExecutor(max_workers=self.config["workers"],
+                                                 mp_context=multiprocessing.get_context("spawn"))
+            return self._pool
+
+    def _acquire(self):
+        if not self._slots.acquire(timeout=self.config["queue_timeout_seconds"]):
+            raise HasherBusy("Too many password hashes in progress")
+
+    def _submit(self, fn, *args) -> Future:
+        # A slot is taken by the caller beforehand and freed when the work is done
+        try:
+            future = self.pool.submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def _submit_batch(self, passwords: List[str]) -> List[Future]:
+        """
+        Hash passwords in one chunk per pool worker. The batch takes a single slot, taken by the caller
+        beforehand and freed when its last chunk is done, so it either fails before any work or runs whole.
+        """
+        size = math.ceil(len(passwords) / self.config["workers"])
+        chunks = [passwords[i:i + size] for i in range(0, len(passwords), size)]
+        remaining = [len(chunks)]
+        lock = threading.Lock()
+
+        def chunk_done(_):
+            with lock:
+                remaining[0] -= 1
+                if remaining[0]:
+                    return
+            self._slots.release()
+
+        try:
+            futures = [self.pool.submit(hash_passwords, chunk, *self._cost()) for chunk in chunks]
+        except Exception:
+            self._slots.release()
+            raise
+        for future in futures:
+            future.add_done_callback(chunk_done)
+        return futures
+
+    def _cost(self) -> tuple:
+        return self.config["scrypt_n"], self.config["scrypt_r"], self.config["scrypt_p"]
+
+    def _hash_args(self, password: str) -> tuple:
+        return (password, *self._cost())
+
+    def hash(self, password: str) -> str:
+        self._acquire()
+        return self._submit(hash_password, *self._hash_args(password)).result()
+
+    def hash_many(self, passwords: List[str]) -> List[str]:
+        if not passwords:
+            return []
+        self._acquire()
+        return [encoded for future in self._submit_batch(passwords) for encoded in future.result()]
+
+    def verify(self, password: str, encoded: Optional[str]) -> bool:
+        self._acquire()
+        return self._submit(verify_password, password, encoded).result()
+
+    async def _async_acquire(self):
+        if not self._slots.acquire(blocking=False):
+            await run_in_threadpool(self._acquire)
+
+    async def ahash(self, password: str) -> str:
+        await self._async_acquire()
+        return await asyncio.wrap_future(self._submit(hash_password, *self._hash_args(password)))
+
+    async def ahash_many(self, passwords: List[str]) -> List[str]:
+        if not passwords:
+            return []
+        await self._async_acquire()
+        chunks = await asyncio.gather(*(asyncio.wrap_future(future) for future in self._submit_batch(passwords)))
+        return [encoded for chunk in chunks for encoded in chunk]
+
+    async def averify(self, password: str, encoded: Optional[str]) -> bool:
+        await self._async_acquire()
+        return await asyncio.wrap_future(self._submit(verify_password, password, encoded))
+
+    def shutdown(self):
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=True, cancel_futures=True)
+                self._pool = None
+
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,87 @@
+import bisect
+import threading
+import time
+from typing import Dict, Type
+
+from sqlalchemy import exc
+from sqlalchemy.pool import Pool
+
+# Upper bounds (in milliseconds) of the checkout wait-time histogram buckets
+WAIT_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class PoolStats:
+    """
+    Checkout counters and a wait-time histogram for one connection pool.
+    Updated from the pool's checkout path, so every method is thread safe.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total_ms = 0.0
+        # One extra bucket for waits above the last bound
+        self.wait_buckets = [0] * (len(WAIT_BUCKETS_MS) + 1)
+
+    def record_checkout(self, wait_ms: float):
+        with self._lock:
+            self.checkouts += 1
+            self.wait_total_ms += wait_ms
+            self.wait_buckets[bisect.bisect_left(WAIT_BUCKETS_MS, wait_ms)] += 1
+
+    def record_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def snapshot(self, pool: Pool) -> dict:
+        """
+        Current pool occupancy together with the accumulated checkout statistics.
+        :param pool: The pool these stats are attached to
+        :return: JSON-serializable dict
+        """
+        with self._lock:
+            buckets = {f"<={bound}ms": count for bound, count in zip(WAIT_BUCKETS_MS, self.wait_buckets)}
+            buckets[f">{WAIT_BUCKETS_MS[-1]}ms"] = self.wait_buckets[-1]
+            stats = {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "avg_wait_ms": self.wait_total_ms / self.checkouts if self.checkouts else 0.0,
+                "wait_histogram": buckets,
+            }
+        stats.update({
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "idle": pool.checkedin(),
+            # QueuePool counts overflow from -pool_size, only the positive part is real overflow
+            "overflow": max(pool.overflow(), 0),
+        })
+        return stats
+
+
+def timed_pool_class(pool_class: Type[Pool], stats: PoolStats) -> Type[Pool]:
+    """
+    Build a subclass of pool_class that times how long each checkout waits for a connection.
+    The stats are bound to the class so they survive engine.dispose(), which recreates the pool
+    from its class.
+    :param pool_class: QueuePool or AsyncAdaptedQueuePool
+    :param stats: Where checkout waits are recorded
+    :return: The pool class to pass as create_engine(poolclass=...)
+    """
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = pool_class._do_get(self)
+        except exc.TimeoutError:
+            stats.record_timeout()
+            raise
+        stats.record_checkout((time.perf_counter() - start) * 1000)
+        return connection
+
+    return type(f"Timed{pool_class.__name__}", (pool_class,), {"_do_get": _do_get, "stats": stats})
+
+
+def pool_snapshot(pools: Dict[str, Pool]) -> dict:
+    return {name: pool.stats.snapshot(pool) for name, pool in pools.items()}
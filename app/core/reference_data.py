@@ -0,0 +1,108 @@
+import threading
+import time
+from typing import Dict, Optional
+
+from sqlalchemy import event, literal, select, union_all
+from sqlalchemy.orm import Session
+
+from app.core.config import REFERENCE_DATA_CONFIG
+from app.models.request import RequestStatus, RequestType
+from app.models.user import City, License, UserStatus, UserType
+
+# The cached tables, with their id and name columns
+REFERENCE_TABLES = {
+    "cities": (City, City.id, City.city_name),
+    "request_types": (RequestType, RequestType.id, RequestType.type_name),
+    "request_statuses": (RequestStatus, RequestStatus.id, RequestStatus.status_name),
+    "user_types": (UserType, UserType.id, UserType.name),
+    "user_statuses": (UserStatus, UserStatus.id, UserStatus.name),
+    "licenses": (License, License.id, License.license_name),
+}
+
+_REFERENCE_MODELS = tuple(model for model, _, _ in REFERENCE_TABLES.values())
+
+
+class ReferenceData:
+    """
+    id <-> name maps of the reference tables, so that queries can filter and group on the integer
+    foreign keys instead of joining these tables, and responses can carry the names.
+
+    Loaded at startup with a single query, reloaded every REFERENCE_DATA_CONFIG["reload_seconds"],
+    after this process commits a change to one of the tables, when a name is not found, or on demand
+    (POST /admin/reference-data/refresh).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.names: Dict[str, Dict[int, str]] = {table: {} for table in REFERENCE_TABLES}
+        self.ids: Dict[str, Dict[str, int]] = {table: {} for table in REFERENCE_TABLES}
+        self.loaded_at: Optional[float] = None
+        self.version = 0
+        self._stale = False
+
+    def load(self, session: Session):
+        query = union_all(*(select(literal(table).label("table"), id_column, name_column)
+                            for table, (_, id_column, name_column) in REFERENCE_TABLES.items()))
+        names = {table: {} for table in REFERENCE_TABLES}
+        with session.no_autoflush:
+            for table, id_, name in session.execute(query):
+                names[table][id_] = name
+        with self._lock:
+            self.names = names
+            self.ids = {table: {name: id_ for id_, name in rows.items()} for table, rows in names.items()}
+            self.loaded_at = time.monotonic()
+            self.version += 1
+            self._stale = False
+
+    def ensure_loaded(self, session: Session):
+        if (self.loaded_at is None or self._stale
+                or time.monotonic() - self.loaded_at > REFERENCE_DATA_CONFIG["reload_seconds"]):
+            self.load(session)
+
+    def invalidate(self):
+        self._stale = True
+
+    def id_of(self, table: str, name: str, session: Session) -> Optional[int]:
+        """
+        The id of the row named name, or None if there is none.
+        """
+        self.ensure_loaded(session)
+        id_ = self.ids[table].get(name)
+        if id_ is None and time.monotonic() - self.loaded_at > REFERENCE_DATA_CONFIG["miss_reload_seconds"]:
+            self.load(session)
+            id_ = self.ids[table].get(name)
+        return id_
+
+    def name_of(self, table: str, id_: Optional[int]) -> Optional[str]:
+        return self.names[table].get(id_)
+
+    def with_names(self, row: dict, **fields: str) -> dict:
+        """
+        Add a <field>_name entry to row for every field=table pair, e.g. with_names(row, city="cities").
+        """
+        for field, table in fields.items():
+            row[f"{field}_name"] = self.names[table].get(row.get(field))
+        return row
+
+    def snapshot(self) -> dict:
+        return {"version": self.version, "tables": self.names}
+
+
+reference_data = ReferenceData()
+
+
+@event.listens_for(Session, "after_flush")
+def _note_reference_changes(session: Session, flush_context):
+    if any(isinstance(obj, _REFERENCE_MODELS) for obj in (*session.new, *session.dirty, *session.deleted)):
+        session.info["reference_data_changed"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_reference_data(session: Session):
+    if session.info.pop("reference_data_changed", False):
+        reference_data.invalidate()
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_reference_changes(session: Session):
+    session.info.pop("reference_data_changed", None)
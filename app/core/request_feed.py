@@ -0,0 +1,263 @@
+import asyncio
+import logging
+from collections import defaultdict
+from typing import AsyncIterator, Dict, Iterable, Mapping, Optional, Set, Tuple
+
+import asyncpg
+import orjson
+from sqlalchemy import event, inspect, text
+from sqlalchemy.orm import Session
+
+from app.core.config import FEED_CONFIG
+from app.core.loading import get_many
+from app.models.request import Request, RequestProcess
+
+logger = logging.getLogger(__name__)
+
+# Postgres notification channel of the feed
+CHANNEL = "request_feed"
+
+# One round trip for all the changes of a flush. Notifications are only delivered once the transaction
+# commits, and identical ones sent in the same transaction are delivered once
+_NOTIFY = text("SELECT pg_notify(:channel, payload) FROM unnest(CAST(:payloads AS text[])) AS payload")
+
+# Fields of a request sent with its events
+EVENT_FIELDS = ("id", "request_type", "city", "status", "is_urgent", "requires_vehicle", "description",
+                "created_at")
+
+# Sent instead of the events a client missed, which should then fetch GET /api/requests/ again
+_RESYNC = b"event: resync\ndata: {}\n\n"
+_KEEPALIVE = b": keepalive\n\n"
+
+
+def request_event(op: str, values: Mapping, previous: Optional[Mapping] = None) -> bytes:
+    """
+    Notification payload of a change to a request.
+    :param op: "upsert" for a new or changed request, "delete" for a deleted one
+    :param values: The request's columns, a Request or a mapping of them
+    :param previous: The city and request_type of a changed request before the change, when either changed.
+        The volunteers of the old ones get the event too, so that they drop the request
+    """
+    get = values.get if isinstance(values, Mapping) else lambda field: getattr(values, field)
+    request = {field: get(field) for field in EVENT_FIELDS}
+    if request["description"]:
+        request["description"] = request["description"][:FEED_CONFIG["description_chars"]]
+    message = {"op": op, "request": request}
+    if previous:
+        message["previous"] = dict(previous)
+    return orjson.dumps(message)
+
+
+def _previous_keys(request: Request) -> Optional[dict]:
+    """
+    The city and request_type of a flushed request before the flush, or None if neither changed.
+    """
+    state = inspect(request)
+    previous = {}
+    for key in ("city", "request_type"):
+        history = state.attrs[key].history
+        if history.deleted and history.deleted[0] is not None:
+            previous[key] = history.deleted[0]
+    if not previous:
+        return None
+    # Both keys, so that subscribers of either old one are found
+    return {key: previous.get(key, getattr(request, key)) for key in ("city", "request_type")}
+
+
+def publish_request_changes(session: Session, events: Iterable[bytes]):
+    """
+    Notify the feed listeners of every worker of changes made in the session's current transaction.
+    Writes that bypass the ORM flush (bulk INSERTs) call this themselves with request_event payloads.
+    """
+    payloads = [payload.decode() for payload in events]
+    if payloads:
+        session.connection().execute(_NOTIFY, {"channel": CHANNEL, "payloads": payloads})
+
+
+@event.listens_for(Session, "after_flush")
+def _publish_flushed_requests(session: Session, flush_context):
+    changed: Dict[str, Tuple[str, object, Optional[dict]]] = {}
+    progressed = set()
+    for obj in session.new:
+        if isinstance(obj, Request):
+            changed[obj.id] = ("upsert", obj, None)
+    for obj in session.dirty:
+        if isinstance(obj, Request) and session.is_modified(obj):
+            changed[obj.id] = ("upsert", obj, _previous_keys(obj))
+    for obj in (*session.new, *session.dirty):
+        if isinstance(obj, RequestProcess):
+            # Progress of the handling of a request, sent as a change of the request
+            progressed.add(obj.request_id)
+    for request_id, request in get_many(session, Request, progressed.difference(changed)).items():
+        changed[request_id] = ("upsert", request, None)
+    for obj in session.deleted:
+        if isinstance(obj, Request):
+            changed[obj.id] = ("delete", obj, None)
+    publish_request_changes(session, (request_event(*change) for change in changed.values()))
+
+
+class FeedFull(Exception):
+    pass
+
+
+class _Subscriber:
+    __slots__ = ("city", "skill", "queue")
+
+    def __init__(self, city: int, skill: int):
+        self.city = city
+        self.skill = skill
+        self.queue: asyncio.Queue = asyncio.Queue(FEED_CONFIG["queue_size"])
+
+
+def _frame(event_name: str, data: dict) -> bytes:
+    return b"event: " + event_name.encode() + b"\ndata: " + orjson.dumps(data) + b"\n\n"
+
+
+class RequestFeed:
+    """
+    Fans the request notifications out to the open streams of this worker process.
+
+    A single LISTEN connection per process receives the changes committed by every worker. Streams are
+    indexed by the volunteer's preferred city and skill, so an event costs one decode and one lookup
+    whatever the number of clients, and only reaches the volunteers it matches.
+    """
+
+    def __init__(self):
+        self._by_city: Dict[int, Set[_Subscriber]] = defaultdict(set)
+        self._by_skill: Dict[int, Set[_Subscriber]] = defaultdict(set)
+        self._subscribers: Set[_Subscriber] = set()
+        self._listener: Optional[asyncio.Task] = None
+        self._connected: Optional[asyncio.Event] = None
+        self.events_received = 0
+        self.events_sent = 0
+
+    def check_capacity(self):
+        if len(self._subscribers) >= FEED_CONFIG["max_subscribers"]:
+            raise FeedFull(f"The request feed already has {len(self._subscribers)} streams open")
+
+    async def stream(self, city: int, skill: int) -> AsyncIterator[bytes]:
+        """
+        Server-Sent Events for a volunteer with this preferred city and skill: a "ready" event once the
+        feed is listening, then a "request" event for every new, changed or deleted request in that city
+        or of that type, "resync" after events were lost, and keepalive comments. Ends after
+        FEED_CONFIG["max_stream_seconds"], EventSource clients reconnect by themselves.
+        """
+        subscriber = _Subscriber(city, skill)
+        self._subscribers.add(subscriber)
+        self._by_city[city].add(subscriber)
+        self._by_skill[skill].add(subscriber)
+        try:
+            self._ensure_listening()
+            while not self._connected.is_set():
+                try:
+                    await asyncio.wait_for(self._connected.wait(), FEED_CONFIG["keepalive_seconds"])
+                except asyncio.TimeoutError:
+                    yield _KEEPALIVE
+            # Changes committed from now on are in the stream, so this is when the client should fetch
+            # the current state
+            yield b"retry: %d\n" % int(FEED_CONFIG["reconnect_seconds"] * 1000) + _frame("ready", {})
+
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + FEED_CONFIG["max_stream_seconds"]
+            while (remaining := deadline - loop.time()) > 0:
+                try:
+                    frame = await asyncio.wait_for(subscriber.queue.get(),
+                                                   min(FEED_CONFIG["keepalive_seconds"], remaining))
+                except asyncio.TimeoutError:
+                    frame = _KEEPALIVE
+                if frame is None:
+                    break
+                yield frame
+        finally:
+            self._subscribers.discard(subscriber)
+            self._by_city[city].discard(subscriber)
+            self._by_skill[skill].discard(subscriber)
+
+    def _dispatch(self, connection, pid, channel, payload: str):
+        self.events_received += 1
+        message = orjson.loads(payload)
+        request = message["request"]
+        in_city = self._by_city.get(request["city"], ())
+        with_skill = self._by_skill.get(request["request_type"], ())
+        # A request that moved to another city or type is also sent to the volunteers it matched before,
+        # with the match percentage of its new values
+        previous = message.get("previous") or {}
+        matched_before = {*self._by_city.get(previous.get("city"), ()),
+                          *self._by_skill.get(previous.get("request_type"), ())}
+        if not in_city and not with_skill and not matched_before:
+            return
+        # Encoded once per match percentage (see requests_db.get_matched_requests), not once per client
+        frames = {}
+        for subscriber in {*in_city, *with_skill, *matched_before}:
+            match = 50 * ((subscriber in in_city) + (subscriber in with_skill))
+            if match not in frames:
+                frames[match] = _frame("request", dict(message, match_percentage=match))
+            self._send(subscriber, frames[match])
+
+    def _send(self, subscriber: _Subscriber, frame: bytes):
+        try:
+            subscriber.queue.put_nowait(frame)
+            self.events_sent += 1
+        except asyncio.QueueFull:
+            # The client is too slow, replace its backlog with a resync
+            self._replace_backlog(subscriber, _RESYNC)
+
+    @staticmethod
+    def _replace_backlog(subscriber: _Subscriber, frame: Optional[bytes]):
+        while not subscriber.queue.empty():
+            subscriber.queue.get_nowait()
+        subscriber.queue.put_nowait(frame)
+
+    def _ensure_listening(self):
+        if self._listener is None or self._listener.done():
+            self._connected = asyncio.Event()
+            self._listener = asyncio.create_task(self._listen())
+
+    async def _listen(self):
+        from app.core.database import DATABASE_URL
+
+        reconnecting = False
+        while True:
+            connection = None
+            try:
+                connection = await asyncpg.connect(DATABASE_URL)
+                await connection.add_listener(CHANNEL, self._dispatch)
+                if reconnecting:
+                    # Whatever was committed while disconnected was not received
+                    for subscriber in list(self._subscribers):
+                        self._send(subscriber, _RESYNC)
+                self._connected.set()
+                while True:
+                    await asyncio.sleep(FEED_CONFIG["keepalive_seconds"])
+                    # A dropped connection is only noticed when it is used
+                    await connection.execute("SELECT 1", timeout=FEED_CONFIG["reconnect_seconds"])
+            except (OSError, asyncpg.PostgresError, asyncpg.InterfaceError, asyncio.TimeoutError) as e:
+                logger.warning("Request feed listener disconnected, reconnecting: %s", e)
+            except Exception:
+                # Anything else must not end the listener either, the streams would wait for events forever
+                logger.exception("Request feed listener failed, reconnecting")
+            finally:
+                self._connected.clear()
+                if connection is not None:
+                    connection.terminate()
+            reconnecting = True
+            await asyncio.sleep(FEED_CONFIG["reconnect_seconds"])
+
+    async def close(self):
+        """
+        End all streams and stop listening.
+        """
+        for subscriber in list(self._subscribers):
+            self._replace_backlog(subscriber, None)
+        if self._listener is not None:
+            self._listener.cancel()
+            await asyncio.gather(self._listener, return_exceptions=True)
+            self._listener = None
+
+    def stats(self) -> dict:
+        listening = self._connected is not None and self._connected.is_set()
+        return {"subscribers": len(self._subscribers), "listening": listening,
+                "events_received": self.events_received, "events_sent": self.events_sent}
+
+
+request_feed = RequestFeed()
@@ -0,0 +1,165 @@
+from typing import List, Optional
+
+from sqlalchemy.orm import Session, raiseload
+from sqlalchemy.sql import case, func
+
+from app.core.pagination import PageParams, keyset_page
+from app.core.reference_data import reference_data
+from app.models.request import Request
+from app.models.user import User, Family, Volunteer
+from app.schemas.request import RequestModel
+
+
+# Request columns that refer to a reference table, see reference_data.with_names
+REQUEST_NAME_FIELDS = {"city": "cities", "request_type": "request_types", "status": "request_statuses"}
+
+
+def get_matched_requests(session: Session, page: Optional[PageParams] = None) -> List[dict]:
+    """
+    Returns a list of requests with volunteer details and a calculated match percentage.
+
+    The match percentage is computed as:
+      - 100 if both the request's city and request_type match the volunteer's preferred city and skill.
+      - 50 if either the city or the skill matches.
+      - 0 otherwise.
+
+    Filters:
+      - Only include users whose related user_type has an id equal to 2.
+      - Only include users that have been approved (approved_by_id is not null).
+      - Only include requests with a status of 1.
+
+    With page, only that page of requests is returned, newest first.
+    Rows carry the city, request type and status names next to their ids.
+    """
+    # Define the match_percentage expression.
+    match_percentage_expr = case(
+        (
+            (Request.city == Volunteer.preferred_city) &
+            (Request.request_type == Volunteer.preferred_skill),
+            100
+        ),
+        (
+            (Request.city == Volunteer.preferred_city) |
+            (Request.request_type == Volunteer.preferred_skill),
+            50
+        ),
+        else_=0
+    ).label("match_percentage")
+
+    # Build the query with joins and filters.
+    query = (
+        session.query(
+            Request.id.label("request_id"),
+            Request.request_type,
+            Request.description,
+            Request.city,
+            Request.status,
+            Request.is_urgent,
+            Request.created_at,
+            # Concatenate first_name and last_name from the User model.
+            func.concat(User.first_name, " ", User.last_name).label("vol_name"),
+            match_percentage_expr
+        )
+        .join(Family, Family.user_id == Request.family_id)
+        .join(User, User.id == Family.user_id)
+        .join(Volunteer, Volunteer.user_id == User.id)
+        .filter(
+            # Filter using the relationship’s criteria.
+            User.user_type.has(id=2),
+            User.approved_by_id.isnot(None),
+            Request.status == 1
+        )
+    )
+    if page is not None:
+        query = keyset_page(query, Request.created_at, Request.id, page)
+
+    results = query.all()
+    # Convert each result row to a dictionary, with the names from the reference data instead of joins.
+    reference_data.ensure_loaded(session)
+    return [reference_data.with_names(dict(row._mapping), **REQUEST_NAME_FIELDS) for row in results]
+
+
+def request_to_dict(request: Request) -> dict:
+    """
+    The request's columns together with its city, request type and status names.
+    """
+    row = {column.key: getattr(request, column.key) for column in Request.__table__.columns}
+    reference_data.with_names(row, **REQUEST_NAME_FIELDS)
+    # Kept for clients of the old joined request_type_relation
+    row["request_type_relation"] = {"id": request.request_type, "type_name": row["request_type_name"]}
+    return row
+
+
+def get_requests(session: Session, request_id: Optional[str] = None,
+                 page: Optional[PageParams] = None) -> List[dict]:
+    """
+    Retrieve requests together with their city, request type and status names.
+    :param session: SQLAlchemy database session
+    :param request_id: Return only the request with this identifier
+    :param page: Return only this page of requests, newest first
+    :return: List of requests, see request_to_dict
+    """
+    # Only columns are serialized, see request_to_dict
+    query = session.query(Request).options(raiseload("*"))
+    if request_id:
+        query = query.filter(Request.id == request_id)
+    if page is not None:
+        query = keyset_page(query, Request.created_at, Request.id, page)
+    requests = query.all()
+    reference_data.ensure_loaded(session)
+    return [request_to_dict(request) for request in requests]
+
+
+def create_request(session: Session, request: RequestModel) -> Request:
+    """
+    Insert a new request. The session is rolled back and the error re-raised if the insert fails.
+    :param session: SQLAlchemy database session
+    :param request: The request to create
+    :return: The created request
+    """
+    # Leave created_at to the database default unless it was given
+    new_request = Request(**request.model_dump(exclude={"created_at"} if request.created_at is None else None))
+    session.add(new_request)
+    try:
+        session.commit()
+        session.refresh(new_request)
+        return new_request
+    except Exception:
+        session.rollback()
+        raise
+
+
+def update_request(session: Session, request_id: str, updated_request: RequestModel) -> Optional[Request]:
+    """
+    Update an existing request with the fields that were set on updated_request.
+    :param session: SQLAlchemy database session
+    :param request_id: Identifier for the request to update
+    :param updated_request: The new values
+    :return: The updated request if found, None otherwise
+    """
+    db_request = session.query(Request).filter(Request.id == request_id).first()
+    if not db_request:
+        return None
+
+    for key, value in updated_request.model_dump(exclude_unset=True, exclude={"id", "created_at"}).items():
+        setattr(db_request, key, value)
+
+    session.commit()
+    session.refresh(db_request)
+    return db_request
+
+
+def delete_request(session: Session, request_id: str) -> bool:
+    """
+    Delete a request.
+    :param session: SQLAlchemy database session
+    :param request_id: Identifier for the request to delete
+    :return: True if the request was deleted, False if it does not exist
+    """
+    db_request = session.query(Request).filter(Request.id == request_id).first()
+    if not db_request:
+        return False
+
+    session.delete(db_request)
+    session.commit()
+    return True
@@ -0,0 +1,163 @@
+import zlib
+from datetime import timedelta
+from decimal import Decimal
+from typing import Any, Set
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+from starlette.datastructures import Headers, MutableHeaders
+
+from app.core.config import RESPONSE_CONFIG
+
+try:
+    import brotli
+except ImportError:  # brotli compression is optional, gzip is always available
+    brotli = None
+
+
+def _default(obj: Any):
+    # Types orjson does not know, encoded as jsonable_encoder would
+    if isinstance(obj, BaseModel):
+        return obj.model_dump(mode="json")
+    if isinstance(obj, timedelta):
+        return obj.total_seconds()
+    if isinstance(obj, Decimal):
+        return int(obj) if obj.as_tuple().exponent >= 0 else float(obj)
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    return jsonable_encoder(obj)
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSON response rendered with orjson. Datetimes, dicts with integer keys and pydantic models are encoded
+    the same way as by the default response class.
+
+    FastAPI still runs jsonable_encoder over whatever a route returns before rendering it, so routes with
+    large results return a FastJSONResponse themselves, which orjson renders directly.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+def _accepted_encodings(header: str) -> Set[str]:
+    encodings = set()
+    for item in header.split(","):
+        coding, _, params = item.partition(";")
+        try:
+            weight = float(params.replace(" ", "").partition("q=")[2] or 1)
+        except ValueError:
+            weight = 1
+        # q=0 means the coding is not acceptable
+        if weight > 0:
+            encodings.add(coding.strip().lower())
+    return encodings
+
+
+class _CompressionResponder:
+    """
+    Sends the response of app compressed, unless it is smaller than minimum_size, already encoded or an
+    event stream. Streamed responses are compressed chunk by chunk, and every chunk is flushed so that
+    the client gets it right away.
+    """
+    content_encoding: str
+
+    def __init__(self, app, minimum_size: int):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.send = None
+        self.start_message = None
+        self.passthrough = False
+        self.started = False
+
+    async def __call__(self, scope, receive, send):
+        self.send = send
+        await self.app(scope, receive, self.send_compressed)
+
+    async def send_compressed(self, message):
+        if message["type"] == "http.response.start":
+            # Held back until the first body chunk tells whether the headers change
+            self.start_message = message
+            headers = Headers(raw=message["headers"])
+            self.passthrough = ("content-encoding" in headers
+                                or headers.get("content-type", "").startswith("text/event-stream"))
+            return
+        if message["type"] != "http.response.body" or self.passthrough:
+            if not self.started and self.start_message is not None:
+                self.started = True
+                await self.send(self.start_message)
+            return await self.send(message)
+
+        body, more_body = message.get("body", b""), message.get("more_body", False)
+        if not self.started:
+            self.started = True
+            headers = MutableHeaders(raw=self.start_message["headers"])
+            if len(body) < self.minimum_size and not more_body:
+                await self.send(self.start_message)
+                return await self.send(message)
+            headers.add_vary_header("Accept-Encoding")
+            headers["Content-Encoding"] = self.content_encoding
+            body = self.compress(body, more_body=more_body)
+            if more_body:
+                del headers["Content-Length"]
+            else:
+                headers["Content-Length"] = str(len(body))
+            await self.send(self.start_message)
+        else:
+            body = self.compress(body, more_body=more_body)
+        await self.send({**message, "body": body})
+
+    def compress(self, body: bytes, *, more_body: bool) -> bytes:
+        raise NotImplementedError
+
+
+class GzipResponder(_CompressionResponder):
+    content_encoding = "gzip"
+
+    def __init__(self, app, minimum_size: int, level: int):
+        super().__init__(app, minimum_size)
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, body: bytes, *, more_body: bool) -> bytes:
+        return self.compressor.compress(body) + self.compressor.flush(zlib.Z_SYNC_FLUSH if more_body else
+                                                                      zlib.Z_FINISH)
+
+
+class BrotliResponder(_CompressionResponder):
+    content_encoding = "br"
+
+    def __init__(self, app, minimum_size: int, quality: int):
+        super().__init__(app, minimum_size)
+        self.compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, body: bytes, *, more_body: bool) -> bytes:
+        return self.compressor.process(body) + (self.compressor.flush() if more_body else self.compressor.finish())
+
+
+class CompressionMiddleware:
+    """
+    Compresses responses of at least RESPONSE_CONFIG["compression_min_bytes"] with brotli or gzip,
+    whichever the client accepts, preferring brotli. Streamed responses (exports) are compressed chunk by
+    chunk, event streams are left alone.
+    """
+
+    def __init__(self, app, config: dict = RESPONSE_CONFIG):
+        self.app = app
+        self.config = config
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        accepted = _accepted_encodings(Headers(scope=scope).get("accept-encoding", ""))
+        minimum_size = self.config["compression_min_bytes"]
+        if brotli is not None and "br" in accepted:
+            responder = BrotliResponder(self.app, minimum_size, self.config["brotli_quality"])
+        elif "gzip" in accepted:
+            responder = GzipResponder(self.app, minimum_size, self.config["gzip_level"])
+        else:
+            return await self.app(scope, receive, send)
+        await responder(scope, receive, send)
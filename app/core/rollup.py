@@ -0,0 +1,212 @@
+"""
+The request_daily_rollup table: per-day request counts for the dashboard, kept up to date by a flush
+listener. Migration 0006 fills it from the existing rows. Writes that bypass the ORM and
+app/core/bulk_import.py (plain SQL, restoring a dump) are not counted, rebuild the affected days after them:
+
+    python -m app.core.rollup backfill --since 2025-03-01
+"""
+import argparse
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+from typing import Dict, Optional, Set, Tuple
+
+from sqlalchemy import event, func, inspect, select, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from app.core.loading import get_many
+from app.core.reference_data import reference_data
+from app.core.table_versions import bump_versions
+from app.models.request import Request, RequestProcess, RequestStatus, RequestDailyRollup
+
+# Rollup rows use status 0 for requests that have no status
+NO_STATUS = 0
+
+
+def completed_status_id(session: Session) -> Optional[int]:
+    """
+    Id of the RequestStatus.COMPLETED status, from the reference data cache.
+    """
+    return reference_data.id_of("request_statuses", RequestStatus.COMPLETED, session)
+
+
+def database_today(session: Session) -> date:
+    """
+    Today by the clock of the database, which also sets created_at and so the rollup days.
+    """
+    return session.scalar(select(func.current_date()))
+
+
+def full_days(start_date: datetime, end_date: datetime, today: date) -> Optional[Tuple[date, date]]:
+    """
+    The whole days inside [start_date, end_date] that can be read from the rollup. Today is never
+    included because it is still being written to.
+    :param today: Today by the database clock, see database_today
+    :return: (first_day, last_day), or None when the range holds no such day
+    """
+    first_day = start_date.date() if start_date.time() == time.min else start_date.date() + timedelta(days=1)
+    last_day = min(end_date.date(), today) - timedelta(days=1)
+    if first_day > last_day:
+        return None
+    return first_day, last_day
+
+
+def day_start(day: date) -> datetime:
+    return datetime.combine(day, time.min)
+
+
+def _old_value(state, key):
+    history = state.attrs[key].history
+    if history.deleted:
+        return history.deleted[0]
+    return getattr(state.obj(), key)
+
+
+def _request_key(day, city, request_type, status):
+    return day, city, request_type, status if status is not None else NO_STATUS
+
+
+def _completed_day(requests: Dict[str, Request], completed_status: Optional[int], request_id, status, completed_at):
+    """
+    The (day, city) of the request of a completed request_process row, or None.
+    :param requests: The requests of the flushed request_process rows, by id
+    """
+    if status != completed_status or completed_at is None:
+        return None
+    request = requests.get(request_id)
+    if request is None or request.created_at is None:
+        return None
+    return request.created_at.date(), request.city
+
+
+def collect_deltas(session: Session) -> Dict[tuple, int]:
+    """
+    Work out how the pending flush changes the rollup.
+    Days are those of created_at, which the database sets (see Request.__mapper_args__), requests
+    without one are not counted.
+    :return: {(day, city, request_type, status): request_count}
+    """
+    deltas = defaultdict(int)
+
+    def add_request(day, city, request_type, status, sign):
+        deltas[_request_key(day, city, request_type, status)] += sign
+
+    for obj in session.new:
+        if isinstance(obj, Request) and obj.created_at is not None:
+            add_request(obj.created_at.date(), obj.city, obj.request_type, obj.status, 1)
+
+    for obj in session.dirty:
+        if not isinstance(obj, Request) or not session.is_modified(obj):
+            continue
+        state = inspect(obj)
+        keys = ("created_at", "city", "request_type", "status")
+        if not any(state.attrs[key].history.has_changes() for key in keys):
+            continue
+        old_created_at = _old_value(state, "created_at")
+        if old_created_at is not None:
+            add_request(old_created_at.date(), _old_value(state, "city"), _old_value(state, "request_type"),
+                        _old_value(state, "status"), -1)
+        if obj.created_at is not None:
+            add_request(obj.created_at.date(), obj.city, obj.request_type, obj.status, 1)
+
+    for obj in session.deleted:
+        if isinstance(obj, Request) and obj.created_at is not None:
+            add_request(obj.created_at.date(), obj.city, obj.request_type, obj.status, -1)
+
+    return {key: delta for key, delta in deltas.items() if delta}
+
+
+def completed_days(session: Session) -> Set[Tuple[date, int]]:
+    """
+    The (day, city) of the requests whose completion the pending flush changes. The completion statistics
+    are computed from the raw rows, these only tell the dashboard cache what to invalidate.
+    """
+    processes = [obj for obj in (*session.new, *session.dirty, *session.deleted) if isinstance(obj, RequestProcess)]
+    if not processes:
+        return set()
+    # The requests of all the flushed request_process rows, before and after the change, in one query
+    requests = get_many(session, Request, [request_id for obj in processes for request_id in
+                                           (obj.request_id, _old_value(inspect(obj), "request_id"))])
+    completed_status = completed_status_id(session)
+    days = set()
+    for obj in processes:
+        if obj in session.dirty:
+            state = inspect(obj)
+            if not any(state.attrs[key].history.has_changes() for key in ("request_id", "status", "completed_at")):
+                continue
+            days.add(_completed_day(requests, completed_status, _old_value(state, "request_id"),
+                                    _old_value(state, "status"), _old_value(state, "completed_at")))
+        days.add(_completed_day(requests, completed_status, obj.request_id, obj.status, obj.completed_at))
+    days.discard(None)
+    return days
+
+
+def apply_deltas(session: Session, deltas: Dict[tuple, int]):
+    """
+    Add the deltas onto the rollup with a single upsert, in the session's current transaction.
+    """
+    if not deltas:
+        return
+    rows = [
+        {"day": day, "city": city, "request_type": request_type, "status": status, "request_count": count}
+        for (day, city, request_type, status), count in deltas.items()
+    ]
+    stmt = insert(RequestDailyRollup).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["day", "city", "request_type", "status"],
+        set_={"request_count": RequestDailyRollup.request_count + stmt.excluded.request_count}
+    )
+    session.connection().execute(stmt)
+
+
+@event.listens_for(Session, "after_flush")
+def _maintain_rollup(session: Session, flush_context):
+    # new/dirty/deleted and attribute history still describe the flushed changes at this point
+    deltas = collect_deltas(session)
+    apply_deltas(session, deltas)
+    # Picked up on commit to invalidate cached dashboard results (see app/core/cache.py)
+    changes = session.info.setdefault("rollup_changes", set())
+    changes.update((day, city) for day, city, _, _ in deltas)
+    changes.update(completed_days(session))
+
+
+def backfill(session: Session, since: Optional[date] = None):
+    """
+    Rebuild the rollup from the requests table. Writes to it are blocked while this runs so that no
+    change is counted twice or missed.
+    :param session: SQLAlchemy database session
+    :param since: Only rebuild days from this one on
+    """
+    session.execute(text("LOCK TABLE requests IN SHARE MODE"))
+
+    delete = RequestDailyRollup.__table__.delete()
+    if since is not None:
+        delete = delete.where(RequestDailyRollup.day >= since)
+    session.execute(delete)
+
+    day = func.date(Request.created_at)
+    status = func.coalesce(Request.status, NO_STATUS)
+    counts = (
+        select(day, Request.city, Request.request_type, status, func.count(Request.id))
+        .filter(Request.created_at.isnot(None))
+        .group_by(day, Request.city, Request.request_type, status)
+    )
+    if since is not None:
+        counts = counts.filter(Request.created_at >= day_start(since))
+    session.execute(insert(RequestDailyRollup).from_select(
+        ["day", "city", "request_type", "status", "request_count"], counts))
+    bump_versions(session, [RequestDailyRollup.__tablename__])
+    session.commit()
+
+
+if __name__ == "__main__":
+    from app.core.database import SessionLocal
+
+    arg_parser = argparse.ArgumentParser(description="Maintain the request_daily_rollup table")
+    commands = arg_parser.add_subparsers(dest="command", required=True)
+    backfill_parser = commands.add_parser("backfill", help="Rebuild the rollup from the raw tables")
+    backfill_parser.add_argument("--since", type=date.fromisoformat, help="First day to rebuild (YYYY-MM-DD)")
+    args = arg_parser.parse_args()
+
+    with SessionLocal() as db:
+        backfill(db, args.since)
@@ -0,0 +1,58 @@
+from typing import Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from .password_hashing import password_hasher, needs_rehash
+from ..models.user import User
+
+# Unknown emails are checked against this hash so that they take as long to reject as wrong passwords
+_dummy_hash: Optional[str] = None
+
+
+def _get_dummy_hash() -> str:
+    global _dummy_hash
+    if _dummy_hash is None:
+        _dummy_hash = password_hasher.hash("dummy password")
+    return _dummy_hash
+
+
+async def _get_dummy_hash_async() -> str:
+    global _dummy_hash
+    if _dummy_hash is None:
+        _dummy_hash = await password_hasher.ahash("dummy password")
+    return _dummy_hash
+
+
+def authenticate(session: Session, email: str, password: str) -> Optional[User]:
+    """
+    Check a user's email and password. Legacy or outdated hashes are upgraded on a successful sign in.
+    :param session: SQLAlchemy database session
+    :param email: Email of the user signing in
+    :param password: Plain text password
+    :return: The user if the password matches, None otherwise
+    """
+    user = User.get_user_by_email(session, email)
+    valid = password_hasher.verify(password, user.password_hash if user and user.password_hash
+                                   else _get_dummy_hash())
+    if user is None or not user.password_hash or not valid:
+        return None
+    if needs_rehash(user.password_hash):
+        user.password_hash = password_hasher.hash(password)
+        session.commit()
+    return user
+
+
+async def authenticate_async(db: AsyncSession, email: str, password: str) -> Optional[User]:
+    """
+    authenticate for the async stack. Hashing runs in the hashing pool, never in run_sync.
+    """
+    user = await db.run_sync(User.get_user_by_email, email)
+    valid = await password_hasher.averify(password, user.password_hash if user and user.password_hash
+                                          else await _get_dummy_hash_async())
+    if user is None or not user.password_hash or not valid:
+        return None
+    if needs_rehash(user.password_hash):
+        user.password_hash = await password_hasher.ahash(password)
+        await db.commit()
+    return user
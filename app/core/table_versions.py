@@ -0,0 +1,125 @@
+import hashlib
+import json
+import logging
+from typing import Iterable, Optional, Sequence, Tuple
+
+from sqlalchemy import event, select, text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session, SessionTransaction
+from starlette.datastructures import MutableHeaders
+from starlette.requests import Request
+
+from app.models.table_version import TableVersion
+
+logger = logging.getLogger(__name__)
+
+# One statement for all the tables, in a fixed order so that concurrent bumps cannot deadlock
+_BUMP = text("INSERT INTO table_versions (table_name, version) "
+             "SELECT table_name, 1 FROM unnest(CAST(:tables AS text[])) AS table_name ORDER BY table_name "
+             "ON CONFLICT (table_name) DO UPDATE SET version = table_versions.version + 1")
+
+
+def bump_versions(session: Session, tables: Iterable[str]):
+    """
+    Bump the versions of tables once the session's current transaction has committed, nothing is bumped
+    if it rolls back. Writes that bypass the ORM flush (bulk INSERT/UPDATE, raw SQL) call this themselves.
+    """
+    tables = set(tables)
+    if tables:
+        session.info.setdefault("version_bumps", set()).update(tables)
+        # Reads of these tables stay on the primary for a while after the commit, see ReplicaRouter
+        session.info.setdefault("written_tables", set()).update(tables)
+
+
+def current_versions(session: Session, tables: Sequence[str]) -> Tuple[int, ...]:
+    """
+    The versions of tables, in order. A table that was never written through the app is at version 0.
+    """
+    query = select(TableVersion.table_name, TableVersion.version).where(TableVersion.table_name.in_(tables))
+    versions = dict(session.execute(query).all())
+    return tuple(versions.get(table, 0) for table in tables)
+
+
+def make_etag(request: Request, versions: Tuple[int, ...]) -> str:
+    """
+    Weak ETag of a GET response that only depends on the route, its query parameters and the versions
+    of the tables it reads. Weak, because the compressed and uncompressed bodies differ byte for byte.
+    """
+    key = json.dumps([request.url.path, sorted(request.query_params.multi_items()), versions])
+    return f'W/"{hashlib.sha1(key.encode()).hexdigest()[:20]}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Weak comparison of etag against an If-None-Match header.
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag.removeprefix("W/") for tag in if_none_match.split(","))
+
+
+class ETagMiddleware:
+    """
+    Sends the ETag computed by the conditional_get dependency (app/api/dependencies.py) with the
+    successful response of the route, whatever response class the route returned.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "GET":
+            return await self.app(scope, receive, send)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and message["status"] == 200:
+                etag = scope.get("state", {}).get("etag")
+                if etag is not None:
+                    headers = MutableHeaders(scope=message)
+                    headers["ETag"] = etag
+                    # Cache, but revalidate with If-None-Match before every use
+                    headers["Cache-Control"] = "no-cache"
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+
+@event.listens_for(Session, "after_flush")
+def _bump_flushed_tables(session: Session, flush_context):
+    tables = {obj.__table__.name for obj in (*session.new, *session.deleted)}
+    tables.update(obj.__table__.name for obj in session.dirty if session.is_modified(obj))
+    bump_versions(session, tables)
+
+
+# Bumping the version rows inside the writing transactions would serialize all the writers of a table on
+# its row. They are bumped after the commit instead, in a statement of their own. A read between the two
+# gets the old version with the new data, which only costs its client one more full response later
+@event.listens_for(Session, "after_commit")
+def _collect_committed_bumps(session: Session):
+    tables = session.info.pop("version_bumps", None)
+    if tables:
+        session.info.setdefault("committed_version_bumps", set()).update(tables)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_rolled_back_bumps(session: Session):
+    session.info.pop("version_bumps", None)
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _bump_committed_tables(session: Session, transaction: SessionTransaction):
+    # By now the session has given its connection back, so this cannot wait on a pool it holds a slot of.
+    # Savepoints wait for the whole transaction to end
+    if transaction.parent is not None:
+        return
+    tables = session.info.pop("committed_version_bumps", None)
+    if not tables:
+        return
+    try:
+        with session.get_bind().engine.connect() as connection:
+            connection.execution_options(isolation_level="AUTOCOMMIT").execute(_BUMP, {"tables": sorted(tables)})
+    except SQLAlchemyError as e:
+        # The versions change with the next write, until then conditional GETs of these tables can get a 304
+        logger.warning("Could not bump the versions of %s: %s", ", ".join(sorted(tables)), e)
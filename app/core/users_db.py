@@ -0,0 +1,55 @@
+from typing import List, Optional, Sequence
+
+from sqlalchemy.orm import Session, raiseload, selectinload
+
+from app.core.pagination import PageParams, keyset_page
+from app.core.reference_data import reference_data
+from app.models.user import User
+
+# Never sent to clients
+PRIVATE_USER_FIELDS = {"password_hash"}
+# User columns that refer to a reference table, and the table holding their names
+USER_NAME_FIELDS = {"city_id": ("city_name", "cities"), "user_type_id": ("user_type_name", "user_types"),
+                    "status_id": ("status_name", "user_statuses")}
+# The family and volunteer profiles are loaded with one query each per page, whatever the page size.
+# Their own relationships are never serialized
+USER_PROFILE_OPTIONS = (selectinload(User.families).raiseload("*"), selectinload(User.volunteers).raiseload("*"))
+
+
+def _columns(obj, exclude=()) -> dict:
+    return {attr.key: getattr(obj, attr.key) for attr in obj.__mapper__.column_attrs if attr.key not in exclude}
+
+
+def user_to_dict(user: User) -> dict:
+    """
+    The user's columns, without the password hash, with the names of its city, type and status, and its
+    family or volunteer profile. The profiles must have been loaded with USER_PROFILE_OPTIONS.
+    """
+    row = _columns(user, PRIVATE_USER_FIELDS)
+    for field, (name_field, table) in USER_NAME_FIELDS.items():
+        row[name_field] = reference_data.name_of(table, row[field])
+    row["family"] = _columns(user.families, ("user_id",)) if user.families is not None else None
+    row["volunteer"] = _columns(user.volunteers, ("user_id",)) if user.volunteers is not None else None
+    return row
+
+
+def get_users_page(session: Session, page: Optional[PageParams] = None, filters: Sequence = (),
+                   options: Sequence = ()) -> List[User]:
+    """
+    Users matching filters, one page of them, newest first, when page is given.
+    :param options: Loader options for the relationships the caller needs, any other relationship raises
+        when accessed instead of sending one query per user
+    """
+    query = session.query(User).options(*options, raiseload("*")).filter(*filters)
+    if page is not None:
+        query = keyset_page(query, User.created_at, User.id, page)
+    return query.all()
+
+
+def get_users_with_profiles(session: Session, page: Optional[PageParams] = None) -> List[dict]:
+    """
+    A page of users, newest first, see user_to_dict. Three queries, whatever the page size.
+    """
+    users = get_users_page(session, page, options=USER_PROFILE_OPTIONS)
+    reference_data.ensure_loaded(session)
+    return [user_to_dict(user) for user in users]
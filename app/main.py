@@ -1,25 +1,115 @@
-from fastapi import FastAPI
+import logging
+import time
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware  # Import CORS middleware
 
-from .api.endpoints.admin.dashboard import dashboard_router
-from .api.endpoints.users import users_router
-from .api.endpoints.admin.approval_api import approve_users
+from .api.endpoints.admin.dashboard import dashboard_router, async_dashboard_router
+from .api.endpoints.users import users_router, async_users_router
+from .api.endpoints.admin.approval_api import approve_users, async_approve_users
+from .api.endpoints.admin.pool_api import pool_router
+from .api.endpoints.admin.reference_api import reference_router, async_reference_router
+from .api.endpoints.requests import request_router, async_request_router
+from .core.city_distances import city_distances
+from .core.config import USE_ASYNC_DB, EMAIL_CONFIG
+from .core.database import SessionLocal, get_pools, warm_up_pools, async_warm_up_pools, dispose_engines
+from .core.email_outbox import EmailDispatcher
+from .core.matching import matching_engine
+from .core.metrics import CONTENT_TYPE, MetricsMiddleware, metrics
+from .core.password_hashing import password_hasher, HasherBusy
+from .core.reference_data import reference_data
+from .core.request_feed import request_feed
+from .core.responses import CompressionMiddleware, FastJSONResponse
+from .core.table_versions import ETagMiddleware
+
+logger = logging.getLogger(__name__)
+
 
-app = FastAPI()
+async def warm_up():
+    """
+    Open the connections of the database pools and load the in-memory caches, so that the first requests
+    a worker serves do not pay for them. Runs before the worker accepts connections.
+    """
+    start = time.perf_counter()
+    if USE_ASYNC_DB:
+        await async_warm_up_pools()
+    else:
+        warm_up_pools()
+    with SessionLocal() as db:
+        reference_data.load(db)
+        city_distances.load(db)
+        matching_engine.load(db)
+    logger.info("Worker warmed up in %.2f s", time.perf_counter() - start)
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # Allows all origins (you can restrict this in production)
-    allow_credentials=True,
-    allow_methods=["*"],  # Allows all methods (GET, POST, PATCH, etc.)
-    allow_headers=["*"],  # Allows all headers
-)
 
-app.include_router(users_router, prefix="/users")
-app.include_router(dashboard_router, prefix="/admin/dashboard")
-app.include_router(approve_users, prefix="/admin/approval")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await warm_up()
+    dispatcher = None
+    if EMAIL_CONFIG["dispatcher_enabled"]:
+        dispatcher = EmailDispatcher(SessionLocal)
+        dispatcher.start()
+    yield
+    # In-flight requests are done by now, see app/serve.py
+    if dispatcher is not None:
+        dispatcher.stop(timeout=EMAIL_CONFIG["timeout_seconds"])
+    # Ends the open request feed streams and closes its LISTEN connection
+    await request_feed.close()
+    password_hasher.shutdown()
+    await dispose_engines()
+
+
+async def hasher_busy_handler(request: Request, exc: HasherBusy):
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "1"})
 
 
-@app.get("/")
 def health_check():
     return "hello world"
+
+
+def get_metrics():
+    """
+    Per-route latency, status and SQL statement metrics of this worker process, in Prometheus text format.
+    """
+    return Response(metrics.render(get_pools()), media_type=CONTENT_TYPE)
+
+
+def create_app() -> FastAPI:
+    """
+    The API with all its routers: /api, /users, /admin/... Served by app/serve.py in production, by
+    `uvicorn --factory app.main:create_app` in development.
+    """
+    app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse)
+    app.add_exception_handler(HasherBusy, hasher_busy_handler)
+
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],  # Allows all origins (you can restrict this in production)
+        allow_credentials=True,
+        allow_methods=["*"],  # Allows all methods (GET, POST, PATCH, etc.)
+        allow_headers=["*"],  # Allows all headers
+    )
+    app.add_middleware(ETagMiddleware)
+    app.add_middleware(CompressionMiddleware)
+    # Added last so that it is the outermost middleware and its latency covers the others
+    app.add_middleware(MetricsMiddleware)
+
+    if USE_ASYNC_DB:
+        app.include_router(async_request_router, prefix="/api")
+        app.include_router(async_users_router, prefix="/users")
+        app.include_router(async_dashboard_router, prefix="/admin/dashboard")
+        app.include_router(async_approve_users, prefix="/admin/approval")
+        app.include_router(async_reference_router, prefix="/admin/reference-data")
+    else:
+        app.include_router(request_router, prefix="/api")
+        app.include_router(users_router, prefix="/users")
+        app.include_router(dashboard_router, prefix="/admin/dashboard")
+        app.include_router(approve_users, prefix="/admin/approval")
+        app.include_router(reference_router, prefix="/admin/reference-data")
+    app.include_router(pool_router, prefix="/admin/pool")
+
+    app.add_api_route("/", health_check, methods=["GET"])
+    app.add_api_route("/metrics", get_metrics, methods=["GET"])
+    return app
@@ -0,0 +1,32 @@
+from sqlalchemy import Column, Integer, String, Text, TIMESTAMP, Index
+
+from app.models.request import Base
+
+
+class EmailOutbox(Base):
+    """
+    Emails waiting to be sent by the dispatcher in app/core/email_outbox.py. A row is written in
+    the same transaction as the change that triggers the email, so it is sent if and only if
+    that change is committed.
+    """
+    __tablename__ = 'email_outbox'
+
+    PENDING = "pending"
+    SENT = "sent"
+    DEAD = "dead"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    to_email = Column(String(100), nullable=False)
+    subject = Column(String(200), nullable=False)
+    body = Column(Text, nullable=True)  # cleared once sent, it may hold credentials
+    status = Column(String(10), nullable=False, default=PENDING)
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(TIMESTAMP, nullable=False, server_default='NOW()')
+    last_error = Column(Text, nullable=True)
+    created_at = Column(TIMESTAMP, server_default='NOW()')
+    sent_at = Column(TIMESTAMP, nullable=True)
+
+    __table_args__ = (
+        # The dispatcher only ever looks for pending rows that are due
+        Index("ix_email_outbox_due", "next_attempt_at", postgresql_where=(status == PENDING)),
+    )
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, Text, ForeignKey, TIMESTAMP, CHAR
+from sqlalchemy import Column, Integer, String, Boolean, Text, ForeignKey, TIMESTAMP, CHAR, Date, Index, text
 from sqlalchemy.orm import relationship, declarative_base
 
 Base = declarative_base()
@@ -36,7 +36,7 @@ class Request(Base):
     expected_completion = Column(TIMESTAMP, nullable=True)
     preferred_datetime = Column(TIMESTAMP, nullable=True)
 
-    created_at = Column(TIMESTAMP, server_default='NOW()')
+    created_at = Column(TIMESTAMP, server_default='NOW()', nullable=False)
 
     family_relation = relationship("Family", back_populates="requests")
     request_type_relation = relationship("RequestType", back_populates="requests")
@@ -45,6 +45,17 @@ class Request(Base):
     assigned_volunteer_relation = relationship("Volunteer", back_populates="requests")
     request_processes = relationship("RequestProcess", back_populates="request_relation")
 
+    # Fetch created_at back on insert so flush listeners (see app/core/rollup.py) can see it
+    __mapper_args__ = {"eager_defaults": True}
+    __table_args__ = (
+        # Keyset pagination of the request lists (see app/core/pagination.py)
+        Index("ix_requests_created_at_id", "created_at", "id"),
+        # Dashboard counts over a created_at range, answered from the index alone
+        Index("ix_requests_created_at_city_status_type", "created_at", "city", "status", "request_type"),
+        # Open requests (status 1): the matched requests list and the matching engine
+        Index("ix_requests_open_created_at_id", "created_at", "id", postgresql_where=text("status = 1")),
+    )
+
 
 class RequestProcess(Base):
     __tablename__ = 'request_process'
@@ -62,6 +73,11 @@ class RequestProcess(Base):
     volunteer_relation = relationship("Volunteer", back_populates="request_processes")
     status_relation = relationship("RequestStatus", back_populates="request_processes")
 
+    __table_args__ = (
+        # Completion times and rollup maintenance look up the process rows of a request by status
+        Index("ix_request_process_request_id_status", "request_id", "status"),
+    )
+
 
 class RequestType(Base):
     __tablename__ = 'request_types'
@@ -71,3 +87,17 @@ class RequestType(Base):
 
     requests = relationship("Request", back_populates="request_type_relation")
     volunteers = relationship("Volunteer", back_populates="preferred_skill_relation")
+
+
+class RequestDailyRollup(Base):
+    """
+    Per-day request counts, maintained by app/core/rollup.py, keyed by the request's current status
+    (0 when it has none).
+    """
+    __tablename__ = 'request_daily_rollup'
+
+    day = Column(Date, primary_key=True)
+    city = Column(Integer, primary_key=True)
+    request_type = Column(Integer, primary_key=True)
+    status = Column(Integer, primary_key=True)
+    request_count = Column(Integer, nullable=False, default=0)
@@ -0,0 +1,14 @@
+from sqlalchemy import BigInteger, Column, String
+
+from app.models.request import Base
+
+
+class TableVersion(Base):
+    """
+    Change counter of a table, bumped right after every write made through the app commits
+    (see app/core/table_versions.py). Conditional GETs compare these instead of running their queries.
+    """
+    __tablename__ = 'table_versions'
+
+    table_name = Column(String(63), primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0)
@@ -1,10 +1,10 @@
 from datetime import datetime
-from typing import List, Optional, Callable
+from typing import List, Optional, Callable, Sequence
 
-from sqlalchemy import Column, Integer, String, Boolean, Text, ForeignKey, CHAR, DateTime, \
-    SQLColumnExpression
+from sqlalchemy import Column, Integer, String, Boolean, Text, ForeignKey, CHAR, DateTime, Index, \
+    SQLColumnExpression, text, Float
 from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy.orm import relationship, Mapped, Session
+from sqlalchemy.orm import relationship, Mapped, Session, raiseload
 
 from app.models.request import Base
 
@@ -44,6 +44,18 @@ class City(Base):
     requests = relationship("Request", back_populates="city_relation")  # Relationship to Request table
 
 
+class CityDistance(Base):
+    """
+    Travel distance between two cities, loaded into the matrix of app/core/city_distances.py.
+    A pair stored in one direction only counts for both.
+    """
+    __tablename__ = 'city_distances'
+
+    from_city = Column(Integer, ForeignKey('cities.id', ondelete='CASCADE'), primary_key=True)
+    to_city = Column(Integer, ForeignKey('cities.id', ondelete='CASCADE'), primary_key=True)
+    distance_km = Column(Float, nullable=False)
+
+
 class User(Base):
     __tablename__ = 'users'  # Table name in the database
 
@@ -65,7 +77,8 @@ class User(Base):
 
     approved_at: Optional[datetime] = Column(DateTime,
                                              nullable=True)  # Timestamp for when the user was approved (optional)
-    created_at: datetime = Column(DateTime, default=datetime.now)  # Timestamp for when the user record was created
+    # Timestamp for when the user record was created
+    created_at: datetime = Column(DateTime, default=datetime.now, server_default=text('NOW()'), nullable=False)
 
     city_id: int = Column("city", Integer, ForeignKey("cities.id"),
                           nullable=False)  # Foreign key reference to Cities table
@@ -78,6 +91,16 @@ class User(Base):
     families = relationship("Family", uselist=False, back_populates="user")
     volunteers = relationship("Volunteer", uselist=False, back_populates="user")
 
+    __table_args__ = (
+        # Keyset pagination of all users and of users by status (see app/core/users_db.py)
+        Index("ix_users_created_at_id", "created_at", "id"),
+        Index("ix_users_user_status_created_at_id", "user_status", "created_at", "id"),
+        # The approval queue (pending users, user_status 0)
+        Index("ix_users_pending_created_at_id", "created_at", "id", postgresql_where=text("user_status = 0")),
+        # Joins from the CHAR(9) families.user_id and volunteers.user_id compare id::bpchar
+        Index("ix_users_id_bpchar", text("(id::bpchar)")),
+    )
+
     @classmethod
     def update_user(cls, session: Session, user_id: str, **kwargs: dict) -> Optional['User']:
         """
@@ -113,17 +136,18 @@ class User(Base):
 
     @classmethod
     def get_users(cls, session: Session, order_by: Optional[List[Callable]] = None,
-                  filters: Optional[List[SQLColumnExpression]] = None) \
-            -> List['User']:
+                  filters: Optional[List[SQLColumnExpression]] = None, options: Sequence = ()) -> List['User']:
         """
         Retrieve a list of users from the database based on the provided filters.
         :param session: SQLAlchemy database session
         :param order_by: List of functions to order the results. Look at asc() and desc() from sqlalchemy
         :param filters: Filters to apply to the query
+        :param options: Loader options for the relationships the caller needs, e.g. selectinload(User.families).
+            Any other relationship raises when accessed instead of sending one query per user
         :return: List of users matching the filters
         """
 
-        query = session.query(cls)
+        query = session.query(cls).options(*options, raiseload("*"))
 
         # Apply filters if provided
         if filters is not None:
@@ -145,6 +169,16 @@ class User(Base):
         """
         return session.query(User).filter_by(id=user_id).first()
 
+    @classmethod
+    def get_user_by_email(cls, session: Session, email: str) -> Optional['User']:
+        """
+        Retrieve a user from the database based on their email.
+        :param session: SQLAlchemy database session
+        :param email: Email of the user to retrieve
+        :return: The user if found, None otherwise
+        """
+        return session.query(User).filter_by(email=email).first()
+
 
 class Family(Base):
     __tablename__ = 'families'
@@ -47,14 +47,17 @@ class RequestStatus(Base):
     requests = relationship("Request", back_populates="status")
 
 class RequestModel(BaseModel):
-    id: Optional[str] = Field(default_factory=lambda: str(uuid.uuid4()), description="Unique request ID")
-    family_id: int
-    request_type: RequestType
+    # requests.id is CHAR(9)
+    id: Optional[str] = Field(default_factory=lambda: uuid.uuid4().hex[:9], max_length=9,
+                              description="Unique request ID")
+    family_id: str = Field(..., max_length=9)
+    request_type: int  # id in request_types
     description: Optional[str] = None
     city: int
     status: Optional[int] = 1
     is_urgent: Optional[bool] = False
-    assigned_volunteer_id: Optional[int] = None
+    requires_vehicle: Optional[bool] = False
+    assigned_volunteer_id: Optional[str] = Field(None, max_length=9)
     expected_completion: Optional[datetime] = None
     preferred_datetime: Optional[datetime] = None
     created_at: Optional[datetime] = None  # Only set when returning a request
@@ -1,9 +1,6 @@
 # Pydantic schemas for user
 from pydantic import BaseModel, Field, field_validator, EmailStr
 from typing import Optional
-import re
-
-HASH_REGEX = re.compile(r"^[a-fA-F0-9]{32,64}$")
 
 
 class DTO_users_for_post_signup(BaseModel):
@@ -37,5 +34,5 @@ class DTO_for_family_signup(DTO_users_for_signup):
 class UserDTO_for_signin(BaseModel):
     #data to get from users when signing in
     email: EmailStr
-    password: str = Field(..., regex=HASH_REGEX.pattern)
-    first_sign_in: bool
\ No newline at end of file
+    password: str = Field(..., min_length=1, max_length=128)  # plain text, hashed on the server
+    first_sign_in: bool = False
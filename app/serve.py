@@ -0,0 +1,106 @@
+"""
+Production server: the app of app.main.create_app in several uvicorn worker processes sharing one socket.
+
+    python -m app.serve --workers 4
+
+Every worker warms up (see app.main.warm_up) before it accepts connections. On SIGTERM or SIGINT the
+workers stop accepting, end the open request feed streams, let the in-flight requests finish for up to
+SERVER_GRACEFUL_SHUTDOWN_SECONDS and then shut the app down.
+"""
+import argparse
+import logging
+import math
+import os
+from typing import Dict, Mapping
+
+import uvicorn
+from uvicorn.supervisors import Multiprocess
+
+from app.core.config import DASHBOARD_CACHE_CONFIG, DB_POOL_CONFIG, REPLICA_CONFIG, SERVER_CONFIG
+
+logger = logging.getLogger(__name__)
+
+
+def available_cpus() -> int:
+    """
+    CPUs this process may run on, capped by the CPU quota of its container (cgroup v2).
+    """
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            cpus = min(cpus, max(1, math.ceil(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+
+def worker_environment(workers: int, cpus: int, config: dict = SERVER_CONFIG,
+                       environ: Mapping[str, str] = os.environ) -> Dict[str, str]:
+    """
+    Settings of every worker process that depend on how many there are, as environment variables read by
+    app/core/config.py when the worker starts.
+    :param environ: Environment of the server, the settings it sets are kept
+    :raise ValueError: If DB_POOL_SIZE and DB_MAX_OVERFLOW are set to more than config["db_connections"]
+    leaves every engine
+    """
+    environment = {}
+    if config["db_connections"]:
+        # Every engine of app/core/database.py has its own pool
+        engines = 4 if REPLICA_CONFIG["url"] else 2
+        share = max(1, config["db_connections"] // (workers * engines))
+        pool_size = int(environ.get("DB_POOL_SIZE", min(DB_POOL_CONFIG["pool_size"], share)))
+        max_overflow = int(environ.get("DB_MAX_OVERFLOW", max(0, share - pool_size)))
+        if pool_size + max_overflow > share:
+            raise ValueError(f"DB_POOL_SIZE={pool_size} and DB_MAX_OVERFLOW={max_overflow} allow more than the "
+                             f"{share} connections each of the {engines} engines of {workers} workers may have "
+                             f"within SERVER_DB_CONNECTIONS={config['db_connections']}")
+        environment.update(DB_POOL_SIZE=str(pool_size), DB_MAX_OVERFLOW=str(max_overflow))
+    # The password hashing processes of all the workers share the CPUs
+    if "PASSWORD_HASHING_WORKERS" not in environ:
+        environment["PASSWORD_HASHING_WORKERS"] = str(max(1, cpus // workers))
+    return environment
+
+
+class Server(uvicorn.Server):
+
+    async def shutdown(self, sockets=None):
+        from app.core.request_feed import request_feed
+
+        # Feed streams only end by themselves after FEED_MAX_STREAM_SECONDS, the drain would wait for them.
+        # Their clients reconnect to another worker or server
+        await request_feed.close()
+        await super().shutdown(sockets)
+
+
+def serve(host: str, port: int, workers: int, config: dict = SERVER_CONFIG):
+    cpus = available_cpus()
+    workers = workers or cpus
+    environment = worker_environment(workers, cpus, config)
+    # Inherited by the worker processes
+    os.environ.update(environment)
+    logger.info("Starting %d workers on %d CPUs with %s", workers, cpus, environment)
+    if workers > 1 and DASHBOARD_CACHE_CONFIG["enabled"] and not DASHBOARD_CACHE_CONFIG["redis_url"]:
+        logger.warning("Every worker has its own dashboard cache, results stay stale for up to %s s after a "
+                       "write in another worker. Set DASHBOARD_CACHE_REDIS_URL to share it",
+                       DASHBOARD_CACHE_CONFIG["ttl_seconds"])
+
+    server_config = uvicorn.Config("app.main:create_app", factory=True, host=host, port=port, workers=workers,
+                                   timeout_graceful_shutdown=config["graceful_shutdown_seconds"],
+                                   log_level=config["log_level"])
+    server = Server(server_config)
+    if workers == 1:
+        server.run()
+    else:
+        Multiprocess(server_config, target=server.run, sockets=[server_config.bind_socket()]).run()
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--host", default=SERVER_CONFIG["host"])
+    arg_parser.add_argument("--port", type=int, default=SERVER_CONFIG["port"])
+    arg_parser.add_argument("--workers", type=int, default=SERVER_CONFIG["workers"], help="0 for one per CPU")
+    args = arg_parser.parse_args()
+    logging.basicConfig(level=SERVER_CONFIG["log_level"].upper(), format="%(levelname)s:     %(message)s")
+    serve(args.host, args.port, args.workers)
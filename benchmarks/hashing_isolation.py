@@ -0,0 +1,102 @@
+"""
+Latency of a cheap endpoint while a burst of password hashes is running, with the hashes computed
+inline in the request handler versus in the password hashing pool (app/core/password_hashing.py).
+
+    python -m benchmarks.hashing_isolation --seconds 5 --hash-clients 8
+
+Runs its own server on localhost and needs no database.
+"""
+import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+import uvicorn
+from fastapi import FastAPI
+
+from app.core.config import PASSWORD_HASHING_CONFIG
+from app.core.password_hashing import PasswordHasher, hash_password
+from benchmarks.report import percentile
+
+
+def build_app(hasher: PasswordHasher) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/ping")
+    async def ping():
+        return "pong"
+
+    @app.post("/hash/inline")
+    async def hash_inline():
+        return hash_password("benchmark password", PASSWORD_HASHING_CONFIG["scrypt_n"],
+                             PASSWORD_HASHING_CONFIG["scrypt_r"], PASSWORD_HASHING_CONFIG["scrypt_p"])
+
+    @app.post("/hash/pool")
+    async def hash_pool():
+        return await hasher.ahash("benchmark password")
+
+    return app
+
+
+def measure_pings(base_url: str, seconds: float):
+    latencies = []
+    with requests.Session() as http:
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            http.get(f"{base_url}/ping").raise_for_status()
+            latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def hash_burst(url: str, clients: int, stop: threading.Event, counter: list):
+    def client():
+        with requests.Session() as http:
+            while not stop.is_set():
+                http.post(url).raise_for_status()
+                counter.append(1)
+
+    with ThreadPoolExecutor(clients) as executor:
+        for _ in range(clients):
+            executor.submit(client)
+
+
+def run(seconds: float, hash_clients: int, port: int):
+    hasher = PasswordHasher()
+    hasher.hash("warm up the worker processes")
+    server = uvicorn.Server(uvicorn.Config(build_app(hasher), port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    base_url = f"http://127.0.0.1:{port}"
+
+    print(f"scrypt n={PASSWORD_HASHING_CONFIG['scrypt_n']} r={PASSWORD_HASHING_CONFIG['scrypt_r']} "
+          f"p={PASSWORD_HASHING_CONFIG['scrypt_p']}, {PASSWORD_HASHING_CONFIG['workers']} hashing workers, "
+          f"{hash_clients} hashing clients")
+    print(f"{'scenario':<14}{'pings':>7}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}{'hashes/s':>10}")
+    for scenario in ("idle", "inline", "pool"):
+        stop, hashes = threading.Event(), []
+        burst = None
+        if scenario != "idle":
+            burst = threading.Thread(target=hash_burst,
+                                     args=(f"{base_url}/hash/{scenario}", hash_clients, stop, hashes))
+            burst.start()
+        latencies = measure_pings(base_url, seconds)
+        stop.set()
+        if burst is not None:
+            burst.join()
+        print(f"{scenario:<14}{len(latencies):>7}{percentile(latencies, 50):>9.1f}{percentile(latencies, 95):>9.1f}"
+              f"{percentile(latencies, 99):>9.1f}{max(latencies):>9.1f}{len(hashes) / seconds:>10.1f}")
+
+    server.should_exit = True
+    hasher.shutdown()
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--seconds", type=float, default=5, help="Duration of each scenario")
+    arg_parser.add_argument("--hash-clients", type=int, default=8, help="Concurrent clients requesting hashes")
+    arg_parser.add_argument("--port", type=int, default=8765)
+    args = arg_parser.parse_args()
+    run(args.seconds, args.hash_clients, args.port)
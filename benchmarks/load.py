@@ -0,0 +1,284 @@
+"""
+Load driver: sends a weighted mix of requests to every router of a running deployment for a fixed time
+and writes the per-endpoint latency percentiles and throughput to benchmarks/results/.
+
+    python -m benchmarks.seed --scale small
+    python -m app.serve --port 8000 &
+    python -m benchmarks.load --seconds 60
+    python -m benchmarks.load ... --mix "dashboard.summary=5,api.requests_page=1"
+    python -m benchmarks.report compare benchmarks/results/<base>.json benchmarks/results/<head>.json
+
+--api-url serves /api, --url serves /users, /admin/dashboard and /admin/approval. Both default to the
+server above, they are separate for revisions that served them from two apps. Ids are sampled from the
+database the deployment uses, or with --scale from the id scheme of benchmarks/seed.py without connecting
+to it. Writing endpoints are only in the "writes" mix.
+"""
+import argparse
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+import requests
+
+from benchmarks.report import git_revision, print_run, summarize
+from benchmarks.seed import CITIES, PASSWORD, REQUEST_TYPES, SCALES
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+
+class Call(NamedTuple):
+    method: str
+    base: str  # "api" for --api-url, "app" for --url
+    path: str
+    params: Optional[dict] = None
+    json: Optional[object] = None
+
+
+class Sample:
+    """
+    Ids and names the scenarios pick their arguments from.
+    """
+
+    def __init__(self, requests_: List[str], open_requests: List[str], families: List[str], volunteers: List[str],
+                 pending_users: List[str], cities: List[str], request_types: List[str]):
+        self.requests = requests_
+        self.open_requests = open_requests
+        self.families = families
+        self.volunteers = volunteers
+        self.pending_users = pending_users
+        self.cities = cities
+        self.request_types = request_types
+        self._pending_lock = threading.Lock()
+
+    @classmethod
+    def from_scale(cls, scale: str) -> "Sample":
+        counts = SCALES[scale]
+
+        def ids(prefix, count):
+            return [f"{prefix}{i:08d}" for i in range(1, count + 1)]
+
+        # A quarter of the seeded requests are open, which ones is random, so all of them are candidates
+        request_ids = ids("R", counts["requests"])
+        return cls(request_ids, request_ids, ids("F", counts["families"]), ids("V", counts["volunteers"]),
+                   ids("P", counts["pending_users"]), [f"city {i}" for i in range(1, CITIES + 1)],
+                   [f"type {i}" for i in range(1, REQUEST_TYPES + 1)])
+
+    @classmethod
+    def from_database(cls, size: int = 5000) -> "Sample":
+        from sqlalchemy import text
+
+        from app.core.database import SessionLocal
+
+        def column(session, query):
+            return [row[0].strip() for row in session.execute(text(query), {"size": size})]
+
+        with SessionLocal() as db:
+            return cls(column(db, "SELECT id FROM requests ORDER BY random() LIMIT :size"),
+                       column(db, "SELECT id FROM requests WHERE status = 1 ORDER BY random() LIMIT :size"),
+                       column(db, "SELECT id FROM users WHERE user_type = 1 ORDER BY random() LIMIT :size"),
+                       column(db, "SELECT id FROM users WHERE user_type = 2 AND user_status = 1 "
+                                  "ORDER BY random() LIMIT :size"),
+                       column(db, "SELECT id FROM users WHERE user_status = 0 ORDER BY random() LIMIT :size"),
+                       column(db, "SELECT city_name FROM cities"), column(db, "SELECT type_name FROM request_types"))
+
+    def take_pending_user(self) -> Optional[str]:
+        """
+        A pending user no other call has decided yet.
+        """
+        with self._pending_lock:
+            return self.pending_users.pop() if self.pending_users else None
+
+
+def _window(rng: random.Random) -> dict:
+    # Dashboard date ranges as the admin UI sends them: today, last week, last month or last quarter
+    end = datetime.now()
+    start = (end - timedelta(days=rng.choice((0, 7, 30, 90)))).replace(hour=0, minute=0, second=0, microsecond=0)
+    return {"start_date": start.isoformat(), "end_date": end.isoformat()}
+
+
+def _dashboard(path: str) -> Callable[[Sample, random.Random], Call]:
+    def call(sample: Sample, rng: random.Random) -> Call:
+        params = _window(rng)
+        if rng.random() < 0.2:
+            params["city"] = rng.choice(sample.cities)
+        return Call("GET", "app", f"/admin/dashboard{path}", params)
+
+    return call
+
+
+def _completion_stats(sample: Sample, rng: random.Random) -> Call:
+    return Call("GET", "app", "/admin/dashboard/request-completion-time",
+                {**_window(rng), "mode": "stats", "group_by": rng.choice(("city", "request_type"))})
+
+
+def _create_request(sample: Sample, rng: random.Random) -> Call:
+    return Call("POST", "api", "/api/request", json={
+        "id": "L" + uuid.uuid4().hex[:8], "family_id": rng.choice(sample.families),
+        "request_type": rng.randint(1, len(sample.request_types)), "city": rng.randint(1, len(sample.cities)),
+        "description": "load test", "is_urgent": rng.random() < 0.1})
+
+
+def _signin(sample: Sample, rng: random.Random) -> Call:
+    # The seeded user F00000042 signs in as f42@example.com
+    user_id = rng.choice(rng.choice((sample.families, sample.volunteers)))
+    return Call("POST", "app", "/users/signin",
+                json={"email": f"{user_id[0].lower()}{int(user_id[1:])}@example.com", "password": PASSWORD})
+
+
+def _reject_pending(sample: Sample, rng: random.Random) -> Optional[Call]:
+    user_id = sample.take_pending_user()
+    return Call("POST", "app", f"/admin/approval/{user_id}/reject") if user_id else None
+
+
+# Scenario name -> function building the call from the sample. Names start with the router they hit
+SCENARIOS: Dict[str, Callable[[Sample, random.Random], Optional[Call]]] = {
+    "api.requests_page": lambda s, rng: Call("GET", "api", "/api/request", {"limit": 100}),
+    "api.request_by_id": lambda s, rng: Call("GET", "api", "/api/request", {"id": rng.choice(s.requests)}),
+    "api.matched_requests_page": lambda s, rng: Call("GET", "api", "/api/requests/", {"limit": 100}),
+    "api.matches_for_request": lambda s, rng: Call("GET", "api",
+                                                   f"/api/matches/requests/{rng.choice(s.open_requests)}"),
+    "api.matches_for_volunteer": lambda s, rng: Call("GET", "api",
+                                                     f"/api/matches/volunteers/{rng.choice(s.volunteers)}"),
+    "api.create_request": _create_request,
+    "users.page": lambda s, rng: Call("GET", "app", "/users/", {"limit": 100}),
+    "users.signin": _signin,
+    "dashboard.summary": _dashboard("/summary"),
+    "dashboard.city_count": _dashboard("/city-count"),
+    "dashboard.status_count": _dashboard("/status-count"),
+    "dashboard.type_count": _dashboard("/type-count"),
+    "dashboard.completion_stats": _completion_stats,
+    "approval.unapproved_page": lambda s, rng: Call("GET", "app", "/admin/approval/unapproved", {"limit": 100}),
+    "approval.all_users_page": lambda s, rng: Call("GET", "app", "/admin/approval/all_users", {"limit": 100}),
+    "approval.reject": _reject_pending,
+}
+
+# Scenario weights of the named mixes. The default one is read only, so that runs can be repeated on the
+# same seed
+MIXES: Dict[str, Dict[str, float]] = {
+    "default": {
+        "api.requests_page": 10, "api.request_by_id": 10, "api.matched_requests_page": 5,
+        "api.matches_for_request": 5, "api.matches_for_volunteer": 5,
+        "users.page": 5, "users.signin": 1,
+        "dashboard.summary": 10, "dashboard.city_count": 3, "dashboard.status_count": 3, "dashboard.type_count": 3,
+        "dashboard.completion_stats": 2,
+        "approval.unapproved_page": 3, "approval.all_users_page": 2,
+    },
+    "dashboard": {"dashboard.summary": 5, "dashboard.city_count": 2, "dashboard.status_count": 2,
+                  "dashboard.type_count": 2, "dashboard.completion_stats": 1},
+    "writes": {"api.create_request": 5, "approval.reject": 1, "users.signin": 2, "api.requests_page": 5,
+               "dashboard.summary": 5, "approval.unapproved_page": 2},
+}
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    """
+    A named mix, or "scenario=weight,..." pairs.
+    """
+    if mix in MIXES:
+        return MIXES[mix]
+    weights = {}
+    for pair in mix.split(","):
+        name, _, weight = pair.partition("=")
+        if name.strip() not in SCENARIOS:
+            raise ValueError(f"Unknown scenario {name.strip()!r}, expected one of {', '.join(SCENARIOS)}")
+        weights[name.strip()] = float(weight or 1)
+    return weights
+
+
+def run(api_url: str, url: str, sample: Sample, mix: str, concurrency: int, seconds: float, warmup: float,
+        timeout: float = 30, random_seed: Optional[int] = None) -> dict:
+    """
+    Run concurrency closed-loop clients for warmup + seconds. Only the calls that start after the warmup
+    are reported.
+
+    :return: the run report, {"meta": ..., "endpoints": {scenario: stats}, "total": stats}
+    """
+    weights = parse_mix(mix)
+    bases = {"api": api_url.rstrip("/"), "app": url.rstrip("/")}
+    names, cum_weights = list(weights), []
+    for name in names:
+        cum_weights.append((cum_weights[-1] if cum_weights else 0) + weights[name])
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    errors: Dict[str, int] = defaultdict(int)
+    lock = threading.Lock()
+    start = time.perf_counter()
+    measure_from, deadline = start + warmup, start + warmup + seconds
+
+    def client(client_id: int):
+        rng = random.Random(None if random_seed is None else random_seed + client_id)
+        local_latencies, local_errors = defaultdict(list), defaultdict(int)
+        with requests.Session() as http:
+            while True:
+                name = rng.choices(names, cum_weights=cum_weights)[0]
+                call = SCENARIOS[name](sample, rng)
+                began = time.perf_counter()
+                if began >= deadline:
+                    break
+                if call is None:
+                    continue
+                try:
+                    response = http.request(call.method, bases[call.base] + call.path, params=call.params,
+                                            json=call.json, timeout=timeout)
+                    failed = response.status_code >= 400
+                except requests.RequestException:
+                    failed = True
+                if began < measure_from:
+                    continue
+                if failed:
+                    local_errors[name] += 1
+                else:
+                    local_latencies[name].append((time.perf_counter() - began) * 1000)
+        with lock:
+            for name, values in local_latencies.items():
+                latencies[name] += values
+            for name, count in local_errors.items():
+                errors[name] += count
+
+    started_at = datetime.now().isoformat(timespec="seconds")
+    with ThreadPoolExecutor(concurrency) as executor:
+        list(executor.map(client, range(concurrency)))
+
+    return {
+        "meta": {**git_revision(), "started_at": started_at, "api_url": api_url, "url": url,
+                 "mix": mix, "weights": weights, "concurrency": concurrency, "seconds": seconds, "warmup": warmup},
+        "endpoints": {name: summarize(latencies[name], errors[name], seconds) for name in names},
+        "total": summarize([value for values in latencies.values() for value in values], sum(errors.values()),
+                           seconds),
+    }
+
+
+def write_run(report: dict, path: Optional[str] = None) -> str:
+    if path is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = report["meta"]["started_at"].replace(":", "").replace("-", "")
+        path = os.path.join(RESULTS_DIR, f"{stamp}-{report['meta']['commit'] or 'nogit'}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    return path
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--api-url", default="http://localhost:8000", help="Server of /api")
+    arg_parser.add_argument("--url", default="http://localhost:8000", help="Server of /users and /admin")
+    arg_parser.add_argument("--mix", default="default",
+                            help=f"One of {', '.join(MIXES)}, or scenario=weight pairs separated by commas")
+    arg_parser.add_argument("--concurrency", type=int, default=16, help="Concurrent clients")
+    arg_parser.add_argument("--seconds", type=float, default=60, help="Measured duration")
+    arg_parser.add_argument("--warmup", type=float, default=10, help="Unmeasured duration before it")
+    arg_parser.add_argument("--scale", choices=SCALES, help="Sample ids from the seed scheme, not the database")
+    arg_parser.add_argument("--random-seed", type=int)
+    arg_parser.add_argument("--output", help="Defaults to benchmarks/results/<time>-<commit>.json")
+    args = arg_parser.parse_args()
+
+    report = run(args.api_url, args.url, Sample.from_scale(args.scale) if args.scale else Sample.from_database(),
+                 args.mix, args.concurrency, args.seconds, args.warmup, random_seed=args.random_seed)
+    print_run(report)
+    print(f"written to {write_run(report, args.output)}")
@@ -0,0 +1,104 @@
+"""
+Latency reports of benchmark runs (see benchmarks/load.py), and comparison of two runs.
+
+    python -m benchmarks.report show benchmarks/results/<run>.json
+    python -m benchmarks.report compare benchmarks/results/<base>.json benchmarks/results/<head>.json
+
+compare exits with status 1 when an endpoint's p95 got slower by more than --threshold percent.
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from typing import Dict, List
+
+METRICS = ("p50", "p95", "p99")
+
+
+def percentile(samples: List[float], q: int) -> float:
+    if len(samples) == 1:
+        return samples[0]
+    return statistics.quantiles(samples, n=100, method="inclusive")[q - 1]
+
+
+def summarize(latencies: List[float], errors: int, seconds: float) -> dict:
+    """
+    Latency percentiles (ms) and throughput of one endpoint, or of all of them together.
+    """
+    if not latencies:
+        return {"count": 0, "errors": errors, "rps": 0.0}
+    return {
+        "count": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / seconds, 2),
+        "mean": round(statistics.fmean(latencies), 2),
+        **{metric: round(percentile(latencies, int(metric[1:])), 2) for metric in METRICS},
+        "max": round(max(latencies), 2),
+    }
+
+
+def git_revision() -> Dict[str, object]:
+    def git(*args):
+        return subprocess.run(["git", *args], capture_output=True, text=True).stdout.strip()
+
+    return {"commit": git("rev-parse", "--short", "HEAD"), "branch": git("rev-parse", "--abbrev-ref", "HEAD"),
+            "dirty": bool(git("status", "--porcelain", "--untracked-files=no"))}
+
+
+def print_run(run: dict):
+    meta = run["meta"]
+    print(f"{meta['commit']}{' (dirty)' if meta['dirty'] else ''} {meta['started_at']}  mix={meta['mix']}  "
+          f"concurrency={meta['concurrency']}  {meta['seconds']}s")
+    print(f"{'endpoint':<32}{'count':>8}{'errors':>8}{'rps':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+    for name, stats in [*sorted(run["endpoints"].items()), ("total", run["total"])]:
+        if not stats["count"]:
+            print(f"{name:<32}{0:>8}{stats['errors']:>8}")
+            continue
+        print(f"{name:<32}{stats['count']:>8}{stats['errors']:>8}{stats['rps']:>9.1f}{stats['p50']:>9.1f}"
+              f"{stats['p95']:>9.1f}{stats['p99']:>9.1f}{stats['max']:>9.1f}")
+
+
+def compare(base: dict, head: dict, threshold: float) -> bool:
+    """
+    Print the change of every metric between two runs. Returns False if any p95 regressed by more than
+    threshold percent.
+    """
+    print(f"base {base['meta']['commit']}  head {head['meta']['commit']}  (change in %, + is slower for latencies)")
+    print(f"{'endpoint':<32}" + "".join(f"{metric + ' ms':>18}" for metric in METRICS) + f"{'rps':>18}")
+    ok = True
+    names = sorted(set(base["endpoints"]) & set(head["endpoints"])) + ["total"]
+    for name in names:
+        old = base["total"] if name == "total" else base["endpoints"][name]
+        new = head["total"] if name == "total" else head["endpoints"][name]
+        if not old["count"] or not new["count"]:
+            continue
+        cells = []
+        for metric in (*METRICS, "rps"):
+            change = (new[metric] - old[metric]) / old[metric] * 100 if old[metric] else 0.0
+            cells.append(f"{old[metric]:>7.1f}>{new[metric]:<7.1f}{change:+4.0f}")
+        regressed = (new["p95"] - old["p95"]) / old["p95"] * 100 > threshold if old["p95"] else False
+        ok = ok and not regressed
+        print(f"{name:<32}" + "".join(f"{cell:>18}" for cell in cells) + ("  REGRESSION" if regressed else ""))
+    return ok
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = arg_parser.add_subparsers(dest="command", required=True)
+    show_parser = commands.add_parser("show", help="Print the report of a run")
+    show_parser.add_argument("run")
+    compare_parser = commands.add_parser("compare", help="Compare two runs")
+    compare_parser.add_argument("base")
+    compare_parser.add_argument("head")
+    compare_parser.add_argument("--threshold", type=float, default=10, help="Allowed p95 slowdown, in percent")
+    args = arg_parser.parse_args()
+
+    def load(path):
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+
+    if args.command == "show":
+        print_run(load(args.run))
+    else:
+        sys.exit(0 if compare(load(args.base), load(args.head), args.threshold) else 1)
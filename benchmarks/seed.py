@@ -0,0 +1,147 @@
+"""
+Fill an empty, migrated database with synthetic data for benchmarks and query plan checks.
+
+    alembic upgrade head
+    python -m benchmarks.seed --scale medium
+    python -m benchmarks.seed --requests 500000 --days 730
+
+The data is generated inside Postgres with generate_series, so large seeds take seconds. City sizes are
+skewed (low city ids get most users and requests) and requests lean towards recent days, as in production.
+The same --seed gives the same data.
+"""
+import argparse
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from app.core.config import PASSWORD_HASHING_CONFIG
+from app.core.password_hashing import hash_password
+from app.core.table_versions import bump_versions
+from app.models.request import RequestStatus
+
+CITIES = 30
+REQUEST_TYPES = 8
+LICENSES = 3
+# Request status ids: 1 is open (see app/core/matching.py), 4 is completed
+REQUEST_STATUSES = [(1, RequestStatus.SEARCHING_VOLUNTEER), (2, RequestStatus.WAITING_APPROVAL),
+                    (3, RequestStatus.IN_PROGRESS), (4, RequestStatus.COMPLETED)]
+PASSWORD = "benchmark"
+# Row counts of the --scale presets
+SCALES = {
+    "small": {"requests": 20_000, "families": 2_000, "volunteers": 500, "pending_users": 200},
+    "medium": {"requests": 200_000, "families": 20_000, "volunteers": 5_000, "pending_users": 2_000},
+    "large": {"requests": 2_000_000, "families": 200_000, "volunteers": 50_000, "pending_users": 20_000},
+}
+SEED_TABLES = ["request_daily_rollup", "email_outbox", "request_process", "requests", "volunteers", "families",
+               "users", "request_status", "request_types", "licenses", "city_distances", "cities", "user_status",
+               "user_types"]
+
+
+def seed(session: Session, requests: int, families: int, volunteers: int, pending_users: int, days: int,
+         random_seed: float = 0.42):
+    """
+    Replace the contents of the tables with synthetic data and rebuild the daily rollup.
+    """
+    execute = session.execute
+    # Every seeded user signs in with PASSWORD. Hashed once, they all share the same salt
+    password_hash = hash_password(PASSWORD, PASSWORD_HASHING_CONFIG["scrypt_n"], PASSWORD_HASHING_CONFIG["scrypt_r"],
+                                  PASSWORD_HASHING_CONFIG["scrypt_p"])
+    execute(text(f"TRUNCATE {', '.join(SEED_TABLES)} RESTART IDENTITY CASCADE"))
+    execute(text("SELECT setseed(:seed)"), {"seed": random_seed})
+
+    execute(text("INSERT INTO user_types (id, name) VALUES (1, 'family'), (2, 'volunteer'), (3, 'admin')"))
+    execute(text("INSERT INTO user_status (id, name) VALUES (0, 'pending'), (1, 'approved'), (2, 'rejected')"))
+    execute(text("INSERT INTO cities (id, city_name) SELECT i, 'city ' || i FROM generate_series(1, :n) i"),
+            {"n": CITIES})
+    # Cities scattered over a 150 x 400 km area, with road distances a third longer than straight lines
+    execute(text("""
+        WITH points AS (SELECT id, random() * 150 AS x, random() * 400 AS y FROM cities)
+        INSERT INTO city_distances (from_city, to_city, distance_km)
+        SELECT a.id, b.id, round((1.3 * sqrt(power(a.x - b.x, 2) + power(a.y - b.y, 2)))::numeric, 1)
+        FROM points a JOIN points b ON a.id < b.id
+    """))
+    execute(text("INSERT INTO request_types (id, type_name) SELECT i, 'type ' || i FROM generate_series(1, :n) i"),
+            {"n": REQUEST_TYPES})
+    execute(text("INSERT INTO licenses (id, license_name) SELECT i, 'license ' || i FROM generate_series(1, :n) i"),
+            {"n": LICENSES})
+    execute(text("INSERT INTO request_status (id, status_name) VALUES (:id, :name)"),
+            [{"id": id_, "name": name} for id_, name in REQUEST_STATUSES])
+
+    # User ids: F######## families, V######## volunteers, P######## pending sign ups, A00000001 the admin.
+    # Emails are f<n>@example.com, v<n>@example.com and p<n>@example.com
+    execute(text("""
+        INSERT INTO users (id, first_name, last_name, email, password_hash, city, user_type, user_status,
+                           created_at, approved_at, approved_by)
+        VALUES ('A00000001', 'Admin', 'User', 'admin@example.com', NULL, 1, 3, 1, now() - interval '2 years',
+                now() - interval '2 years', NULL)
+    """))
+    for prefix, count, user_type, status in (("F", families, 1, 1), ("V", volunteers, 2, 1),
+                                             ("P", pending_users, 2, 0)):
+        execute(text("""
+            INSERT INTO users (id, first_name, last_name, email, password_hash, city, user_type, user_status,
+                               created_at, approved_at, approved_by)
+            SELECT :prefix || lpad(i::text, 8, '0'), 'First' || i, 'Last' || i,
+                   lower(:prefix) || i || '@example.com', :password_hash,
+                   1 + floor(power(random(), 2) * :cities)::int, :user_type, :status,
+                   now() - random() * make_interval(days => :days),
+                   CASE WHEN :status = 1 THEN now() END, CASE WHEN :status = 1 THEN 'A00000001' END
+            FROM generate_series(1, :count) i
+        """), {"prefix": prefix, "count": count, "user_type": user_type, "status": status, "cities": CITIES,
+               "days": days, "password_hash": password_hash})
+
+    execute(text("""
+        INSERT INTO families (user_id, building_type, floor_number, has_parking, has_elevator, is_private_house)
+        SELECT id, 'building', floor(random() * 10)::int, random() < 0.5, random() < 0.5, random() < 0.3
+        FROM users WHERE user_type = 1
+    """))
+    execute(text("""
+        INSERT INTO volunteers (user_id, preferred_city, preferred_skill, license_level)
+        SELECT id, city, 1 + floor(random() * :types)::int, 1 + floor(random() * :licenses)::int
+        FROM users WHERE user_type = 2
+    """), {"types": REQUEST_TYPES, "licenses": LICENSES})
+
+    # A quarter of the requests are still open, the rest are spread over the other statuses
+    execute(text("""
+        INSERT INTO requests (id, family_id, request_type, description, city, status, is_urgent, requires_vehicle,
+                              assigned_volunteer_id, created_at)
+        SELECT 'R' || lpad(i::text, 8, '0'), 'F' || lpad((1 + floor(random() * :families))::int::text, 8, '0'),
+               1 + floor(random() * :types)::int, 'request ' || i, 1 + floor(power(random(), 2) * :cities)::int,
+               CASE WHEN random() < 0.25 THEN 1 ELSE 2 + floor(random() * 3)::int END,
+               random() < 0.1, random() < 0.2, NULL, now() - power(random(), 1.5) * make_interval(days => :days)
+        FROM generate_series(1, :count) i
+    """), {"count": requests, "families": families, "types": REQUEST_TYPES, "cities": CITIES, "days": days})
+    execute(text("""
+        INSERT INTO request_process (request_id, volunteer_id, status, volunteer_approval, completed_at, created_at)
+        SELECT r.id, 'V' || lpad((1 + floor(random() * :volunteers))::int::text, 8, '0'), r.status, true,
+               CASE WHEN r.status = 4 THEN r.created_at + random() * interval '10 days' END,
+               r.created_at + random() * interval '1 day'
+        FROM requests r WHERE r.status > 1
+    """), {"volunteers": volunteers})
+
+    # Raw SQL bypasses the flush listener, without this clients would keep getting 304s for the old data
+    bump_versions(session, SEED_TABLES)
+    session.commit()
+
+    from app.core.rollup import backfill
+    backfill(session)
+    for table in SEED_TABLES:
+        execute(text(f"ANALYZE {table}"))
+    session.commit()
+
+
+if __name__ == "__main__":
+    from app.core.database import SessionLocal
+
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--scale", choices=SCALES, default="medium", help="Preset row counts")
+    arg_parser.add_argument("--requests", type=int, help="Overrides the preset")
+    arg_parser.add_argument("--families", type=int, help="Overrides the preset")
+    arg_parser.add_argument("--volunteers", type=int, help="Overrides the preset")
+    arg_parser.add_argument("--pending-users", type=int, help="Overrides the preset")
+    arg_parser.add_argument("--days", type=int, default=365)
+    arg_parser.add_argument("--seed", type=float, default=0.42, help="Random seed, between -1 and 1")
+    args = arg_parser.parse_args()
+
+    counts = {name: getattr(args, name) or count for name, count in SCALES[args.scale].items()}
+    with SessionLocal() as db:
+        seed(db, days=args.days, random_seed=args.seed, **counts)
@@ -0,0 +1,97 @@
+"""
+Serialization time of large list responses: the previous path (validated pydantic models, then
+jsonable_encoder and json.dumps) against the fast path of app/core/responses.py (plain dicts rendered by
+orjson), and the cost and size of compressing the result.
+
+    python -m benchmarks.serialization --rows 10000
+
+Builds its rows in memory and needs no database.
+"""
+import argparse
+import gzip
+import json
+import statistics
+import time
+from datetime import datetime, timedelta
+from typing import Callable
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from app.api.endpoints.admin.approval_api import UserResponse, user_response_row
+from app.core.config import RESPONSE_CONFIG
+from app.core.responses import FastJSONResponse, brotli
+from app.models.user import User
+
+
+def _users(rows: int):
+    now = datetime.now()
+    return [User(id=f"V{i:08d}", first_name=f"First{i}", last_name=f"Last{i}", phone_number="050-0000000",
+                 address=None, profile_picture=None, city_id=i % 30 + 1, user_type_id=2, status_id=1,
+                 approved_at=now, created_at=now - timedelta(minutes=i)) for i in range(rows)]
+
+
+def _requests(rows: int):
+    # Rows as requests_db.get_requests returns them
+    now = datetime.now()
+    return [{"id": f"R{i:08d}", "family_id": f"F{i % 2000:08d}", "request_type": i % 8 + 1,
+             "description": f"request {i}", "city": i % 30 + 1, "status": 1, "is_urgent": i % 10 == 0,
+             "requires_vehicle": False, "assigned_volunteer_id": None, "expected_completion": None,
+             "preferred_datetime": None, "created_at": now - timedelta(minutes=i), "city_name": f"city {i % 30 + 1}",
+             "request_type_name": f"type {i % 8 + 1}", "status_name": "מחפש מתנדב",
+             "request_type_relation": {"id": i % 8 + 1, "type_name": f"type {i % 8 + 1}"}} for i in range(rows)]
+
+
+def _timed(fn: Callable[[], bytes], repeat: int):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body = fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times), body
+
+
+def run(rows: int, repeat: int):
+    users, requests = _users(rows), _requests(rows)
+    paths = {
+        "users page": (
+            lambda: JSONResponse(jsonable_encoder({"items": [UserResponse(**user_response_row(user))
+                                                             for user in users]})).body,
+            lambda: FastJSONResponse({"items": [user_response_row(user) for user in users]}).body,
+        ),
+        "requests page": (
+            lambda: JSONResponse(jsonable_encoder({"items": requests})).body,
+            lambda: FastJSONResponse({"items": requests}).body,
+        ),
+    }
+
+    print(f"median of {repeat} runs, {rows} rows")
+    print(f"{'response':<16}{'before ms':>11}{'after ms':>10}{'speedup':>9}{'bytes':>11}")
+    bodies = {}
+    for name, (before, after) in paths.items():
+        before_ms, before_body = _timed(before, repeat)
+        after_ms, after_body = _timed(after, repeat)
+        assert json.loads(before_body) == json.loads(after_body), f"{name}: the two paths disagree"
+        bodies[name] = after_body
+        print(f"{name:<16}{before_ms:>11.1f}{after_ms:>10.1f}{before_ms / after_ms:>8.1f}x{len(after_body):>11}")
+
+    compressors = {
+        f"gzip {RESPONSE_CONFIG['gzip_level']}": lambda body: gzip.compress(body, RESPONSE_CONFIG["gzip_level"]),
+        "gzip 9": lambda body: gzip.compress(body, 9),
+    }
+    if brotli is not None:
+        compressors[f"brotli {RESPONSE_CONFIG['brotli_quality']}"] = \
+            lambda body: brotli.compress(body, quality=RESPONSE_CONFIG["brotli_quality"])
+    print(f"\n{'compression':<28}{'ms':>8}{'bytes':>11}{'ratio':>8}")
+    for name, body in bodies.items():
+        for compressor_name, compress in compressors.items():
+            ms, compressed = _timed(lambda: compress(body), repeat)
+            print(f"{name + ', ' + compressor_name:<28}{ms:>8.1f}{len(compressed):>11}{len(body) / len(compressed):>7.1f}x")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--rows", type=int, default=10000)
+    arg_parser.add_argument("--repeat", type=int, default=5)
+    args = arg_parser.parse_args()
+    run(args.rows, args.repeat)
@@ -1,17 +1,6 @@
-from fastapi import FastAPI, Query, HTTPException, Depends
-from pydantic import BaseModel
-from sqlalchemy import create_engine, Column, String, Integer, Boolean, DateTime, func
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, Session
-from typing import Optional
-from datetime import datetime
-from app.api.endpoints.requests import request_router
-from app.core.database import engine
-Base = declarative_base()
+# The API used to be split between this app (/api) and app/main.py (/users, /admin). Both are now served by
+# app.main.create_app, this module is kept for `uvicorn main:app`. In production run `python -m app.serve`,
+# which does not import it.
+from app.main import create_app
 
-app = FastAPI()
-
-app.include_router(request_router, prefix="/api")
-
-    # Create tables in the database
-Base.metadata.create_all(bind=engine)
\ No newline at end of file
+app = create_app()
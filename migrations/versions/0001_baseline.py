@@ -0,0 +1,115 @@
+"""Baseline: the tables as they were before migrations were introduced
+
+Databases that already have these tables should be marked as migrated with
+`alembic stamp 0001` instead of running this revision.
+
+Revision ID: 0001
+Revises:
+Create Date: 2025-03-01 00:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'user_types',
+        sa.Column('id', sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column('name', sa.String(20), nullable=False, unique=True),
+    )
+    op.create_table(
+        'user_status',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('name', sa.String(50), nullable=False),
+    )
+    op.create_table(
+        'cities',
+        sa.Column('id', sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column('city_name', sa.String(50), nullable=False, unique=True),
+    )
+    op.create_table(
+        'licenses',
+        sa.Column('id', sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column('license_name', sa.String(50), nullable=False, unique=True),
+    )
+    op.create_table(
+        'request_types',
+        sa.Column('id', sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column('type_name', sa.String(50), nullable=False, unique=True),
+    )
+    op.create_table(
+        'request_status',
+        sa.Column('id', sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column('status_name', sa.String(50), nullable=False, unique=True),
+    )
+    op.create_table(
+        'users',
+        sa.Column('id', sa.String(9), primary_key=True),
+        sa.Column('first_name', sa.String(50), nullable=False),
+        sa.Column('last_name', sa.String(50), nullable=False),
+        sa.Column('phone_number', sa.String(20), nullable=True),
+        sa.Column('address', sa.Text(), nullable=True),
+        sa.Column('profile_picture', sa.Text(), nullable=True),
+        sa.Column('email', sa.String(100), nullable=False, unique=True),
+        sa.Column('password_hash', sa.Text(), nullable=True),
+        sa.Column('approved_at', sa.DateTime(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('city', sa.Integer(), sa.ForeignKey('cities.id'), nullable=False),
+        sa.Column('user_type', sa.Integer(), sa.ForeignKey('user_types.id'), nullable=False),
+        sa.Column('user_status', sa.Integer(), sa.ForeignKey('user_status.id'), nullable=False),
+        sa.Column('approved_by', sa.String(9), sa.ForeignKey('users.id'), nullable=True),
+    )
+    op.create_table(
+        'families',
+        sa.Column('user_id', sa.CHAR(9), sa.ForeignKey('users.id'), primary_key=True),
+        sa.Column('building_type', sa.String(50)),
+        sa.Column('floor_number', sa.Integer()),
+        sa.Column('has_parking', sa.Boolean()),
+        sa.Column('has_elevator', sa.Boolean()),
+        sa.Column('is_private_house', sa.Boolean()),
+    )
+    op.create_table(
+        'volunteers',
+        sa.Column('user_id', sa.CHAR(9), sa.ForeignKey('users.id'), primary_key=True),
+        sa.Column('preferred_city', sa.Integer(), sa.ForeignKey('cities.id'), nullable=False),
+        sa.Column('preferred_skill', sa.Integer(), sa.ForeignKey('request_types.id'), nullable=False),
+        sa.Column('license_level', sa.Integer(), sa.ForeignKey('licenses.id'), nullable=False),
+    )
+    op.create_table(
+        'requests',
+        sa.Column('id', sa.CHAR(9), primary_key=True),
+        sa.Column('family_id', sa.CHAR(9), sa.ForeignKey('families.user_id'), nullable=False),
+        sa.Column('request_type', sa.Integer(), sa.ForeignKey('request_types.id'), nullable=False),
+        sa.Column('description', sa.Text(), nullable=True),
+        sa.Column('city', sa.Integer(), sa.ForeignKey('cities.id'), nullable=False),
+        sa.Column('status', sa.Integer(), sa.ForeignKey('request_status.id')),
+        sa.Column('is_urgent', sa.Boolean()),
+        sa.Column('requires_vehicle', sa.Boolean()),
+        sa.Column('assigned_volunteer_id', sa.CHAR(9), sa.ForeignKey('volunteers.user_id'), nullable=True),
+        sa.Column('expected_completion', sa.TIMESTAMP(), nullable=True),
+        sa.Column('preferred_datetime', sa.TIMESTAMP(), nullable=True),
+        sa.Column('created_at', sa.TIMESTAMP(), server_default=sa.text('NOW()')),
+    )
+    op.create_table(
+        'request_process',
+        sa.Column('id', sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column('request_id', sa.CHAR(9), sa.ForeignKey('requests.id'), nullable=False),
+        sa.Column('volunteer_id', sa.CHAR(9), sa.ForeignKey('volunteers.user_id'), nullable=False),
+        sa.Column('status', sa.Integer(), sa.ForeignKey('request_status.id')),
+        sa.Column('volunteer_approval', sa.Boolean()),
+        sa.Column('estimated_arrival', sa.TIMESTAMP(), nullable=True),
+        sa.Column('completed_at', sa.TIMESTAMP(), nullable=True),
+        sa.Column('created_at', sa.TIMESTAMP(), server_default=sa.text('NOW()')),
+    )
+
+
+def downgrade():
+    for table in ('request_process', 'requests', 'volunteers', 'families', 'users', 'request_status',
+                  'request_types', 'licenses', 'cities', 'user_status', 'user_types'):
+        op.drop_table(table)
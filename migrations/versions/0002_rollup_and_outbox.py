@@ -0,0 +1,53 @@
+"""request_daily_rollup and email_outbox tables
+
+Both tables could already have been created outside of migrations (by
+`python -m app.core.rollup backfill` and by the app at startup), so they are
+created with IF NOT EXISTS.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2025-03-01 00:00:01
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'request_daily_rollup',
+        sa.Column('day', sa.Date(), primary_key=True),
+        sa.Column('city', sa.Integer(), primary_key=True),
+        sa.Column('request_type', sa.Integer(), primary_key=True),
+        sa.Column('status', sa.Integer(), primary_key=True),
+        sa.Column('request_count', sa.Integer(), nullable=False),
+        sa.Column('completed_count', sa.Integer(), nullable=False),
+        sa.Column('completion_seconds_sum', sa.Float(), nullable=False),
+        if_not_exists=True,
+    )
+    op.create_table(
+        'email_outbox',
+        sa.Column('id', sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column('to_email', sa.String(100), nullable=False),
+        sa.Column('subject', sa.String(200), nullable=False),
+        sa.Column('body', sa.Text(), nullable=True),
+        sa.Column('status', sa.String(10), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('next_attempt_at', sa.TIMESTAMP(), nullable=False, server_default=sa.text('NOW()')),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.TIMESTAMP(), server_default=sa.text('NOW()')),
+        sa.Column('sent_at', sa.TIMESTAMP(), nullable=True),
+        if_not_exists=True,
+    )
+    op.create_index('ix_email_outbox_due', 'email_outbox', ['next_attempt_at'],
+                    postgresql_where=sa.text("status = 'pending'"), if_not_exists=True)
+
+
+def downgrade():
+    op.drop_table('email_outbox')
+    op.drop_table('request_daily_rollup')
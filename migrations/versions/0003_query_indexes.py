@@ -0,0 +1,52 @@
+"""Indexes for the dashboard, request list and approval queries
+
+Built with CREATE INDEX CONCURRENTLY so that writes are not blocked while they build.
+IF NOT EXISTS keeps the revision safe to run on databases where some of them were
+created by hand. If a build fails it leaves an INVALID index behind, drop it before retrying.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2025-03-01 00:00:02
+
+"""
+from alembic import op
+
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+# (name, table, columns, partial index predicate)
+INDEXES = [
+    # Keyset pagination of the request and user lists
+    ('ix_requests_created_at_id', 'requests', ['created_at', 'id'], None),
+    ('ix_users_created_at_id', 'users', ['created_at', 'id'], None),
+    ('ix_users_user_status_created_at_id', 'users', ['user_status', 'created_at', 'id'], None),
+    # Dashboard counts over a created_at range, answered from the index alone
+    ('ix_requests_created_at_city_status_type', 'requests', ['created_at', 'city', 'status', 'request_type'], None),
+    # Open requests: the matched requests list and the matching engine
+    ('ix_requests_open_created_at_id', 'requests', ['created_at', 'id'], 'status = 1'),
+    # Completion times and rollup maintenance
+    ('ix_request_process_request_id_status', 'request_process', ['request_id', 'status'], None),
+    # The approval queue
+    ('ix_users_pending_created_at_id', 'users', ['created_at', 'id'], 'user_status = 0'),
+    # users.id is VARCHAR while families.user_id and volunteers.user_id are CHAR, so joins on them compare
+    # id::bpchar, which the primary key cannot serve
+    ('ix_users_id_bpchar', 'users', ['(id::bpchar)'], None),
+]
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        for name, table, columns, where in INDEXES:
+            op.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} ({', '.join(columns)})"
+                       + (f" WHERE {where}" if where else ""))
+        op.execute("ANALYZE requests")
+        op.execute("ANALYZE request_process")
+        op.execute("ANALYZE users")
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, _, _, _ in reversed(INDEXES):
+            op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
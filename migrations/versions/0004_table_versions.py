@@ -0,0 +1,26 @@
+"""table_versions table
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2025-03-01 00:00:03
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'table_versions',
+        sa.Column('table_name', sa.String(63), primary_key=True),
+        sa.Column('version', sa.BigInteger(), nullable=False),
+    )
+
+
+def downgrade():
+    op.drop_table('table_versions')
@@ -0,0 +1,27 @@
+"""city_distances table
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2025-03-01 00:00:04
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'city_distances',
+        sa.Column('from_city', sa.Integer(), sa.ForeignKey('cities.id', ondelete='CASCADE'), primary_key=True),
+        sa.Column('to_city', sa.Integer(), sa.ForeignKey('cities.id', ondelete='CASCADE'), primary_key=True),
+        sa.Column('distance_km', sa.Float(), nullable=False),
+    )
+
+
+def downgrade():
+    op.drop_table('city_distances')
@@ -0,0 +1,39 @@
+"""Fill request_daily_rollup from the existing requests
+
+0002 created the table empty, so the dashboard read 0 for every day before the flush listener of
+app/core/rollup.py started to count. The rollup is rebuilt from scratch (the listener has counted the
+requests written since 0002) with writes to requests blocked while it runs.
+The same rebuild is `python -m app.core.rollup backfill`.
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2025-03-01 00:00:05
+
+"""
+from alembic import op
+
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("LOCK TABLE requests IN SHARE MODE")
+    op.execute("DELETE FROM request_daily_rollup")
+    op.execute("""
+        INSERT INTO request_daily_rollup
+            (day, city, request_type, status, request_count, completed_count, completion_seconds_sum)
+        SELECT date(created_at), city, request_type, coalesce(status, 0), count(*), 0, 0
+        FROM requests
+        WHERE created_at IS NOT NULL
+        GROUP BY 1, 2, 3, 4
+    """)
+    # Dashboard responses cached against the old version are stale (see app/core/table_versions.py)
+    op.execute("INSERT INTO table_versions (table_name, version) VALUES ('request_daily_rollup', 1) "
+               "ON CONFLICT (table_name) DO UPDATE SET version = table_versions.version + 1")
+
+
+def downgrade():
+    # The rows are kept up to date by the app, an empty rollup would be wrong again
+    pass
@@ -0,0 +1,52 @@
+"""requests.created_at and users.created_at NOT NULL
+
+The request and user lists are paged on (created_at, id) (see app/core/pagination.py), rows
+without a created_at could not be paged to. Rows created without one get the epoch, so they come last
+in the lists, and are added to the daily rollup on that day like the flush listener would.
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2025-03-01 00:00:06
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0007'
+down_revision = '0006'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("LOCK TABLE requests IN SHARE ROW EXCLUSIVE MODE")
+    op.execute("""
+        CREATE TEMPORARY TABLE undated_requests ON COMMIT DROP AS
+        SELECT id FROM requests WHERE created_at IS NULL
+    """)
+    op.execute("UPDATE requests SET created_at = 'epoch' WHERE id IN (SELECT id FROM undated_requests)")
+    op.execute("""
+        INSERT INTO request_daily_rollup
+            (day, city, request_type, status, request_count, completed_count, completion_seconds_sum)
+        SELECT date(created_at), city, request_type, coalesce(status, 0), count(*), 0, 0
+        FROM requests
+        WHERE id IN (SELECT id FROM undated_requests)
+        GROUP BY 1, 2, 3, 4
+        ON CONFLICT (day, city, request_type, status) DO UPDATE SET
+            request_count = request_daily_rollup.request_count + excluded.request_count
+    """)
+    op.alter_column('requests', 'created_at', existing_type=sa.TIMESTAMP(), nullable=False)
+
+    op.execute("UPDATE users SET created_at = 'epoch' WHERE created_at IS NULL")
+    # Users inserted outside of the app get one too
+    op.alter_column('users', 'created_at', existing_type=sa.DateTime(), nullable=False,
+                    server_default=sa.text('NOW()'))
+
+    op.execute("INSERT INTO table_versions (table_name, version) "
+               "VALUES ('requests', 1), ('request_daily_rollup', 1), ('users', 1) "
+               "ON CONFLICT (table_name) DO UPDATE SET version = table_versions.version + 1")
+
+
+def downgrade():
+    op.alter_column('users', 'created_at', existing_type=sa.DateTime(), nullable=True, server_default=None)
+    op.alter_column('requests', 'created_at', existing_type=sa.TIMESTAMP(), nullable=True)
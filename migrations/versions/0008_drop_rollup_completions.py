@@ -0,0 +1,30 @@
+"""Drop the completion columns of request_daily_rollup
+
+The completion statistics need percentiles and a histogram over the raw rows of the whole range, so
+they never read completed_count and completion_seconds_sum. The flush listener stops maintaining them.
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2025-03-01 00:00:07
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0008'
+down_revision = '0007'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.drop_column('request_daily_rollup', 'completion_seconds_sum')
+    op.drop_column('request_daily_rollup', 'completed_count')
+
+
+def downgrade():
+    # Back as 0, nothing read them
+    op.add_column('request_daily_rollup', sa.Column('completed_count', sa.Integer(), nullable=False,
+                                                    server_default='0'))
+    op.add_column('request_daily_rollup', sa.Column('completion_seconds_sum', sa.Float(), nullable=False,
+                                                    server_default='0'))
@@ -0,0 +1,35 @@
+import os
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+import app.core.database  # noqa: F401, registers all the models and the session listeners
+from app.core.config import DASHBOARD_CACHE_CONFIG
+from app.core.metrics import instrument_engine
+
+# Tests marked with the pg_session fixture run against this database, migrated to head and seeded with
+# `python -m benchmarks.seed --scale small`. They are skipped when it is not set.
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+
+@pytest.fixture(scope="session")
+def pg_engine():
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    engine = create_engine(TEST_DATABASE_URL)
+    # For app.core.metrics.count_statements
+    instrument_engine(engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def pg_session(pg_engine, monkeypatch):
+    # Results must come from the database, not from the dashboard cache
+    monkeypatch.setitem(DASHBOARD_CACHE_CONFIG, "enabled", False)
+    # Commits of the code under test only release a savepoint, everything is rolled back at the end
+    with pg_engine.connect() as connection, connection.begin() as transaction:
+        with Session(connection, join_transaction_mode="create_savepoint") as session:
+            yield session
+        transaction.rollback()
@@ -0,0 +1,106 @@
+import asyncio
+import json
+
+import pytest
+from fastapi import HTTPException
+
+from app.api.endpoints.admin import approval_api
+from app.core import admin_approval
+from app.core.admin_approval import bulk_decide_users
+from app.models.user import User, UserStatus
+
+
+@pytest.fixture
+def hashed(monkeypatch):
+    """
+    The number of credentials generated by each generate_credentials call, without hashing.
+    """
+    counts = []
+
+    def generate_credentials(count):
+        counts.append(count)
+        return [(f"password{i}", f"hash{i}") for i in range(count)]
+
+    monkeypatch.setattr(admin_approval, "generate_credentials", generate_credentials)
+    return counts
+
+
+def _user_ids(session, status, n):
+    return [user_id for user_id, in session.query(User.id).filter(User.status_id == status).limit(n)]
+
+
+def test_bulk_approve_only_hashes_pending_users(pg_session, hashed):
+    pending = _user_ids(pg_session, UserStatus.PENDING, 3)
+    approved = _user_ids(pg_session, UserStatus.APPROVED, 2)
+    users = bulk_decide_users(pg_session, [*pending, *approved, "000000000", pending[0]], "approve")
+    assert hashed == [3]
+    assert sorted(user.id for user in users) == sorted(pending)
+
+
+def test_bulk_approve_of_no_pending_user_hashes_nothing(pg_session, hashed):
+    assert bulk_decide_users(pg_session, _user_ids(pg_session, UserStatus.APPROVED, 2), "approve") == []
+    assert hashed == [0]
+
+
+class AsyncSessionOf:
+    """
+    The AsyncSession calls of the async routes on top of a sync session, recording them in events.
+    """
+
+    def __init__(self, session, events):
+        self.session, self.events = session, events
+
+    async def run_sync(self, fn, *args):
+        self.events.append(fn.__name__)
+        return fn(self.session, *args)
+
+    async def rollback(self):
+        self.events.append("rollback")
+        self.session.rollback()
+
+
+@pytest.fixture
+def async_hashed(monkeypatch):
+    """
+    The events of the session at each generate_credentials_async call, without hashing.
+    """
+    calls = []
+
+    async def generate_credentials_async(count):
+        calls.append(list(events))
+        return [(f"password{i}", f"hash{i}") for i in range(count)]
+
+    events = []
+    monkeypatch.setattr(approval_api, "generate_credentials_async", generate_credentials_async)
+    return events, calls
+
+
+def test_async_bulk_approve_releases_the_connection_while_hashing(pg_session, async_hashed):
+    events, calls = async_hashed
+    pending = _user_ids(pg_session, UserStatus.PENDING, 2)
+    decision = approval_api.BulkDecision(user_ids=pending, decision="approve")
+    response = asyncio.run(approval_api.bulk_decide_async(decision, AsyncSessionOf(pg_session, events)))
+    assert calls == [["pending_user_ids", "rollback"]]
+    assert sorted(user["id"] for user in json.loads(response.body)["updated"]) == sorted(pending)
+
+
+def test_async_approve_checks_the_user_before_hashing(pg_session, async_hashed):
+    events, calls = async_hashed
+    approved, = _user_ids(pg_session, UserStatus.APPROVED, 1)
+    session = AsyncSessionOf(pg_session, events)
+    with pytest.raises(HTTPException):
+        asyncio.run(approval_api.approve_user_async("000000000", session))
+    assert asyncio.run(approval_api.approve_user_async(approved, session)).id == approved
+    assert calls == []
+
+    pending, = _user_ids(pg_session, UserStatus.PENDING, 1)
+    user = asyncio.run(approval_api.approve_user_async(pending, session))
+    assert calls == [["get_user", "get_user", "get_user", "rollback"]]
+    assert user.status_id == UserStatus.APPROVED
+
+
+def test_approving_an_approved_user_keeps_their_password(pg_session, hashed):
+    approved, = _user_ids(pg_session, UserStatus.APPROVED, 1)
+    password_hash = pg_session.get(User, approved).password_hash
+    assert admin_approval.do_approve_user(pg_session, approved).password_hash == password_hash
+    assert hashed == []
@@ -0,0 +1,38 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import func
+
+from app.core.adminview_db import BREAKDOWNS, dashboard_summary
+from app.core.reference_data import reference_data
+from app.models.request import Request
+
+KEY_COLUMNS = {"city": (Request.city, "cities"), "status": (Request.status, "request_statuses"),
+               "type": (Request.request_type, "request_types")}
+
+
+def _plain_counts(session, key, start_date, end_date):
+    column, table = KEY_COLUMNS[key]
+    rows = (session.query(column, func.count(Request.id))
+            .filter(Request.created_at.between(start_date, end_date))
+            .group_by(column))
+    return {reference_data.name_of(table, id_): count for id_, count in rows if id_ is not None}
+
+
+@pytest.mark.parametrize("days", [0, 400])
+@pytest.mark.parametrize("breakdown", ["city", "status", "type"])
+def test_single_breakdown_matches_group_by(pg_session, breakdown, days):
+    end_date = datetime.now()
+    start_date = end_date.replace(hour=0, minute=0, second=0) - timedelta(days=days)
+    summary = dashboard_summary(pg_session, start_date, end_date, breakdowns=(breakdown,))
+    assert summary == {breakdown: _plain_counts(pg_session, breakdown, start_date, end_date)}
+
+
+def test_all_breakdowns_in_one_query_match_single_ones(pg_session):
+    end_date = datetime.now()
+    start_date = end_date - timedelta(days=90, hours=6)
+    summary = dashboard_summary(pg_session, start_date, end_date)
+    for name in BREAKDOWNS:
+        if name != "cross_tab":
+            assert summary[name] == dashboard_summary(pg_session, start_date, end_date, breakdowns=(name,))[name]
+    assert sum(row["count"] for row in summary["cross_tab"]) == sum(summary["type"].values())
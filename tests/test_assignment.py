@@ -0,0 +1,102 @@
+import itertools
+import random
+from datetime import datetime
+
+import pytest
+
+from app.core.assignment import CandidateGraph, Proposal, auction, proposals_from_slots
+from app.core.matching import RequestEntry
+
+EPSILON = 0.01
+
+
+def _slots(capacities):
+    slot_start = [0]
+    for capacity in capacities:
+        slot_start.append(slot_start[-1] + capacity)
+    return slot_start
+
+
+def _total(counts, edges, slot_start, slot_cost, slots):
+    """
+    Check that slots is a valid assignment and return its benefit.
+    """
+    benefit_of = [dict(row) for row in edges]
+    total, taken = 0.0, set()
+    for g, group_slots in enumerate(slots):
+        assert len(group_slots) <= counts[g]
+        for slot in group_slots:
+            assert slot not in taken
+            taken.add(slot)
+            volunteer = next(v for v in range(len(slot_start) - 1) if slot_start[v] <= slot < slot_start[v + 1])
+            total += benefit_of[g][volunteer] - slot_cost[slot]
+    return total
+
+
+def _best_total(counts, edges, slot_start, slot_cost):
+    """
+    Benefit of the best assignment, trying every one.
+    """
+    requests = [g for g, count in enumerate(counts) for _ in range(count)]
+    benefit_of = [dict(row) for row in edges]
+    options = []
+    for g in requests:
+        options.append([None] + [slot for volunteer in benefit_of[g]
+                                 for slot in range(slot_start[volunteer], slot_start[volunteer + 1])])
+    best = 0.0
+    for choice in itertools.product(*options):
+        chosen = [slot for slot in choice if slot is not None]
+        if len(chosen) != len(set(chosen)):
+            continue
+        best = max(best, sum(benefit_of[g][next(v for v in benefit_of[g] if slot_start[v] <= slot < slot_start[v + 1])]
+                             - slot_cost[slot] for g, slot in zip(requests, choice) if slot is not None))
+    return best
+
+
+def test_identical_requests_share_a_volunteer_up_to_its_slots():
+    slot_start, slot_cost = _slots([2]), [0.0, 1.0]
+    assert auction([3], [[(0, 10.0)]], slot_start, slot_cost, EPSILON) == [[0, 1]]
+
+
+def test_request_is_left_unassigned_rather_than_given_a_worthless_slot():
+    assert auction([2], [[(0, 5.0)]], _slots([2]), [0.0, 5.0], EPSILON) == [[0]]
+    assert auction([1], [[(0, 1.0)]], _slots([1]), [2.0], EPSILON) == [[]]
+
+
+def test_contested_volunteer_goes_to_the_group_that_has_no_other():
+    # Group 0 prefers volunteer 0 but volunteer 1 is almost as good, group 1 can only take volunteer 0
+    slots = auction([1, 1], [[(0, 10.0), (1, 9.0)], [(0, 8.0)]], _slots([1, 1]), [0.0, 0.0], EPSILON)
+    assert slots == [[1], [0]]
+
+
+def test_groups_without_requests_or_candidates_get_nothing():
+    assert auction([0, 2, 1], [[(0, 3.0)], [], [(0, 3.0)]], _slots([1]), [0.0], EPSILON) == [[], [], [0]]
+
+
+@pytest.mark.parametrize("seed", range(30))
+def test_auction_is_optimal_within_epsilon(seed):
+    rng = random.Random(seed)
+    capacities = [rng.randint(1, 2) for _ in range(rng.randint(1, 3))]
+    slot_start = _slots(capacities)
+    slot_cost = [0.0] * slot_start[-1]
+    for v, capacity in enumerate(capacities):
+        for j in range(capacity):
+            slot_cost[slot_start[v] + j] = rng.choice([0.0, 1.5]) * j
+    counts = [rng.randint(1, 2) for _ in range(rng.randint(1, 3))]
+    edges = [[(v, float(rng.randint(1, 10))) for v in range(len(capacities)) if rng.random() < 0.7]
+             for _ in counts]
+
+    slots = auction(counts, edges, slot_start, slot_cost, EPSILON)
+    assert _total(counts, edges, slot_start, slot_cost, slots) >= (_best_total(counts, edges, slot_start, slot_cost)
+                                                                   - sum(counts) * EPSILON - 1e-9)
+
+
+def test_proposals_give_the_best_slots_to_the_oldest_requests():
+    older = RequestEntry("R1", 1, 1, None, False, False, datetime(2025, 1, 1))
+    newer = RequestEntry("R2", 1, 1, None, False, False, datetime(2025, 1, 2))
+    graph = CandidateGraph(groups=[[older, newer]], edges=[[(0, 10.0), (1, 7.0)]], scores=[[10.0, 7.0]],
+                           volunteer_ids=["V1", "V2"], slot_start=[0, 2, 3], slot_cost=[0.0, 5.0, 0.0])
+    assert proposals_from_slots(graph, [[0, 2]]) == [Proposal("R1", "V1", 10.0, 10.0),
+                                                     Proposal("R2", "V2", 7.0, 7.0)]
+    assert proposals_from_slots(graph, [[1, 2]]) == [Proposal("R1", "V2", 7.0, 7.0),
+                                                     Proposal("R2", "V1", 10.0, 5.0)]
@@ -0,0 +1,25 @@
+from sqlalchemy import func, select
+
+from app.core.bulk_import import import_requests
+from app.core.rollup import database_today
+from app.models.request import Request, RequestDailyRollup
+
+
+def test_rows_without_created_at_are_dated_by_the_database_clock(pg_session):
+    template = pg_session.scalars(select(Request).limit(1)).one()
+    key = {"day": database_today(pg_session), "city": template.city, "request_type": template.request_type,
+           "status": 1}
+
+    def count():
+        return pg_session.scalar(select(RequestDailyRollup.request_count).filter_by(**key)) or 0
+
+    before = count()
+    rows = [{"id": f"T0000000{i}", "family_id": template.family_id, "city": template.city,
+             "request_type": template.request_type} for i in range(2)]
+    results = list(import_requests(pg_session, rows))
+    assert [result["status"] for result in results] == ["created", "created"]
+
+    # The test runs in one database transaction, whose clock stays at its start
+    created_at = pg_session.scalars(select(Request.created_at).where(Request.id.in_(["T00000000", "T00000001"])))
+    assert set(created_at) == {pg_session.scalar(select(func.localtimestamp()))}
+    assert count() == before + 2
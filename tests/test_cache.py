@@ -0,0 +1,78 @@
+from datetime import date, datetime
+
+import pytest
+
+from app.core import cache
+from app.core.cache import CacheScope, TTLCache, cached_query
+
+SCOPE = CacheScope(datetime(2025, 3, 1), datetime(2025, 3, 5, 12), city_id=1)
+
+
+def test_get_returns_what_was_set():
+    ttl_cache = TTLCache(max_entries=10, ttl=60)
+    assert ttl_cache.get("key") == (False, None)
+    ttl_cache.set("key", {"a": 1}, SCOPE, ttl_cache.generation())
+    assert ttl_cache.get("key") == (True, {"a": 1})
+    assert (ttl_cache.hits, ttl_cache.misses) == (1, 1)
+
+
+def test_get_returns_a_copy():
+    ttl_cache = TTLCache(max_entries=10, ttl=60)
+    value = {"city": {"a": 1}}
+    ttl_cache.set("key", value, SCOPE, ttl_cache.generation())
+    value["city"]["a"] = 2
+    ttl_cache.get("key")[1]["city"]["a"] = 3
+    assert ttl_cache.get("key") == (True, {"city": {"a": 1}})
+
+
+def test_entries_expire():
+    ttl_cache = TTLCache(max_entries=10, ttl=-1)
+    ttl_cache.set("key", 1, SCOPE, ttl_cache.generation())
+    assert ttl_cache.get("key") == (False, None)
+
+
+def test_least_recently_used_entry_is_evicted():
+    ttl_cache = TTLCache(max_entries=2, ttl=60)
+    for key in ("a", "b"):
+        ttl_cache.set(key, key, SCOPE, ttl_cache.generation())
+    ttl_cache.get("a")
+    ttl_cache.set("c", "c", SCOPE, ttl_cache.generation())
+    assert [ttl_cache.get(key)[0] for key in ("a", "b", "c")] == [True, False, True]
+
+
+@pytest.mark.parametrize("change, dropped", [
+    ((date(2025, 3, 3), 1), True),
+    ((date(2025, 3, 5), 1), True),
+    ((date(2025, 3, 6), 1), False),
+    ((date(2025, 3, 3), 2), False),
+])
+def test_invalidate_drops_entries_covering_the_change(change, dropped):
+    ttl_cache = TTLCache(max_entries=10, ttl=60)
+    ttl_cache.set("key", 1, SCOPE, ttl_cache.generation())
+    ttl_cache.invalidate([change])
+    assert ttl_cache.get("key")[0] is not dropped
+
+
+def test_set_is_skipped_after_an_invalidation():
+    ttl_cache = TTLCache(max_entries=10, ttl=60)
+    generation = ttl_cache.generation()
+    ttl_cache.invalidate([(date(2025, 3, 3), 1)])
+    ttl_cache.set("key", 1, SCOPE, generation)
+    assert ttl_cache.get("key") == (False, None)
+
+
+def test_cached_query_does_not_cache_results_computed_across_a_commit(monkeypatch):
+    ttl_cache = TTLCache(max_entries=10, ttl=60)
+    monkeypatch.setattr(cache, "dashboard_cache", ttl_cache)
+    monkeypatch.setitem(cache.DASHBOARD_CACHE_CONFIG, "enabled", True)
+    calls = []
+
+    @cached_query
+    def query(session, start_date, end_date, city=None):
+        calls.append(1)
+        if len(calls) == 1:
+            # A write committed by another session while the query runs
+            ttl_cache.invalidate([(date(2025, 3, 3), 1)])
+        return len(calls)
+
+    assert [query(None, datetime(2025, 3, 1), datetime(2025, 3, 5)) for _ in range(3)] == [1, 2, 2]
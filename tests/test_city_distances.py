@@ -0,0 +1,123 @@
+from contextlib import nullcontext
+
+from app.core import database
+from app.core.city_distances import UNREACHABLE, CityDistances
+
+CITY_IDS = [1, 2, 3, 4, 5]
+ROWS = [(1, 2, 10.0), (1, 3, 5.0), (1, 4, 20.0), (2, 1, 10.0), (3, 1, 5.0)]
+
+
+class FakeResult(list):
+
+    def all(self):
+        return self
+
+
+class FakeSession:
+    """
+    Answers the two queries of CityDistances.load.
+    """
+
+    def __init__(self, city_ids=CITY_IDS, rows=ROWS):
+        self.city_ids, self.rows = city_ids, rows
+        self.loads = 0
+
+    def scalars(self, statement):
+        self.loads += 1
+        return FakeResult(self.city_ids)
+
+    def execute(self, statement):
+        return FakeResult(self.rows)
+
+
+def loaded(session=None, nearest_cities=100) -> CityDistances:
+    distances = CityDistances()
+    distances.load(session or FakeSession(), nearest_cities)
+    return distances
+
+
+def test_distance():
+    distances = loaded()
+    assert distances.distance(1, 3) == 5
+    assert distances.distance(3, 3) == 0
+    assert distances.distance(3, 2) == UNREACHABLE
+    assert distances.distance(1, 99) == UNREACHABLE
+
+
+def test_nearest_cities_start_with_the_city_and_skip_unreachable():
+    assert list(loaded().nearest_cities(1)) == [(1, 0), (3, 5), (2, 10), (4, 20)]
+    assert list(loaded().nearest_cities(5)) == [(5, 0)]
+    assert list(loaded().nearest_cities(99)) == [(99, 0)]
+
+
+def test_nearest_cities_keeps_the_configured_number():
+    assert list(loaded(nearest_cities=3).nearest_cities(1)) == [(1, 0), (3, 5), (2, 10)]
+
+
+def test_stale_matrix_is_reloaded_in_the_background(monkeypatch):
+    distances = loaded()
+    reload_session = FakeSession(rows=[(1, 5, 1.0)])
+    monkeypatch.setattr(database, "SessionLocal", lambda: nullcontext(reload_session))
+    threads = []
+    monkeypatch.setattr("threading.Thread.start", lambda thread: threads.append(thread))
+
+    request_session = FakeSession()
+    distances.invalidate()
+    distances.ensure_loaded(request_session)
+    distances.ensure_loaded(request_session)
+    # One reload at a time, none on the request's session, the old matrix is served until it is done
+    assert len(threads) == 1 and request_session.loads == 0
+    assert distances.distance(1, 5) == UNREACHABLE
+
+    threads[0].run()
+    assert distances.distance(1, 5) == 1
+    distances.ensure_loaded(request_session)
+    assert len(threads) == 1
+
+
+def test_first_load_is_inline():
+    distances = CityDistances()
+    session = FakeSession()
+    distances.ensure_loaded(session)
+    assert session.loads == 1 and distances.distance(1, 2) == 10
+
+
+class InvalidatingSession(FakeSession):
+    """
+    A change to the table is committed while the matrix is being read.
+    """
+
+    def __init__(self, distances):
+        super().__init__()
+        self.distances = distances
+
+    def execute(self, statement):
+        self.distances.invalidate()
+        return super().execute(statement)
+
+
+def test_change_committed_while_loading_is_not_lost():
+    distances = CityDistances()
+    distances.load(InvalidatingSession(distances))
+    assert distances._stale
+
+
+class FailingSession(FakeSession):
+
+    def scalars(self, statement):
+        raise ConnectionError("database is down")
+
+
+def test_failed_reload_waits_for_reload_seconds(monkeypatch):
+    distances = loaded()
+    monkeypatch.setattr(database, "SessionLocal", lambda: nullcontext(FailingSession()))
+    threads = []
+    monkeypatch.setattr("threading.Thread.start", lambda thread: threads.append(thread))
+
+    distances.invalidate()
+    distances.ensure_loaded(FakeSession())
+    threads[0].run()
+    distances.ensure_loaded(FakeSession())
+    # The loaded matrix is kept and the next request does not retry
+    assert len(threads) == 1
+    assert distances.distance(1, 3) == 5
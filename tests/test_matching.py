@@ -0,0 +1,36 @@
+from datetime import datetime
+
+import pytest
+
+from app.core.matching import matching_engine
+from app.core.metrics import count_statements
+from app.models.user import User, UserStatus, Volunteer
+
+
+def _flush_volunteer_changes(session, n):
+    """
+    Change the city of n volunteers whose users are not loaded, flush, and return the statements the
+    flush sent and the matching changes it queued.
+    """
+    volunteers = (session.query(Volunteer).join(User, User.id == Volunteer.user_id)
+                  .filter(User.status_id == UserStatus.APPROVED).limit(n).all())
+    for volunteer in volunteers:
+        volunteer.preferred_city = volunteer.preferred_city % 10 + 1
+    with count_statements() as usage:
+        session.flush()
+    changes = session.info.pop("matching_changes", [])
+    session.rollback()
+    return usage.statements, changes
+
+
+@pytest.fixture
+def loaded_engine(monkeypatch):
+    monkeypatch.setattr(matching_engine, "loaded_at", datetime.now())
+
+
+def test_volunteer_flush_loads_their_users_in_one_query(pg_session, loaded_engine):
+    one, _ = _flush_volunteer_changes(pg_session, 1)
+    many, changes = _flush_volunteer_changes(pg_session, 20)
+    assert many == one
+    assert len(changes) == 20
+    assert all(apply == matching_engine.upsert_volunteer for apply, _ in changes)
@@ -0,0 +1,37 @@
+from datetime import datetime
+
+import pytest
+
+from app.core.pagination import PageParams, decode_cursor, encode_cursor, keyset_page, next_cursor
+from app.models.request import Request
+
+
+def test_cursor_round_trip():
+    key = (datetime(2025, 3, 1, 12, 30, 15, 123456), "123456789")
+    assert decode_cursor(encode_cursor(*key)) == key
+
+
+@pytest.mark.parametrize("cursor", ["", "not a cursor", encode_cursor(datetime(2025, 3, 1), "1")[:-4],
+                                    "WyJub3QgYSBkYXRlIiwgIjEiXQ=="])
+def test_decode_cursor_rejects_malformed_cursors(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+
+def test_next_cursor_is_none_on_the_last_page():
+    rows = [(datetime(2025, 3, 1), "1")]
+    assert next_cursor(rows, PageParams(limit=2), key=lambda row: row) is None
+    assert decode_cursor(next_cursor(rows, PageParams(limit=1), key=lambda row: row)) == rows[0]
+
+
+def test_pages_cover_every_row_once(pg_session):
+    page, seen = PageParams(limit=700), []
+    while True:
+        rows = keyset_page(pg_session.query(Request.created_at, Request.id), Request.created_at, Request.id,
+                           page).all()
+        seen += [row.id for row in rows]
+        cursor = next_cursor(rows, page, key=lambda row: (row.created_at, row.id))
+        if cursor is None:
+            break
+        page = PageParams(page.limit, decode_cursor(cursor))
+    assert len(seen) == len(set(seen)) == pg_session.query(Request).count()
@@ -0,0 +1,39 @@
+import asyncio
+
+import pytest
+
+from app.core.password_hashing import HasherBusy, PasswordHasher, verify_password
+
+PASSWORDS = [f"password{i}" for i in range(5)]
+
+
+@pytest.fixture
+def hasher():
+    hasher = PasswordHasher({"scrypt_n": 16, "scrypt_r": 1, "scrypt_p": 1, "workers": 2, "max_pending": 1,
+                             "queue_timeout_seconds": 0.05})
+    yield hasher
+    hasher.shutdown()
+
+
+def test_hash_many_hashes_a_batch_under_one_slot(hasher):
+    hashes = hasher.hash_many(PASSWORDS)
+    assert [verify_password(password, encoded) for password, encoded in zip(PASSWORDS, hashes)] == [True] * 5
+    # The slot is free again
+    assert hasher.hash("password") is not None
+
+
+def test_ahash_many_hashes_a_batch_under_one_slot(hasher):
+    hashes = asyncio.run(hasher.ahash_many(PASSWORDS))
+    assert [verify_password(password, encoded) for password, encoded in zip(PASSWORDS, hashes)] == [True] * 5
+
+
+def test_hash_many_fails_before_any_work_when_busy(hasher):
+    hasher._slots.acquire()
+    with pytest.raises(HasherBusy):
+        hasher.hash_many(PASSWORDS)
+    # Nothing was submitted, the pool was not even started
+    assert hasher._pool is None
+
+
+def test_hash_many_of_nothing(hasher):
+    assert hasher.hash_many([]) == []
@@ -0,0 +1,77 @@
+"""
+N+1 check: calls every list endpoint against the test database with growing page sizes, serializes the
+result as FastAPI would, and fails if the number of SQL statements grows with the number of rows.
+"""
+import json
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import Response
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy.orm import Session
+
+from app.api.endpoints import requests as request_routes
+from app.api.endpoints import users as user_routes
+from app.api.endpoints.admin import approval_api, dashboard
+from app.core.metrics import count_statements
+from app.core.pagination import PageParams
+from app.models.request import Request
+from app.models.user import User, UserStatus, Volunteer
+
+PAGE_SIZES = (1, 10, 100)
+
+
+def _open_request(session: Session) -> str:
+    return session.query(Request.id).filter(Request.status == 1).limit(1).scalar()
+
+
+def _approved_volunteer(session: Session) -> str:
+    return (session.query(Volunteer.user_id).join(User, User.id == Volunteer.user_id)
+            .filter(User.status_id == UserStatus.APPROVED).limit(1).scalar())
+
+
+def _completion_times(session: Session, n: int):
+    end = datetime.now()
+    return dashboard.get_request_completion_time((end - timedelta(days=365)).isoformat(), end.isoformat(),
+                                                 mode="raw", group_by=[], limit=n, after=None, db=session)
+
+
+LIST_ENDPOINTS = {
+    "GET /users/": lambda s, n: user_routes.read_user(PageParams(n), s),
+    "GET /admin/approval/all_users": lambda s, n: approval_api.get_all_users(PageParams(n), s),
+    "GET /admin/approval/unapproved": lambda s, n: approval_api.get_unapproved_users(PageParams(n), s),
+    "GET /api/request": lambda s, n: request_routes.read_all_requests(None, PageParams(n), s),
+    "GET /api/requests/": lambda s, n: request_routes.get_requests(PageParams(n), s),
+    "GET /api/matches/requests/{id}": lambda s, n: request_routes.get_request_matches(_open_request(s), n, db=s),
+    "GET /api/matches/volunteers/{id}": lambda s, n: request_routes.get_volunteer_matches(_approved_volunteer(s),
+                                                                                           n, db=s),
+    "GET /admin/dashboard/request-completion-time?mode=raw": _completion_times,
+}
+
+
+def _rows(result) -> int:
+    if isinstance(result, dict):
+        # Pages carry their rows under "items", completion times under "completion_times"
+        result = result.get("items", result.get("completion_times", ()))
+    return len(result)
+
+
+@pytest.mark.parametrize("name", LIST_ENDPOINTS)
+def test_statements_do_not_grow_with_page_size(pg_session, name):
+    endpoint = LIST_ENDPOINTS[name]
+    # Loads the reference data and the matching engine, which are not part of the per-call cost
+    endpoint(pg_session, 1)
+    pg_session.rollback()
+    counts, rows = [], []
+    for size in PAGE_SIZES:
+        with count_statements() as usage:
+            # Serializing may touch lazy relationships, so it has to be inside the count. Routes with
+            # large results render their response themselves, the others are encoded by FastAPI
+            result = endpoint(pg_session, size)
+            result = json.loads(result.body) if isinstance(result, Response) else jsonable_encoder(result)
+        pg_session.rollback()
+        counts.append(usage.statements)
+        rows.append(_rows(result))
+    if rows[-1] <= rows[0]:
+        pytest.skip(f"the test database has too few rows to tell, {rows} rows")
+    assert counts[-1] == counts[0], f"{rows} rows took {counts} statements"
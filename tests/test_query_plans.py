@@ -0,0 +1,114 @@
+"""
+Query plan regression check: runs the hot queries of the app against the test database, EXPLAINs every
+statement they issue and fails if any of them reads one of the large tables with a sequential scan.
+
+Sequential scans are disabled while planning (enable_seqscan = off), so one only shows up when no index
+can serve the query at all, whatever the size of the seeded data.
+"""
+import json
+from datetime import datetime, timedelta
+from typing import Callable, List, Tuple
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.core import requests_db
+from app.core.admin_approval import unapproved_users
+from app.core.adminview_db import dashboard_summary, request_completion_stats, request_completion_time
+from app.core.email_outbox import EmailDispatcher
+from app.core.matching import MatchingEngine
+from app.core.pagination import PageParams
+from app.core.reference_data import reference_data
+from app.core.users_db import get_users_page, get_users_with_profiles
+from app.models.user import User
+
+# Tables that grow with usage, a sequential scan on any of them is a regression
+LARGE_TABLES = {"requests", "request_process", "users", "families", "volunteers", "email_outbox",
+                "request_daily_rollup"}
+
+FIRST_PAGE = PageParams(100, None)
+
+
+def _days_ago(days: float) -> datetime:
+    return datetime.now() - timedelta(days=days)
+
+
+def _second_users_page(session: Session) -> PageParams:
+    newest = session.query(User.created_at, User.id).order_by(User.created_at.desc(), User.id.desc()).first()
+    return PageParams(100, tuple(newest) if newest else None)
+
+
+HOT_QUERIES = {
+    "dashboard summary, today": lambda s: dashboard_summary(s, datetime.now().replace(hour=0, minute=0),
+                                                            datetime.now()),
+    "dashboard summary, 90 days": lambda s: dashboard_summary(s, _days_ago(90.25), datetime.now()),
+    "dashboard summary, city filter": lambda s: dashboard_summary(s, _days_ago(7), datetime.now(),
+                                                                  city=reference_data.name_of("cities", 1)),
+    "completion stats by city": lambda s: request_completion_stats(s, _days_ago(30), datetime.now(),
+                                                                   group_by=("city",)),
+    "completion stats, type filter": lambda s: request_completion_stats(
+        s, _days_ago(30), datetime.now(), request_type=reference_data.name_of("request_types", 1)),
+    "completion times page": lambda s: request_completion_time(s, _days_ago(30), datetime.now(), limit=100),
+    "matched requests page": lambda s: requests_db.get_matched_requests(s, FIRST_PAGE),
+    "requests page": lambda s: requests_db.get_requests(s, page=FIRST_PAGE),
+    "request by id": lambda s: requests_db.get_requests(s, "R00000001"),
+    "users page": lambda s: get_users_with_profiles(s, FIRST_PAGE),
+    "users second page": lambda s: get_users_page(s, _second_users_page(s)),
+    "approval queue page": lambda s: unapproved_users(s, FIRST_PAGE),
+    "user by email": lambda s: User.get_user_by_email(s, "f1@example.com"),
+    "matching engine load": lambda s: MatchingEngine().load(s),
+    "email outbox claim": lambda s: EmailDispatcher(lambda: s).claim(s),
+}
+
+
+def _scans(plan: dict):
+    """
+    Yield (node type, relation, index) for every scan node of an EXPLAIN (FORMAT JSON) plan.
+    """
+    if "Relation Name" in plan:
+        yield plan["Node Type"], plan["Relation Name"], plan.get("Index Name")
+    for child in plan.get("Plans", ()):
+        yield from _scans(child)
+
+
+def capture_statements(session: Session, fn: Callable[[Session], object]) -> List[Tuple[str, object]]:
+    """
+    Run fn and return the (statement, parameters) of the SELECTs it sent, rolling back anything it wrote.
+    """
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(("SELECT", "WITH")):
+            statements.append((statement, parameters))
+
+    engine = session.get_bind().engine
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        fn(session)
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+        session.rollback()
+    return statements
+
+
+def explain(session: Session, statement: str, parameters) -> dict:
+    cursor = session.connection().connection.cursor()
+    try:
+        cursor.execute("SET LOCAL enable_seqscan = off")
+        cursor.execute("EXPLAIN (FORMAT JSON) " + statement, parameters)
+        plan = cursor.fetchone()[0]
+    finally:
+        cursor.close()
+    session.rollback()
+    return (json.loads(plan) if isinstance(plan, str) else plan)[0]["Plan"]
+
+
+@pytest.mark.parametrize("name", HOT_QUERIES)
+def test_hot_query_does_not_scan_large_tables(pg_session, name):
+    reference_data.load(pg_session)
+    statements = capture_statements(pg_session, HOT_QUERIES[name])
+    assert statements
+    scans = [scan for statement, parameters in statements for scan in _scans(explain(pg_session, statement,
+                                                                                      parameters))]
+    assert not {relation for node, relation, _ in scans if node == "Seq Scan" and relation in LARGE_TABLES}
@@ -0,0 +1,83 @@
+import asyncio
+
+import orjson
+from sqlalchemy import select
+
+from app.core import request_feed as feed_module
+from app.core.request_feed import RequestFeed, _Subscriber, request_event
+from app.models.request import Request
+from app.models.user import City
+
+
+def _subscribe(feed: RequestFeed, city: int, skill: int) -> _Subscriber:
+    subscriber = _Subscriber(city, skill)
+    feed._subscribers.add(subscriber)
+    feed._by_city[city].add(subscriber)
+    feed._by_skill[skill].add(subscriber)
+    return subscriber
+
+
+def _received(subscriber: _Subscriber):
+    """
+    The match percentages of the request events queued for subscriber.
+    """
+    matches = []
+    while not subscriber.queue.empty():
+        data = subscriber.queue.get_nowait().split(b"\ndata: ")[1]
+        matches.append(orjson.loads(data)["match_percentage"])
+    return matches
+
+
+REQUEST = {"id": "R00000001", "request_type": 2, "city": 1, "status": 1, "is_urgent": False,
+           "requires_vehicle": False, "description": "", "created_at": None}
+
+
+def test_dispatch_reaches_the_volunteers_of_the_city_or_type():
+    feed = RequestFeed()
+    both, city_only, type_only, neither = (_subscribe(feed, 1, 2), _subscribe(feed, 1, 3), _subscribe(feed, 4, 2),
+                                           _subscribe(feed, 4, 3))
+    feed._dispatch(None, 0, "request_feed", request_event("upsert", REQUEST).decode())
+    assert [_received(s) for s in (both, city_only, type_only, neither)] == [[100], [50], [50], []]
+
+
+def test_dispatch_of_a_moved_request_reaches_its_previous_volunteers():
+    feed = RequestFeed()
+    old_city, new_city = _subscribe(feed, 5, 3), _subscribe(feed, 1, 3)
+    payload = request_event("upsert", REQUEST, previous={"city": 5, "request_type": 2})
+    feed._dispatch(None, 0, "request_feed", payload.decode())
+    assert [_received(s) for s in (old_city, new_city)] == [[0], [50]]
+
+
+def test_flushed_change_carries_the_previous_city(pg_session, monkeypatch):
+    published = []
+    monkeypatch.setattr(feed_module, "publish_request_changes",
+                        lambda session, events: published.extend(orjson.loads(event) for event in events))
+    request = pg_session.scalars(select(Request).limit(1)).one()
+    old_city = request.city
+    new_city = pg_session.scalars(select(City.id).where(City.id != old_city).limit(1)).one()
+    request.city = new_city
+    pg_session.flush()
+    assert published == [{"op": "upsert", "request": published[0]["request"],
+                          "previous": {"city": old_city, "request_type": request.request_type}}]
+    assert published[0]["request"]["city"] == new_city
+
+
+def test_listener_survives_unexpected_errors(monkeypatch):
+    attempts = []
+
+    async def connect(url):
+        attempts.append(url)
+        raise RuntimeError("unexpected")
+
+    monkeypatch.setattr(feed_module.asyncpg, "connect", connect)
+    monkeypatch.setitem(feed_module.FEED_CONFIG, "reconnect_seconds", 0.01)
+
+    async def run():
+        feed = RequestFeed()
+        feed._ensure_listening()
+        await asyncio.sleep(0.1)
+        assert not feed._listener.done()
+        await feed.close()
+
+    asyncio.run(run())
+    assert len(attempts) > 1
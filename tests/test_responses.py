@@ -0,0 +1,78 @@
+import pytest
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse, StreamingResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from app.core.responses import CompressionMiddleware, _accepted_encodings
+
+BODY = "x" * 1000
+
+
+@pytest.mark.parametrize("header, accepted", [
+    ("", {""}),
+    ("gzip", {"gzip"}),
+    ("gzip, deflate, br", {"gzip", "deflate", "br"}),
+    ("br;q=0, gzip;q=0.5", {"gzip"}),
+    ("BR; q=1.0, identity", {"br", "identity"}),
+    ("gzip;q=nonsense", {"gzip"}),
+])
+def test_accepted_encodings(header, accepted):
+    assert _accepted_encodings(header) == accepted
+
+
+async def _large(request):
+    return PlainTextResponse(BODY)
+
+
+async def _small(request):
+    return PlainTextResponse("small")
+
+
+async def _streamed(request):
+    async def chunks():
+        for _ in range(3):
+            yield BODY
+
+    return StreamingResponse(chunks(), media_type="text/plain")
+
+
+async def _events(request):
+    async def events():
+        yield "data: " + BODY + "\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@pytest.fixture
+def client():
+    app = Starlette(routes=[Route("/large", _large), Route("/small", _small), Route("/streamed", _streamed),
+                            Route("/events", _events)])
+    app.add_middleware(CompressionMiddleware, config={"compression_min_bytes": 500, "gzip_level": 6,
+                                                      "brotli_quality": 4})
+    return TestClient(app)
+
+
+@pytest.mark.parametrize("accept, encoding", [("br, gzip", "br"), ("gzip", "gzip"), ("deflate", None)])
+def test_large_responses_are_compressed(client, accept, encoding):
+    if encoding == "br":
+        pytest.importorskip("brotli")
+    response = client.get("/large", headers={"Accept-Encoding": accept})
+    assert response.headers.get("Content-Encoding") == encoding
+    assert response.text == BODY
+
+
+@pytest.mark.parametrize("accept", ["br", "gzip"])
+def test_streamed_responses_are_compressed_chunk_by_chunk(client, accept):
+    if accept == "br":
+        pytest.importorskip("brotli")
+    response = client.get("/streamed", headers={"Accept-Encoding": accept})
+    assert response.headers["Content-Encoding"] == accept
+    assert "Content-Length" not in response.headers
+    assert response.text == BODY * 3
+
+
+@pytest.mark.parametrize("path", ["/small", "/events"])
+def test_small_responses_and_event_streams_are_not_compressed(client, path):
+    response = client.get(path, headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in response.headers
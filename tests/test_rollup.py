@@ -0,0 +1,97 @@
+from datetime import date, datetime
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.core.metrics import count_statements
+from app.core.rollup import NO_STATUS, collect_deltas, completed_days, completed_status_id, database_today, full_days
+from app.models.request import Request, RequestDailyRollup, RequestProcess
+
+TODAY = date(2025, 3, 10)
+
+
+def test_full_days_skips_partial_first_day():
+    assert full_days(datetime(2025, 3, 1, 12), datetime(2025, 3, 5, 23, 59), TODAY) == (date(2025, 3, 2),
+                                                                                        date(2025, 3, 4))
+
+
+def test_full_days_keeps_first_day_from_midnight():
+    assert full_days(datetime(2025, 3, 1), datetime(2025, 3, 5, 12), TODAY) == (date(2025, 3, 1), date(2025, 3, 4))
+
+
+def test_full_days_never_includes_today():
+    assert full_days(datetime(2025, 3, 1), datetime(2025, 3, 20), TODAY) == (date(2025, 3, 1), date(2025, 3, 9))
+
+
+def test_full_days_none_within_a_day():
+    assert full_days(datetime(2025, 3, 1, 8), datetime(2025, 3, 1, 20), TODAY) is None
+    assert full_days(datetime(2025, 3, 10), datetime(2025, 3, 10, 20), TODAY) is None
+
+
+def test_collect_deltas_counts_new_requests_on_their_day():
+    session = Session()
+    session.add_all([
+        Request(id="1", city=1, request_type=2, status=1, created_at=datetime(2025, 3, 1, 9)),
+        Request(id="2", city=1, request_type=2, status=1, created_at=datetime(2025, 3, 1, 18)),
+        Request(id="3", city=1, request_type=2, status=None, created_at=datetime(2025, 3, 2)),
+        # Not counted until the database has set created_at
+        Request(id="4", city=1, request_type=2, status=1),
+    ])
+    assert collect_deltas(session) == {
+        (date(2025, 3, 1), 1, 2, 1): 2,
+        (date(2025, 3, 2), 1, 2, NO_STATUS): 1,
+    }
+
+
+def test_collect_deltas_moves_changed_request(pg_session):
+    request = pg_session.scalars(select(Request).where(Request.created_at.isnot(None)).limit(1)).one()
+    old_city, day = request.city, request.created_at.date()
+    request.city = -old_city
+    assert collect_deltas(pg_session) == {
+        (day, old_city, request.request_type, request.status or NO_STATUS): -1,
+        (day, -old_city, request.request_type, request.status or NO_STATUS): 1,
+    }
+
+
+def test_new_request_is_counted_on_the_database_day(pg_session):
+    template = pg_session.scalars(select(Request).limit(1)).one()
+    key = {"day": database_today(pg_session), "city": template.city, "request_type": template.request_type,
+           "status": 1}
+
+    def count():
+        return pg_session.scalar(select(RequestDailyRollup.request_count).filter_by(**key)) or 0
+
+    before = count()
+    pg_session.add(Request(id="T00000001", family_id=template.family_id, city=template.city,
+                           request_type=template.request_type, status=1))
+    pg_session.flush()
+    assert count() == before + 1
+
+
+def _complete(session, n):
+    completed = completed_status_id(session)
+    processes = (session.query(RequestProcess)
+                 .filter(RequestProcess.status != completed, RequestProcess.completed_at.is_(None))
+                 .limit(n).all())
+    for process in processes:
+        process.status, process.completed_at = completed, datetime.now()
+    return processes
+
+
+def test_completion_flush_loads_the_requests_in_one_query(pg_session):
+    def flush_completions(n):
+        _complete(pg_session, n)
+        with count_statements() as usage:
+            pg_session.flush()
+        pg_session.rollback()
+        return usage.statements
+
+    assert flush_completions(20) == flush_completions(1)
+
+
+def test_completions_only_invalidate_the_days_of_their_requests(pg_session):
+    processes = _complete(pg_session, 3)
+    with pg_session.no_autoflush:
+        requests = [pg_session.get(Request, process.request_id) for process in processes]
+        assert collect_deltas(pg_session) == {}
+        assert completed_days(pg_session) == {(request.created_at.date(), request.city) for request in requests}
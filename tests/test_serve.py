@@ -0,0 +1,49 @@
+import pytest
+
+from app.core.config import DB_POOL_CONFIG, REPLICA_CONFIG
+from app.serve import worker_environment
+
+CONFIG = {"db_connections": 60}
+
+
+@pytest.fixture(autouse=True)
+def pool_config(monkeypatch):
+    monkeypatch.setitem(DB_POOL_CONFIG, "pool_size", 5)
+    monkeypatch.setitem(DB_POOL_CONFIG, "max_overflow", 10)
+    monkeypatch.setitem(REPLICA_CONFIG, "url", None)
+
+
+def test_connections_are_split_between_the_workers_engines():
+    environment = worker_environment(3, 6, CONFIG, environ={})
+    # 60 connections, 3 workers with a sync and an async engine each
+    assert environment == {"DB_POOL_SIZE": "5", "DB_MAX_OVERFLOW": "5", "PASSWORD_HASHING_WORKERS": "2"}
+
+
+def test_replica_engines_get_a_share(monkeypatch):
+    monkeypatch.setitem(REPLICA_CONFIG, "url", "postgresql://replica/db")
+    environment = worker_environment(3, 6, CONFIG, environ={})
+    assert (environment["DB_POOL_SIZE"], environment["DB_MAX_OVERFLOW"]) == ("5", "0")
+
+
+def test_small_share_lowers_the_pool_size():
+    environment = worker_environment(10, 6, CONFIG, environ={})
+    assert (environment["DB_POOL_SIZE"], environment["DB_MAX_OVERFLOW"]) == ("3", "0")
+
+
+def test_explicit_settings_are_kept():
+    environ = {"DB_POOL_SIZE": "5", "DB_MAX_OVERFLOW": "2", "PASSWORD_HASHING_WORKERS": "1"}
+    assert worker_environment(3, 6, CONFIG, environ) == {"DB_POOL_SIZE": "5", "DB_MAX_OVERFLOW": "2"}
+
+
+def test_explicit_pool_size_leaves_the_rest_to_the_overflow():
+    environment = worker_environment(3, 6, CONFIG, environ={"DB_POOL_SIZE": "5"})
+    assert (environment["DB_POOL_SIZE"], environment["DB_MAX_OVERFLOW"]) == ("5", "5")
+
+
+def test_explicit_settings_over_the_share_fail():
+    with pytest.raises(ValueError, match="DB_MAX_OVERFLOW=10"):
+        worker_environment(3, 6, CONFIG, environ={"DB_MAX_OVERFLOW": "10"})
+
+
+def test_no_connection_limit():
+    assert worker_environment(3, 6, {"db_connections": 0}, environ={}) == {"PASSWORD_HASHING_WORKERS": "2"}
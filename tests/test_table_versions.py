@@ -0,0 +1,41 @@
+import pytest
+from sqlalchemy import select
+
+from app.core.table_versions import current_versions, etag_matches
+from app.models.request import Request
+
+ETAG = 'W/"0123456789abcdef0123"'
+
+
+@pytest.mark.parametrize("if_none_match, matches", [
+    (None, False),
+    ("", False),
+    ("*", True),
+    (ETAG, True),
+    (ETAG.removeprefix("W/"), True),
+    (f'"other", {ETAG}', True),
+    ('W/"other"', False),
+])
+def test_etag_matches(if_none_match, matches):
+    assert etag_matches(if_none_match, ETAG) is matches
+
+
+def _requests_version(pg_engine) -> int:
+    # Through a connection of its own, as another worker would see it
+    with pg_engine.connect() as connection:
+        return current_versions(connection, ["requests"])[0]
+
+
+@pytest.mark.parametrize("commit", [True, False])
+def test_versions_are_bumped_after_the_commit_only(pg_session, pg_engine, commit):
+    before = _requests_version(pg_engine)
+    request = pg_session.scalars(select(Request).limit(1)).one()
+    request.description = (request.description or "") + "."
+    pg_session.flush()
+    # Writers of the same table do not wait on each other for the version row
+    assert _requests_version(pg_engine) == before
+    if commit:
+        pg_session.commit()
+    else:
+        pg_session.rollback()
+    assert _requests_version(pg_engine) == before + commit